@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.sitegen import add_site_arguments, generate_site, serve_site
+
+START_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "start.py")
+
+
+def run_crawl(
+        url: str,
+        query: str,
+        workdir: str,
+        crawler_args: list[str]
+) -> dict:
+    """Run start.py against the URL in the working directory and measure it"""
+    os.makedirs(workdir, exist_ok=True)
+    command = [sys.executable, START_SCRIPT, '-u', url, '-d', 'any', '-q', query, *crawler_args]
+    started = time.monotonic()
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # The resource usage of the crawler process only, browsers are separate processes
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.monotonic() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    metrics_filepath = os.path.join(workdir, "results", "metrics.json")
+    metrics = {}
+    if os.path.isfile(metrics_filepath):
+        with open(metrics_filepath, encoding='utf-8') as file:
+            metrics = json.load(file)
+    gauges = metrics.get('gauges', {})
+    crawl_time = metrics.get('uptime') or wall_time
+    processed = gauges.get('processed_count', 0)
+    renders = sum(counters.get('renders', 0) for counters in metrics.get('hosts', {}).values())
+
+    with open(os.path.join(workdir, "results", "result.txt"), encoding='utf-8') as file:
+        matched_pages = sum(1 for line in file if line.strip())
+
+    # Linux reports the peak in kilobytes, macOS in bytes
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return {
+        'exit_code': process.returncode,
+        'wall_time': round(wall_time, 3),
+        'crawl_time': round(crawl_time, 3),
+        'pages': processed,
+        'pages_per_second': round(processed / crawl_time, 2),
+        'renders': renders,
+        'renders_per_second': round(renders / crawl_time, 2),
+        'peak_rss_mb': round(peak_rss / 1024 / 1024, 1),
+        'time_to_first_match': gauges.get('first_match_seconds'),
+        'matched_pages': matched_pages,
+    }
+
+
+def summarize(
+        runs: list[dict]
+) -> dict:
+    """Get the medians of the numeric results of the runs"""
+    summary = {}
+    for name, value in runs[0].items():
+        values = [run[name] for run in runs if run[name] is not None]
+        if isinstance(value, (int, float)) and values:
+            summary[name] = statistics.median(values)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the crawler against a generated site served locally. "
+                    "Arguments after -- are passed to start.py.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    add_site_arguments(parser)
+    parser.add_argument('--browser', default='stub', help="browser rendering the pages")
+    parser.add_argument('--browsers', type=int, default=4, help="number of browsers rendering pages in parallel")
+    parser.add_argument('--render', default='auto', help="when to render pages in a browser")
+    parser.add_argument('--concurrency', type=int, default=16, help="maximum number of concurrent requests")
+    parser.add_argument('--host_concurrency', type=int, default=16,
+                        help="maximum number of concurrent requests per host (the site is a single host)")
+    parser.add_argument('--repeat', type=int, default=3, help="number of runs")
+    parser.add_argument('--output', default=None, help="file to write the results to (JSON)")
+    parser.add_argument('--keep', action='store_true', help="keep the generated site and the results of the runs")
+    args, extra_args = parser.parse_known_args()
+    if extra_args and extra_args[0] == '--':
+        extra_args = extra_args[1:]
+
+    folder = tempfile.mkdtemp(prefix='sherlock-benchmark-')
+    site_folder = os.path.join(folder, "site")
+    manifest = generate_site(
+        site_folder, args.fanout, args.depth, args.page_size, args.js_share,
+        args.matches, args.match_placement, args.query, args.cross_links, args.seed
+    )
+    server = serve_site(site_folder)
+    url = f"http://127.0.0.1:{server.server_address[1]}/index.html"
+    print(f"Site: {manifest['pages']} pages, {manifest['js_pages']} need rendering, "
+          f"{len(manifest['match_pages'])} with matches ({url})")
+
+    crawler_args = [
+        '--browser', args.browser,
+        '--browsers', str(args.browsers),
+        '--render', args.render,
+        '--concurrency', str(args.concurrency),
+        '--host_concurrency', str(args.host_concurrency),
+        *extra_args,
+    ]
+    runs = []
+    try:
+        for index in range(args.repeat):
+            result = run_crawl(url, args.query, os.path.join(folder, f"run_{index}"), crawler_args)
+            runs.append(result)
+            print(f"Run {index + 1}: " + ', '.join(f"{name}={value}" for name, value in result.items()))
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    summary = summarize(runs)
+    print("Median: " + ', '.join(f"{name}={value}" for name, value in summary.items()))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'site': manifest, 'args': crawler_args, 'runs': runs, 'median': summary}, file, indent=2)
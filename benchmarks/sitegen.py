@@ -0,0 +1,186 @@
+import argparse
+import base64
+import functools
+import json
+import os
+import random
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+MATCH_PLACEMENTS = ('leaf', 'shallow', 'uniform', 'last')
+
+FILLER_TEXT = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt "
+    "ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation. "
+)
+
+
+def get_page_filename(
+        page_id: int
+) -> str:
+    """Get the file name of the page"""
+    return "index.html" if page_id == 0 else f"p{page_id}.html"
+
+
+def get_filler(
+        size: int
+) -> str:
+    """Get paragraphs of filler text of about the size (in bytes)"""
+    paragraph = f"<p>{FILLER_TEXT}</p>\n"
+    return paragraph * max(0, size // len(paragraph))
+
+
+def pick_match_pages(
+        depths: list[int],
+        matches: int,
+        placement: str,
+        rng: random.Random
+) -> list[int]:
+    """Pick the pages the query matches are planted in"""
+    max_depth = max(depths)
+    if placement == 'leaf':
+        candidates = [page_id for page_id, depth in enumerate(depths) if depth == max_depth]
+    elif placement == 'shallow':
+        candidates = [page_id for page_id, depth in enumerate(depths) if depth == min(1, max_depth)]
+    elif placement == 'last':
+        return list(range(len(depths)))[-matches:] if matches else []
+    else:
+        candidates = list(range(len(depths)))
+    return rng.sample(candidates, min(matches, len(candidates)))
+
+
+def generate_site(
+        folder: str,
+        fanout: int = 5,
+        depth: int = 3,
+        page_size: int = 8,
+        js_share: float = 0.0,
+        matches: int = 1,
+        match_placement: str = 'leaf',
+        query: str = 'analytics.js',
+        cross_links: int = 2,
+        seed: int = 0
+) -> dict:
+    """Generate a synthetic site graph into the folder and return its manifest
+
+    The pages form a tree with `fanout` children per page down to `depth`,
+    plus `cross_links` random links per page. `js_share` of the pages keep
+    their content in a base64 `data-render` attribute of an empty SPA root,
+    so their links are found only after rendering (by a browser running the
+    inline script or by the stub driver). The query is planted as a script
+    url in `matches` pages picked by `match_placement`.
+    """
+    if match_placement not in MATCH_PLACEMENTS:
+        raise ValueError(f"Unknown match placement: {match_placement}")
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+
+    # Breadth-first numbering of the tree pages
+    depths = [0]
+    children = {0: []}
+    level = [0]
+    for current_depth in range(1, depth + 1):
+        next_level = []
+        for parent_id in level:
+            for _ in range(fanout):
+                page_id = len(depths)
+                depths.append(current_depth)
+                children[parent_id].append(page_id)
+                children[page_id] = []
+                next_level.append(page_id)
+        level = next_level
+
+    pages = len(depths)
+    js_pages = set(rng.sample(range(1, pages), int(js_share * (pages - 1)))) if pages > 1 else set()
+    match_pages = set(pick_match_pages(depths, matches, match_placement, rng))
+
+    for page_id in range(pages):
+        links = children[page_id] + [rng.randrange(pages) for _ in range(cross_links if pages > 1 else 0)]
+        content = ''.join(f'<a href="/{get_page_filename(link)}">Page {link}</a>\n' for link in links)
+        if page_id in match_pages:
+            content += f'<script src="/static/{query}"></script>\n'
+        content += get_filler(page_size * 1024 - len(content))
+
+        if page_id in js_pages:
+            encoded = base64.b64encode(content.encode('utf-8')).decode('ascii')
+            body = (
+                f'<div id="root" data-render="{encoded}"></div>\n'
+                '<script>var root = document.getElementById("root"); '
+                'root.innerHTML = atob(root.dataset.render);</script>\n'
+            )
+        else:
+            body = content
+        with open(os.path.join(folder, get_page_filename(page_id)), 'w', encoding='utf-8') as file:
+            file.write(f"<!DOCTYPE html>\n<html><head><title>Page {page_id}</title></head>\n"
+                       f"<body>\n{body}</body></html>\n")
+
+    manifest = {
+        'pages': pages,
+        'js_pages': len(js_pages),
+        'match_pages': sorted(match_pages),
+        'query': query,
+        'fanout': fanout,
+        'depth': depth,
+        'page_size': page_size,
+        'cross_links': cross_links,
+        'seed': seed,
+    }
+    with open(os.path.join(folder, "manifest.json"), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Static file handler, that does not log every request"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_site(
+        folder: str,
+        port: int = 0
+) -> ThreadingHTTPServer:
+    """Serve the folder on 127.0.0.1 from a background thread (port 0 picks a free one)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), functools.partial(QuietHandler, directory=folder))
+    threading.Thread(target=server.serve_forever, name='BenchmarkServer', daemon=True).start()
+    return server
+
+
+def add_site_arguments(
+        parser: argparse.ArgumentParser
+) -> None:
+    """Add the arguments of the site generator to the parser"""
+    parser.add_argument('--fanout', type=int, default=5, help="links to child pages per page")
+    parser.add_argument('--depth', type=int, default=3, help="depth of the page tree")
+    parser.add_argument('--page_size', type=int, default=8, help="size of a page (in kilobytes)")
+    parser.add_argument('--js_share', type=float, default=0.0,
+                        help="share of pages, that need rendering to find their links")
+    parser.add_argument('--matches', type=int, default=1, help="amount of pages with a query match")
+    parser.add_argument('--match_placement', choices=MATCH_PLACEMENTS, default='leaf',
+                        help="pages the matches are planted in: deepest, first level, random or last ones")
+    parser.add_argument('--query', default='analytics.js', help="query planted into the pages")
+    parser.add_argument('--cross_links', type=int, default=2, help="random links to any page per page")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random generator")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic site generator",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('folder', help="folder to generate the site into")
+    add_site_arguments(parser)
+    parser.add_argument('--serve', type=int, default=None, metavar='PORT', help="serve the site after generating")
+    args = parser.parse_args()
+
+    manifest = generate_site(
+        args.folder, args.fanout, args.depth, args.page_size, args.js_share,
+        args.matches, args.match_placement, args.query, args.cross_links, args.seed
+    )
+    print(json.dumps(manifest))
+    if args.serve is not None:
+        server = serve_site(args.folder, args.serve)
+        print(f"Serving on http://127.0.0.1:{server.server_address[1]}/index.html")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
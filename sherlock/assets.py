@@ -0,0 +1,23 @@
+import posixpath
+from urllib.parse import urlparse
+
+from scrapy.http import Response
+
+# Non-HTML resources, that are only searched for the query and never crawled as pages
+ASSET_EXTENSIONS = ('.js', '.mjs', '.cjs', '.css', '.json')
+ASSET_CONTENT_TYPES = ('javascript', 'ecmascript', 'text/css', 'json')
+
+
+def is_asset_url(
+        url: str
+) -> bool:
+    """Check if the URL points to an asset by its extension"""
+    return posixpath.splitext(urlparse(url).path)[1].lower() in ASSET_EXTENSIONS
+
+
+def is_asset_response(
+        response: Response
+) -> bool:
+    """Check if the response is an asset by its content type"""
+    content_type = (response.headers.get('Content-Type') or b'').decode('latin-1').lower()
+    return any(asset_type in content_type for asset_type in ASSET_CONTENT_TYPES)
@@ -0,0 +1,245 @@
+import logging
+import math
+import queue
+import threading
+import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import urlparse
+
+from twisted.internet import reactor, threads
+from twisted.internet.defer import Deferred
+from twisted.python.threadpool import ThreadPool
+
+from sherlock.extraction import EXTRACT_SCRIPT
+from sherlock.metrics import Metrics
+from sherlock.readiness import READY_SCRIPT, AdaptiveTimeouts
+
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+
+class BrowserUnavailableError(RuntimeError):
+    """No driver of the browser pool could be started"""
+
+
+class BrowserPool:
+    """Pool of Selenium drivers, that render pages on worker threads
+
+    Each worker thread borrows one driver for the duration of a render,
+    so up to `size` pages are rendered in parallel while the reactor keeps
+    downloading and scheduling requests.
+    The drivers are started on the worker threads, so starting them overlaps
+    with the downloads: right away with `start(warm=True)`, or on the first
+    render otherwise (a crawl, that renders nothing, starts no browser).
+
+    A page is extracted once it is ready by the `readiness` strategy, that
+    is awaited in the page by `READY_SCRIPT`. Its load and readiness share
+    the adaptive timeout of its host, and a page, that timed out, is
+    stopped and its partial DOM is extracted.
+
+    A driver, that fails to start, is retried, and then its slot is dropped,
+    so the renders go to the other drivers. A driver, that fails a render
+    with an error other than a timeout (e.g. its browser crashed), is quit
+    and a new one is started in its slot. Once all slots are dropped, the
+    pool is not `available` and every render fails with `BrowserUnavailableError`.
+    """
+
+    # Minimum time left to the readiness strategy after a slow load, and the margin of the script timeout
+    MIN_READY_TIMEOUT = 0.5
+    SCRIPT_TIMEOUT_MARGIN = 5.0
+
+    # Attempts to start a driver and the delay between them
+    START_ATTEMPTS = 2
+    START_RETRY_DELAY = 1.0
+
+    def __init__(
+            self,
+            driver_factory: Callable[[], 'WebDriver'],
+            size: int = 1,
+            metrics: Optional[Metrics] = None,
+            timeout_errors: tuple[type[Exception], ...] = (TimeoutError,),
+            readiness: tuple[str, Optional[object]] = ('load', None),
+            max_timeout: float = 10.0
+    ) -> None:
+        self.size = max(1, size)
+        self.metrics = metrics
+        self.timeout_errors = timeout_errors
+        self.readiness = readiness
+        self.timeouts = AdaptiveTimeouts(max_timeout)
+        # Page load timeouts set in the drivers and the URLs of their last pages
+        self.driver_timeouts: dict[int, float] = {}
+        self.driver_urls: dict[int, str] = {}
+        # Utilisation of the pool: renders in progress and total time of the finished ones
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self.driver_factory = driver_factory
+        self.drivers: list['WebDriver'] = []
+        self.idle_drivers: queue.Queue = queue.Queue()
+        self.threadpool = ThreadPool(minthreads=self.size, maxthreads=self.size, name='BrowserPool')
+        self.started = False
+        self.available = True
+        self.failed_drivers = 0
+
+    def start(
+            self,
+            warm: bool = False
+    ) -> None:
+        """Start the worker threads, and the drivers on them if the pool is warm"""
+        self.threadpool.start()
+        if warm:
+            self.start_drivers()
+
+    def start_drivers(
+            self
+    ) -> None:
+        """Start the drivers on the worker threads (once)"""
+        if self.started:
+            return
+        self.started = True
+        for _ in range(self.size):
+            self.threadpool.callInThread(self._start_driver)
+
+    def _start_driver(
+            self
+    ) -> None:
+        """Start a driver and make it idle (or drop its slot, if it can not be started)"""
+        for attempt in range(1, self.START_ATTEMPTS + 1):
+            try:
+                driver = self.driver_factory()
+                driver.set_script_timeout(self.timeouts.max_timeout + self.SCRIPT_TIMEOUT_MARGIN)
+                break
+            except Exception as error:
+                logging.log(logging.WARNING,
+                            f"Failed to start driver (attempt {attempt}/{self.START_ATTEMPTS}): {error!r}")
+                if attempt < self.START_ATTEMPTS:
+                    time.sleep(self.START_RETRY_DELAY)
+        else:
+            with self.lock:
+                self.failed_drivers += 1
+                left = self.size - self.failed_drivers
+            logging.log(logging.ERROR, f"Browser pool driver slot dropped, {left}/{self.size} drivers left")
+            if left <= 0:
+                self.available = False
+                # Wake the renders waiting for a driver, none of them will ever be idle
+                self.idle_drivers.put(None)
+            return
+        with self.lock:
+            self.drivers.append(driver)
+        self.idle_drivers.put(driver)
+        logging.log(logging.INFO, f"Browser pool driver {len(self.drivers)}/{self.size} started")
+
+    def close(
+            self
+    ) -> None:
+        """Stop the worker threads and quit all drivers"""
+        self.threadpool.stop()
+        for driver in self.drivers:
+            try:
+                driver.quit()
+            except Exception as error:
+                logging.log(logging.WARNING, f"Failed to quit driver: {error!r}")
+        self.drivers.clear()
+
+    def render(
+            self,
+            url: str,
+            literals: list[str] = (),
+            with_source: bool = False
+    ) -> Deferred:
+        """Render the URL on a worker thread.
+        The deferred fires with the result of the extraction script (absolute links,
+        found literals, the page source if requested and if the page is partial, as it
+        was not ready in time) or None if nothing of the page could be extracted.
+        """
+        self.start_drivers()
+        return threads.deferToThreadPool(reactor, self.threadpool, self._render, url, list(literals), with_source)
+
+    def set_page_load_timeout(
+            self,
+            driver: 'WebDriver',
+            timeout: float
+    ) -> None:
+        """Set the page load timeout of the driver, if it is not set already"""
+        if self.driver_timeouts.get(id(driver)) != timeout:
+            driver.set_page_load_timeout(timeout)
+            self.driver_timeouts[id(driver)] = timeout
+
+    def _render(
+            self,
+            url: str,
+            literals: list[str],
+            with_source: bool
+    ) -> Optional[dict]:
+        """Load the URL in an idle driver, wait until it is ready and run the extraction script in it"""
+        driver = self.idle_drivers.get()
+        if driver is None:
+            # No driver could be started, the marker is left for the other waiting renders
+            self.idle_drivers.put(None)
+            raise BrowserUnavailableError("No browser driver could be started")
+        host = urlparse(url).netloc.lower()
+        # Timeouts are rounded up to half seconds, so they are rarely set again
+        timeout = math.ceil(self.timeouts.get(host) * 2) / 2
+        started = time.perf_counter()
+        with self.lock:
+            self.busy += 1
+        try:
+            self.set_page_load_timeout(driver, timeout)
+            try:
+                driver.get(url)
+                loaded = time.perf_counter()
+                remaining = max(self.MIN_READY_TIMEOUT, timeout - (loaded - started))
+                strategy, argument = self.readiness
+                partial = not driver.execute_async_script(READY_SCRIPT, strategy, argument, int(remaining * 1000))
+            except self.timeout_errors:
+                loaded = time.perf_counter()
+                partial = True
+            ready = time.perf_counter()
+
+            if partial:
+                self.timeouts.timed_out(host)
+                # Salvage the partial DOM of the page, if the browser got to it at all
+                driver.execute_script("window.stop();")
+                if driver.current_url in ('about:blank', self.driver_urls.get(id(driver))):
+                    return None
+            else:
+                self.timeouts.observe(host, ready - started)
+            result = driver.execute_script(EXTRACT_SCRIPT, literals, with_source)
+            result['partial'] = partial
+            self.driver_urls[id(driver)] = result['url']
+            if self.metrics is not None:
+                self.metrics.observe('render_get', loaded - started)
+                self.metrics.observe('render_ready', ready - loaded)
+                self.metrics.observe('render_extract', time.perf_counter() - ready)
+            return result
+        except self.timeout_errors:
+            return None
+        except Exception:
+            # A crashed or disconnected browser would fail every render it gets, it is replaced
+            self.replace_driver(driver)
+            driver = None
+            raise
+        finally:
+            with self.lock:
+                self.busy -= 1
+                self.busy_seconds += time.perf_counter() - started
+            if driver is not None:
+                self.idle_drivers.put(driver)
+
+    def replace_driver(
+            self,
+            driver: 'WebDriver'
+    ) -> None:
+        """Quit the broken driver and start a new one in its slot"""
+        with self.lock:
+            if driver in self.drivers:
+                self.drivers.remove(driver)
+        self.driver_timeouts.pop(id(driver), None)
+        self.driver_urls.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as error:
+            logging.log(logging.WARNING, f"Failed to quit broken driver: {error!r}")
+        logging.log(logging.WARNING, "Browser pool driver failed, starting a new one")
+        self.threadpool.callInThread(self._start_driver)
@@ -0,0 +1,163 @@
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chromium.options import ChromiumOptions
+    from selenium.webdriver.firefox.options import Options as FirefoxOptions
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+# Resources, that are never needed to extract links or search the page source
+DEFAULT_BLOCKED_PATTERNS = (
+    # Images
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.ico', '*.bmp', '*.svg',
+    # Fonts
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    # Video and audio
+    '*.mp4', '*.webm', '*.m3u8', '*.mp3', '*.ogg', '*.wav',
+    # Third-party frames of ads and video players
+    '*doubleclick.net*', '*googlesyndication.com*', '*youtube.com/embed*', '*player.vimeo.com*',
+)
+
+# Lock files of a running browser, that must not be copied with its profile
+PROFILE_LOCK_FILES = ('Singleton*', 'lock', '.parentlock')
+
+CHROMIUM_ARGUMENTS = (
+    '--blink-settings=imagesEnabled=false',
+    '--disable-extensions',
+    '--disable-gpu',
+    '--disable-dev-shm-usage',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--disable-notifications',
+    '--mute-audio',
+    '--no-first-run',
+    '--autoplay-policy=user-gesture-required',
+)
+
+# Content settings: 2 blocks the content type
+CHROMIUM_PREFERENCES = {
+    'profile.managed_default_content_settings.images': 2,
+    'profile.managed_default_content_settings.media_stream': 2,
+    'profile.managed_default_content_settings.plugins': 2,
+    'profile.managed_default_content_settings.popups': 2,
+    'profile.managed_default_content_settings.geolocation': 2,
+    'profile.managed_default_content_settings.notifications': 2,
+}
+
+FIREFOX_PREFERENCES = {
+    'permissions.default.image': 2,
+    'gfx.downloadable_fonts.enabled': False,
+    'browser.display.use_document_fonts': 0,
+    'media.autoplay.default': 5,
+    'media.autoplay.blocking_policy': 2,
+    'media.peerconnection.enabled': False,
+    'network.prefetch-next': False,
+    'network.dns.disablePrefetch': True,
+    'network.http.speculative-parallel-limit': 0,
+    'dom.ipc.processCount': 1,
+    'dom.webnotifications.enabled': False,
+    'geo.enabled': False,
+    'extensions.enabled': False,
+    'browser.shell.checkDefaultBrowser': False,
+    'app.update.auto': False,
+    'datareporting.policy.dataSubmissionEnabled': False,
+    'toolkit.telemetry.enabled': False,
+}
+
+
+class LeanProfile:
+    """Lean browser profile for rendering pages only to read their DOM
+
+    Images, fonts, media and the blocked URL patterns are not loaded,
+    unneeded browser features are turned off, and pages are returned as
+    soon as their DOM is ready. When `template_dir` is given, every browser
+    starts from a copy of that warm profile (its HTTP cache keeps shared
+    scripts of the sites), and the profile of the first browser replaces
+    the template when the browsers are closed.
+    """
+
+    def __init__(
+            self,
+            blocked_patterns: Iterable[str] = DEFAULT_BLOCKED_PATTERNS,
+            template_dir: Optional[str] = None
+    ) -> None:
+        self.blocked_patterns = list(blocked_patterns)
+        self.template_dir = template_dir
+        self.profile_dirs: list[str] = []
+
+    def make_profile_dir(
+            self
+    ) -> Optional[str]:
+        """Make the profile directory of a new browser from the warm template"""
+        if self.template_dir is None:
+            return None
+        profile_dir = tempfile.mkdtemp(prefix='sherlock-profile-')
+        if os.path.isdir(self.template_dir):
+            shutil.copytree(self.template_dir, profile_dir, dirs_exist_ok=True,
+                            ignore=shutil.ignore_patterns(*PROFILE_LOCK_FILES))
+        self.profile_dirs.append(profile_dir)
+        return profile_dir
+
+    def apply_chromium(
+            self,
+            options: 'ChromiumOptions'
+    ) -> None:
+        """Apply the profile to the options of Chrome or Edge"""
+        for argument in CHROMIUM_ARGUMENTS:
+            options.add_argument(argument)
+        options.add_experimental_option('prefs', CHROMIUM_PREFERENCES)
+        options.page_load_strategy = 'eager'
+        profile_dir = self.make_profile_dir()
+        if profile_dir is not None:
+            options.add_argument(f'--user-data-dir={profile_dir}')
+
+    def apply_firefox(
+            self,
+            options: 'FirefoxOptions'
+    ) -> None:
+        """Apply the profile to the options of Firefox"""
+        for name, value in FIREFOX_PREFERENCES.items():
+            options.set_preference(name, value)
+        options.page_load_strategy = 'eager'
+        profile_dir = self.make_profile_dir()
+        if profile_dir is not None:
+            # The profile is used in place, so its cache survives the browser
+            options.add_argument('-profile')
+            options.add_argument(profile_dir)
+
+    def block_urls(
+            self,
+            driver: 'WebDriver'
+    ) -> None:
+        """Block the URL patterns in the started browser through DevTools (Chrome and Edge only)"""
+        if not self.blocked_patterns or not hasattr(driver, 'execute_cdp_cmd'):
+            return
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.blocked_patterns})
+
+    def close(
+            self
+    ) -> None:
+        """Save the profile of the first browser as the warm template and remove the profile copies.
+        The browsers must be quit already.
+        """
+        if not self.profile_dirs:
+            return
+        tmp_template_dir = f"{self.template_dir}.tmp"
+        shutil.rmtree(tmp_template_dir, ignore_errors=True)
+        try:
+            shutil.copytree(self.profile_dirs[0], tmp_template_dir,
+                            ignore=shutil.ignore_patterns(*PROFILE_LOCK_FILES))
+            shutil.rmtree(self.template_dir, ignore_errors=True)
+            os.replace(tmp_template_dir, self.template_dir)
+        except OSError as error:
+            logging.log(logging.WARNING, f"Failed to save the browser profile template: {error!r}")
+        for profile_dir in self.profile_dirs:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+        self.profile_dirs.clear()
@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+from w3lib.url import canonicalize_url
+
+
+@dataclass
+class CacheEntry:
+    """Cached result of processing a page"""
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body_hash: str
+    links: list[str]
+    matches: list[tuple[str, str]]
+    queries_hash: str
+    # Empty, if the page source was not kept (it was rendered for links only)
+    dom: str
+
+
+class RenderCache:
+    """On-disk cache of processed pages keyed by the canonical URL
+
+    Every entry keeps the validators of the page (ETag, Last-Modified and
+    the hash of the downloaded body), the extracted links, the query
+    matches and the compressed DOM (NULL, if the source was not kept, so
+    such entries are skipped by the lookups, that need it). The least
+    recently used entries are evicted, when the cache grows over `max_size` bytes.
+
+    Only the lookups run in the calling (reactor) thread. The new entries and
+    the access times are queued to a writer thread with its own connection,
+    that stores them in batches, one transaction per batch.
+    """
+
+    FILENAME = 'render_cache.sqlite'
+    # Evict a bit more than needed, so not every new entry causes an eviction
+    EVICTION_TARGET = 0.9
+    EVICTION_BATCH_SIZE = 1000
+    WRITE_BATCH_SIZE = 500
+
+    STOP = object()
+
+    def __init__(
+            self,
+            cache_dir: str,
+            max_size: int
+    ) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_size = max_size
+        self.filepath = os.path.join(cache_dir, self.FILENAME)
+        self.connection = sqlite3.connect(self.filepath)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body_hash TEXT, '
+            'links TEXT, matches TEXT, queries_hash TEXT, dom BLOB, size INTEGER, accessed REAL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self.size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        self.writes = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, name='RenderCacheWriter', daemon=True)
+        self.writer.start()
+
+    @staticmethod
+    def get_key(
+            url: str
+    ) -> str:
+        """Get the cache key of the URL"""
+        return canonicalize_url(url)
+
+    def get_validators(
+            self,
+            url: str,
+            with_dom: bool = False
+    ) -> Optional[tuple[Optional[str], Optional[str]]]:
+        """Get the ETag and Last-Modified of the cached URL (only of an entry with the DOM, if it is needed)"""
+        return self.connection.execute(
+            'SELECT etag, last_modified FROM entries WHERE url = ? AND (? = 0 OR dom IS NOT NULL)',
+            (self.get_key(url), with_dom)
+        ).fetchone()
+
+    def get(
+            self,
+            url: str,
+            with_dom: bool = False
+    ) -> Optional[CacheEntry]:
+        """Get the cached entry of the URL (only if it has the DOM, if it is needed) and mark it as recently used"""
+        key = self.get_key(url)
+        row = self.connection.execute(
+            'SELECT etag, last_modified, body_hash, links, matches, queries_hash, dom FROM entries '
+            'WHERE url = ? AND (? = 0 OR dom IS NOT NULL)',
+            (key, with_dom)
+        ).fetchone()
+        if row is None:
+            return None
+
+        self.writes.put((key, time.time()))
+        etag, last_modified, body_hash, links, matches, queries_hash, dom = row
+        return CacheEntry(
+            url=url,
+            etag=etag,
+            last_modified=last_modified,
+            body_hash=body_hash,
+            links=json.loads(links),
+            matches=[tuple(match) for match in json.loads(matches)],
+            queries_hash=queries_hash,
+            dom=zlib.decompress(dom).decode('utf-8') if dom is not None else '',
+        )
+
+    def put(
+            self,
+            entry: CacheEntry
+    ) -> None:
+        """Queue the entry to be stored by the writer thread"""
+        self.writes.put(entry)
+
+    def write_loop(
+            self
+    ) -> None:
+        """Store the queued entries and access times in batches, until the cache is closed"""
+        connection = sqlite3.connect(self.filepath)
+        stopped = False
+        while not stopped:
+            batch = [self.writes.get()]
+            while len(batch) < self.WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            if self.STOP in batch:
+                stopped = True
+                batch = [write for write in batch if write is not self.STOP]
+            try:
+                self.write(connection, batch)
+                if self.size > self.max_size:
+                    self.evict(connection)
+            except sqlite3.Error as error:
+                logging.log(logging.WARNING, f"Failed to write {len(batch)} render cache updates: {error!r}")
+        connection.close()
+
+    def write(
+            self,
+            connection: sqlite3.Connection,
+            batch: list
+    ) -> None:
+        """Store the entries and the access times of the batch in one transaction"""
+        with connection:
+            for write in batch:
+                if not isinstance(write, CacheEntry):
+                    key, accessed = write
+                    connection.execute('UPDATE entries SET accessed = ? WHERE url = ?', (accessed, key))
+                    continue
+                key = self.get_key(write.url)
+                links = json.dumps(write.links)
+                matches = json.dumps(write.matches)
+                dom = zlib.compress(write.dom.encode('utf-8')) if write.dom else None
+                size = len(key) + len(links) + len(matches) + (len(dom) if dom is not None else 0)
+                previous = connection.execute('SELECT size FROM entries WHERE url = ?', (key,)).fetchone()
+                connection.execute(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, write.etag, write.last_modified, write.body_hash,
+                     links, matches, write.queries_hash, dom, size, time.time())
+                )
+                self.size += size - (previous[0] if previous else 0)
+
+    def evict(
+            self,
+            connection: sqlite3.Connection
+    ) -> None:
+        """Remove the least recently used entries, until the cache fits into its size limit"""
+        evicted = 0
+        target_size = self.max_size * self.EVICTION_TARGET
+        with connection:
+            while self.size > target_size:
+                rows = connection.execute(
+                    'SELECT url, size FROM entries ORDER BY accessed LIMIT ?', (self.EVICTION_BATCH_SIZE,)
+                ).fetchall()
+                if not rows:
+                    break
+                for key, size in rows:
+                    if self.size <= target_size:
+                        break
+                    connection.execute('DELETE FROM entries WHERE url = ?', (key,))
+                    self.size -= size
+                    evicted += 1
+        logging.log(logging.INFO, f"Evicted {evicted} entries from the render cache")
+
+    def close(
+            self
+    ) -> None:
+        """Store the queued writes and close the cache database"""
+        self.writes.put(self.STOP)
+        self.writer.join()
+        self.connection.close()
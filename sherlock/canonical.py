@@ -0,0 +1,179 @@
+import fnmatch
+import hashlib
+import re
+from collections.abc import Iterable
+from typing import Optional
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+# Query parameters of ad and analytics tracking, that do not change the page
+DEFAULT_TRACKING_PARAMS = (
+    'utm_*', 'gclid', 'gclsrc', 'dclid', 'fbclid', 'msclkid', 'yclid', 'twclid', 'igshid',
+    'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi', 'mkt_tok', 'spm',
+)
+
+# Query parameters of server sessions
+DEFAULT_SESSION_PARAMS = (
+    'jsessionid', 'phpsessid', 'aspsessionid*', 'sessionid', 'session_id', 'sid', 'cfid', 'cftoken',
+)
+
+DEFAULT_STRIP_PARAMS = DEFAULT_TRACKING_PARAMS + DEFAULT_SESSION_PARAMS
+
+# Session ids in the path parameters (e.g. /page;jsessionid=...)
+PATH_SESSION_REGEX = re.compile(r';(?:jsessionid|phpsessid|sessionid|sid)=[^/?#]*', re.IGNORECASE)
+
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+# Characters kept as they are in the rebuilt query
+QUERY_SAFE_CHARACTERS = "/:@!$'()*,;"
+
+# Words of the page text, that make its content fingerprint
+WORD_REGEX = re.compile(r'\w{2,}')
+
+FINGERPRINT_BITS = 64
+FINGERPRINT_MASK = (1 << FINGERPRINT_BITS) - 1
+# Bits set in every byte value
+BYTE_BITS = tuple(tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256))
+
+
+class UrlCanonicalizer:
+    """Reduce the variants of a URL to one canonical form, that the visited set keeps
+
+    The scheme and host are lowercased, the default port, the fragment, the
+    session ids in the path and the query parameters matching `strip_params`
+    (glob patterns, tracking and session parameters by default) are removed,
+    the rest of the parameters are sorted and, with `strip_trailing_slash`,
+    the trailing slash of the path is removed.
+    """
+
+    def __init__(
+            self,
+            strip_params: Iterable[str] = DEFAULT_STRIP_PARAMS,
+            strip_trailing_slash: bool = True
+    ) -> None:
+        patterns = [fnmatch.translate(pattern.lower()) for pattern in strip_params]
+        self.strip_regex = re.compile('|'.join(patterns)) if patterns else None
+        self.strip_trailing_slash = strip_trailing_slash
+
+    def canonicalize(
+            self,
+            url: str
+    ) -> str:
+        """Get the canonical form of the URL"""
+        try:
+            parts = urlsplit(url)
+        except ValueError:
+            return url
+        scheme = parts.scheme.lower()
+        netloc = parts.netloc.lower()
+        default_port = DEFAULT_PORTS.get(scheme)
+        if default_port and netloc.endswith(default_port):
+            netloc = netloc[:-len(default_port)]
+
+        path = PATH_SESSION_REGEX.sub('', parts.path) or '/'
+        if self.strip_trailing_slash and len(path) > 1 and path.endswith('/'):
+            path = path.rstrip('/') or '/'
+
+        query = parts.query
+        if query:
+            params = parse_qsl(query, keep_blank_values=True)
+            if self.strip_regex is not None:
+                params = [(name, value) for name, value in params if not self.strip_regex.match(name.lower())]
+            query = urlencode(sorted(params), quote_via=quote, safe=QUERY_SAFE_CHARACTERS)
+        return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def get_simhash(
+        text: str,
+        shingle_size: int = 3
+) -> Optional[int]:
+    """Get the 64-bit simhash of the distinct word shingles of the text,
+    or None if the text is too short to be fingerprinted.
+    The shingles are hashed the same way in every process (unlike the salted `hash`),
+    so the fingerprints of the parse workers are comparable.
+    """
+    words = WORD_REGEX.findall(text.lower())
+    shingles = {' '.join(words[index:index + shingle_size])
+                for index in range(max(0, len(words) - shingle_size + 1))}
+    shingles = {int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+                for shingle in shingles}
+    if len(shingles) < NearDuplicateIndex.MIN_SHINGLES:
+        return None
+
+    # Every bit of the fingerprint is the majority vote of the shingle hashes, the votes are
+    # counted in one pass over the hashes as the tallies of their bytes (by position and value)
+    byte_counts = [[0] * 256 for _ in range(FINGERPRINT_BITS // 8)]
+    for shingle in shingles:
+        for position, byte in enumerate(shingle.to_bytes(FINGERPRINT_BITS // 8, 'little')):
+            byte_counts[position][byte] += 1
+
+    bit_counts = [0] * FINGERPRINT_BITS
+    for position, counts in enumerate(byte_counts):
+        for byte, count in enumerate(counts):
+            if count:
+                for bit in BYTE_BITS[byte]:
+                    bit_counts[position * 8 + bit] += count
+
+    threshold = len(shingles) / 2
+    fingerprint = 0
+    for bit, count in enumerate(bit_counts):
+        if count > threshold:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class NearDuplicateIndex:
+    """Index of the page fingerprints, that finds a near-duplicate of a new page
+
+    Fingerprints differing in at most `distance` bits are near-duplicates.
+    The fingerprint is split into `distance + 1` blocks, and every block has
+    a table of the fingerprints by the block value, so a near-duplicate is
+    among the fingerprints sharing at least one block with the new one.
+    The index is kept in memory only (it is not saved with checkpoints).
+    """
+
+    MIN_SHINGLES = 16
+
+    def __init__(
+            self,
+            distance: int = 3
+    ) -> None:
+        self.distance = distance
+        # (shift, mask) of the blocks, the last one takes the remaining bits
+        block_bits = FINGERPRINT_BITS // (distance + 1)
+        shifts = [index * block_bits for index in range(distance + 1)]
+        self.blocks = [
+            (shift, (1 << (next_shift - shift)) - 1)
+            for shift, next_shift in zip(shifts, shifts[1:] + [FINGERPRINT_BITS])
+        ]
+        self.tables: list[dict[int, list[int]]] = [{} for _ in self.blocks]
+        self.count = 0
+
+    def __len__(
+            self
+    ) -> int:
+        return self.count
+
+    def find(
+            self,
+            fingerprint: int
+    ) -> Optional[int]:
+        """Get a fingerprint of the index, that is a near-duplicate of the fingerprint"""
+        for table, (shift, mask) in zip(self.tables, self.blocks):
+            for candidate in table.get((fingerprint >> shift) & mask, ()):
+                if (candidate ^ fingerprint).bit_count() <= self.distance:
+                    return candidate
+        return None
+
+    def add(
+            self,
+            fingerprint: int
+    ) -> bool:
+        """Add the fingerprint to the index.
+        Return False if a near-duplicate of it is there already (it is not added then).
+        """
+        if self.find(fingerprint) is not None:
+            return False
+        for table, (shift, mask) in zip(self.tables, self.blocks):
+            table.setdefault((fingerprint >> shift) & mask, []).append(fingerprint)
+        self.count += 1
+        return True
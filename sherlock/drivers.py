@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+    from sherlock.browser_profile import LeanProfile
+
+# Browsers rendering the pages: the first installed one (auto), a chosen one,
+# the browser-less stub driver or none at all (static pages only, Selenium is never imported)
+BROWSERS = ('auto', 'chrome', 'firefox', 'edge', 'safari', 'stub', 'none')
+
+# Installed browser types, that can be used for each browser, in the order of preference
+BROWSER_TYPES = {
+    'chrome': ('chrome', 'chromium'),
+    'firefox': ('firefox',),
+    'edge': ('msedge',),
+    'safari': ('safari',),
+}
+
+# Installed browsers are detected once a day, the cached ones are kept while their binaries exist
+BROWSERS_CACHE_TTL = 24 * 60 * 60
+BROWSERS_CACHE_FILEPATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'sherlock', 'browsers.json'
+)
+
+detection_lock = threading.Lock()
+detected_browsers: Optional[list[dict]] = None
+
+
+def load_cached_browsers(
+        filepath: str,
+        ttl: float
+) -> Optional[list[dict]]:
+    """Load the installed browsers detected by a previous run, if they are still valid"""
+    try:
+        with open(filepath, encoding='utf-8') as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cache.get('detected', 0) > ttl:
+        return None
+    installed = cache.get('browsers', [])
+    # A browser may be installed since the last run, that found none
+    if not installed or not all(os.path.exists(item.get('path') or '') for item in installed):
+        return None
+    return installed
+
+
+def save_cached_browsers(
+        filepath: str,
+        installed: list[dict]
+) -> None:
+    """Save the detected browsers for the next runs"""
+    try:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+        with open(tmp_filepath, 'w', encoding='utf-8') as file:
+            json.dump({'detected': time.time(), 'browsers': installed}, file)
+        os.replace(tmp_filepath, filepath)
+    except OSError as error:
+        logging.log(logging.WARNING, f"Failed to cache the detected browsers: {error!r}")
+
+
+def detect_browsers(
+        filepath: str = BROWSERS_CACHE_FILEPATH,
+        ttl: float = BROWSERS_CACHE_TTL
+) -> list[dict]:
+    """Get the installed browsers: from memory, from the cache of the previous runs
+    or by scanning the system (slow, it starts every browser to get its version).
+    """
+    global detected_browsers
+    with detection_lock:
+        if detected_browsers is None:
+            detected_browsers = load_cached_browsers(filepath, ttl)
+            if detected_browsers is None:
+                import browsers
+
+                started = time.perf_counter()
+                detected_browsers = [dict(item) for item in browsers.browsers()]
+                logging.log(logging.INFO, f"Detected {len(detected_browsers)} installed browser(s) "
+                                          f"in {time.perf_counter() - started:.2f}s")
+                save_cached_browsers(filepath, detected_browsers)
+        return detected_browsers
+
+
+def choose_browser(
+        browser: str
+) -> str:
+    """Get the installed browser to use for the browser option (auto or a chosen one)"""
+    installed_types = {item['browser_type'] for item in detect_browsers()}
+    candidates = BROWSER_TYPES if browser == 'auto' else {browser: BROWSER_TYPES[browser]}
+    for name, browser_types in candidates.items():
+        if installed_types.intersection(browser_types):
+            return name
+    raise RuntimeError(f"No installed browser found for: {browser}")
+
+
+def get_timeout_errors(
+        browser: str
+) -> tuple[type[Exception], ...]:
+    """Get the errors of the driver of the browser, that mean the page timed out"""
+    if browser == 'stub':
+        return TimeoutError,
+    from selenium.common import TimeoutException
+    return TimeoutException, TimeoutError
+
+
+def make_driver(
+        browser: str,
+        lean_profile: Optional['LeanProfile'] = None,
+        page_load_strategy: str = 'normal'
+) -> 'WebDriver':
+    """Start a new driver of the browser, importing Selenium on the first call.
+    Importing any backend loads all Selenium webdrivers, Selenium is skipped only
+    by the stub driver and with `--browser none` (no driver is made then).
+    The browser pool sets its page load timeout.
+    """
+    if browser == 'stub':
+        from sherlock.stub_driver import StubDriver
+        return StubDriver()
+
+    name = choose_browser(browser)
+    if name in ('chrome', 'edge'):
+        if name == 'chrome':
+            from selenium.webdriver import Chrome as Driver
+            from selenium.webdriver.chrome.options import Options
+        else:
+            from selenium.webdriver import Edge as Driver
+            from selenium.webdriver.edge.options import Options
+        browser_options = Options()
+        browser_options.add_argument('--headless')
+        browser_options.add_argument('--ignore-certificate-errors')
+        if lean_profile is not None:
+            # The lean profile keeps its cache, so incognito mode is not used
+            lean_profile.apply_chromium(browser_options)
+        else:
+            browser_options.add_argument('--incognito')
+    elif name == 'firefox':
+        from selenium.webdriver import Firefox as Driver
+        from selenium.webdriver.firefox.options import Options
+        browser_options = Options()
+        browser_options.add_argument('-headless')
+        if lean_profile is not None:
+            lean_profile.apply_firefox(browser_options)
+    else:
+        # Safari has no options to block resources, so it is never lean
+        from selenium.webdriver import Safari as Driver
+        from selenium.webdriver.safari.options import Options
+        browser_options = Options()
+
+    started = time.perf_counter()
+    # The lean profile always loads pages eagerly
+    if lean_profile is None or name == 'safari':
+        browser_options.page_load_strategy = page_load_strategy
+    driver = Driver(options=browser_options)
+    if lean_profile is not None:
+        lean_profile.block_urls(driver)
+    logging.log(logging.INFO, f"Started {name} driver in {time.perf_counter() - started:.2f}s")
+    return driver
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from sherlock.metrics import Metrics, get_rss
+
+
+class MetricsResource(Resource):
+    """HTTP resource serving the metrics in the Prometheus text format"""
+
+    isLeaf = True
+
+    def __init__(
+            self,
+            metrics: Metrics
+    ) -> None:
+        super().__init__()
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.metrics.to_prometheus().encode('utf-8')
+
+
+class MetricsExtension:
+    """Publish the metrics of the spider
+
+    Every `SHERLOCK_METRICS_INTERVAL` seconds the gauges (memory, frontier
+    size, browser pool utilisation) are updated, and the metrics are copied
+    into the scrapy stats and dumped to the `SHERLOCK_METRICS_DUMP_PATH`
+    JSON file. With `SHERLOCK_METRICS_PORT` they are also served on
+    http://127.0.0.1:<port>/metrics for Prometheus.
+    """
+
+    def __init__(
+            self,
+            crawler,
+            interval: float = 10.0,
+            dump_path: Optional[str] = None,
+            port: int = 0
+    ) -> None:
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = interval
+        self.dump_path = dump_path
+        self.port = port
+        self.metrics = None
+        self.loop = None
+        self.listener = None
+        self.last_update = None
+        self.last_busy_seconds = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('SHERLOCK_METRICS_ENABLED', True):
+            raise NotConfigured
+        extension = cls(
+            crawler,
+            interval=crawler.settings.getfloat('SHERLOCK_METRICS_INTERVAL', 10.0),
+            dump_path=crawler.settings.get('SHERLOCK_METRICS_DUMP_PATH'),
+            port=crawler.settings.getint('SHERLOCK_METRICS_PORT', 0),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.metrics = getattr(spider, 'metrics', None)
+        if self.metrics is None:
+            return
+        self.last_update = time.monotonic()
+        self.loop = LoopingCall(self.update, spider)
+        self.loop.start(self.interval, now=False)
+        if self.port:
+            self.listener = reactor.listenTCP(self.port, Site(MetricsResource(self.metrics)), interface='127.0.0.1')
+            logging.log(logging.INFO, f"Metrics are served on http://127.0.0.1:{self.port}/metrics")
+
+    def spider_closed(self, spider):
+        if self.metrics is None:
+            return
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.update(spider)
+        if self.listener is not None:
+            self.listener.stopListening()
+
+    def update(
+            self,
+            spider
+    ) -> None:
+        """Update the gauges and publish the metrics"""
+        now = time.monotonic()
+        elapsed = max(now - self.last_update, 1e-6)
+        self.last_update = now
+
+        rss, peak_rss = get_rss()
+        self.metrics.set_gauge('rss_bytes', rss)
+        self.metrics.set_gauge('peak_rss_bytes', peak_rss)
+        engine_slot = getattr(self.crawler.engine, 'slot', None)
+        if engine_slot is not None and engine_slot.scheduler is not None:
+            self.metrics.set_gauge('frontier_size', len(engine_slot.scheduler))
+        self.metrics.set_gauge('pending_requests', len(getattr(spider, 'pending', ())))
+        frontier = getattr(spider, 'frontier', None)
+        if frontier is not None:
+            self.metrics.set_gauge('frontier_spilled', frontier.spilled_count)
+        self.metrics.set_gauge('downloader_active', len(self.crawler.engine.downloader.active))
+        self.metrics.set_gauge('visited_count', len(spider.visited))
+        self.metrics.set_gauge('processed_count', spider.processed_count)
+
+        browser_pool = getattr(spider, 'browser_pool', None)
+        if browser_pool is not None:
+            busy_seconds = browser_pool.busy_seconds
+            self.metrics.set_gauge('browser_pool_busy', browser_pool.busy)
+            self.metrics.set_gauge('browser_pool_utilisation', round(
+                min(1.0, (busy_seconds - self.last_busy_seconds) / (elapsed * browser_pool.size)), 4))
+            self.last_busy_seconds = busy_seconds
+
+        snapshot = self.metrics.to_dict()
+        for phase, summary in snapshot['phases'].items():
+            for name in ('count', 'mean', 'p50', 'p90', 'p99', 'max'):
+                self.stats.set_value(f'sherlock/metrics/{phase}/{name}', summary[name])
+        for name, value in snapshot['gauges'].items():
+            self.stats.set_value(f'sherlock/metrics/{name}', value)
+        self.stats.set_value('sherlock/metrics/hosts', len(snapshot['hosts']))
+
+        if self.dump_path:
+            self.dump(snapshot)
+
+    def dump(
+            self,
+            snapshot: dict
+    ) -> None:
+        """Replace the dump file with the snapshot of the metrics"""
+        tmp_filepath = f"{self.dump_path}.tmp"
+        with open(tmp_filepath, 'w', encoding='utf-8') as file:
+            json.dump(snapshot, file, indent=2)
+        os.replace(tmp_filepath, self.dump_path)
@@ -0,0 +1,104 @@
+from collections.abc import Iterable
+from typing import Optional
+from urllib.parse import urljoin
+
+import lxml.html
+
+# Script run in the browser after a page is rendered. It collects the absolute
+# URLs of the same elements as `extract_links`, checks which literal queries
+# (arguments[0]) the DOM contains and returns the page source only if it is
+# requested (arguments[1]), so the DOM crosses the WebDriver wire at most once.
+# The URL of the document is returned too.
+EXTRACT_SCRIPT = """
+    var literals = arguments[0], withSource = arguments[1];
+    var links = [];
+    var resolve = function (value) {
+        try {
+            return new URL(value, document.baseURI).href;
+        } catch (error) {
+            return value;
+        }
+    };
+    var elements = document.querySelectorAll(
+        'a[href], link[href], script[src], meta[property="og:url"][content]');
+    for (var i = 0; i < elements.length; i++) {
+        var element = elements[i], tag = element.tagName.toLowerCase();
+        if (tag === 'a') {
+            links.push(resolve(element.getAttribute('href')));
+        } else if (tag === 'script') {
+            links.push(resolve(element.getAttribute('src')));
+        } else if (tag === 'meta') {
+            links.push(resolve(element.getAttribute('content')));
+        } else {
+            var rel = (element.getAttribute('rel') || '').toLowerCase();
+            if (rel === 'stylesheet' || (rel === 'alternate' && element.getAttribute('hreflang') === 'en')) {
+                links.push(resolve(element.getAttribute('href')));
+            }
+        }
+    }
+    var source = null, found = [];
+    if (withSource) {
+        source = document.documentElement.outerHTML;
+    } else if (literals.length) {
+        var html = document.documentElement.outerHTML;
+        found = literals.filter(function (literal) { return html.indexOf(literal) !== -1; });
+    }
+    return {links: links, found: found, source: source, url: location.href};
+"""
+
+
+def iter_link_values(
+        root: lxml.html.HtmlElement
+) -> Iterable[str]:
+    """Get the raw link values of the tree in one pass (the same elements as `EXTRACT_SCRIPT`)"""
+    for element in root.iter('a', 'link', 'script', 'meta'):
+        tag = element.tag
+        if tag == 'a':
+            value = element.get('href')
+        elif tag == 'script':
+            value = element.get('src')
+        elif tag == 'meta':
+            value = element.get('content') if element.get('property') == 'og:url' else None
+        else:
+            rel = (element.get('rel') or '').lower()
+            value = element.get('href') if rel == 'stylesheet' or (
+                    rel == 'alternate' and element.get('hreflang') == 'en') else None
+        if value is not None:
+            yield value
+
+
+def extract_links(
+        root: Optional[lxml.html.HtmlElement],
+        url: str
+) -> list[str]:
+    """Extract the absolute URLs of the links of the parsed page in a single pass"""
+    if root is None:
+        return []
+    base_href = root.xpath('string((//base/@href)[1])') if root.find('.//base') is not None else ''
+    base_url = urljoin(url, base_href.strip()) if base_href else url
+    return [urljoin(base_url, value.strip()) for value in iter_link_values(root)]
+
+
+def extract_rendered(
+        page_source: str,
+        url: str,
+        literals: list[str],
+        with_source: bool
+) -> dict:
+    """Get the same result as `EXTRACT_SCRIPT` from the page source (for browser-less drivers)"""
+    root = lxml.html.fromstring(page_source) if page_source.strip() else None
+    return {
+        'links': extract_links(root, url),
+        'found': [] if with_source else [literal for literal in literals if literal in page_source],
+        'source': page_source if with_source else None,
+        'url': url,
+    }
+
+
+def extract_text(
+        root: Optional[lxml.html.HtmlElement]
+) -> str:
+    """Get the text of the parsed page without its scripts and styles"""
+    if root is None:
+        return ''
+    return ' '.join(root.xpath('.//text()[not(ancestor::script) and not(ancestor::style)]'))
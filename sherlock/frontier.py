@@ -0,0 +1,261 @@
+import logging
+import os
+import shutil
+import struct
+import sys
+from array import array
+from collections import deque
+from collections.abc import Generator
+from typing import Optional
+
+# Entry of a spilled segment: deep level and length of the UTF-8 encoded url
+SEGMENT_ENTRY = struct.Struct('<II')
+
+# Memory of an entry besides its url string: list pointer and deep level
+ENTRY_OVERHEAD = 8 + 4
+
+
+class LinkBuffer:
+    """In-memory part of the frontier: urls in a list and deep levels in an array"""
+
+    def __init__(
+            self
+    ) -> None:
+        self.urls: list[str] = []
+        self.depths = array('I')
+        self.start = 0
+        self.size = 0
+
+    def __len__(
+            self
+    ) -> int:
+        return len(self.urls) - self.start
+
+    def push(
+            self,
+            url: str,
+            url_deep_level: int
+    ) -> None:
+        self.urls.append(url)
+        self.depths.append(url_deep_level)
+        self.size += sys.getsizeof(url) + ENTRY_OVERHEAD
+
+    def pop_first(
+            self
+    ) -> tuple[str, int]:
+        url, url_deep_level = self.urls[self.start], self.depths[self.start]
+        self.urls[self.start] = None
+        self.start += 1
+        self.size -= sys.getsizeof(url) + ENTRY_OVERHEAD
+        # Drop the popped part once it is the bigger one, so popping stays O(1) amortized
+        if self.start * 2 >= len(self.urls):
+            del self.urls[:self.start]
+            del self.depths[:self.start]
+            self.start = 0
+        return url, url_deep_level
+
+    def pop_last(
+            self
+    ) -> tuple[str, int]:
+        url, url_deep_level = self.urls.pop(), self.depths.pop()
+        self.size -= sys.getsizeof(url) + ENTRY_OVERHEAD
+        if not self:
+            self.clear()
+        return url, url_deep_level
+
+    def __iter__(
+            self
+    ) -> Generator[tuple[str, int], None, None]:
+        for index in range(self.start, len(self.urls)):
+            yield self.urls[index], self.depths[index]
+
+    def clear(
+            self
+    ) -> None:
+        self.urls.clear()
+        self.depths = array('I')
+        self.start = 0
+        self.size = 0
+
+
+class CompactFrontier:
+    """Queue of the discovered (url, deep level) links, that are not requested yet
+
+    Entries take a url string and a deep level in an array, instead of a
+    whole request. The url of a link, that is its own canonical form, is the
+    same string object the in-memory visited set keeps, so it is stored once. Past `memory_limit`
+    bytes, the entries are spilled to segment files in `directory`.
+    The queue is FIFO (breadth-first), or LIFO (depth-first) with `lifo`.
+    In FIFO mode the new entries go to the tail buffer, that is spilled as a
+    whole, and the head buffer is refilled from the oldest segment.
+    In LIFO mode the oldest half of the single buffer is spilled, and the
+    buffer is refilled from the newest segment.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            memory_limit: int = 64 * 1024 * 1024,
+            lifo: bool = False
+    ) -> None:
+        self.directory = directory
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+        self.memory_limit = memory_limit
+        self.lifo = lifo
+        self.head = LinkBuffer()
+        self.tail = LinkBuffer()
+        self.segments: deque[tuple[str, int]] = deque()
+        self.segment_counter = 0
+        self.spilled_count = 0
+
+    def __len__(
+            self
+    ) -> int:
+        return len(self.head) + len(self.tail) + self.spilled_count
+
+    def __bool__(
+            self
+    ) -> bool:
+        return len(self) > 0
+
+    def push(
+            self,
+            url: str,
+            url_deep_level: int
+    ) -> None:
+        """Add the link to the frontier"""
+        if self.lifo:
+            self.head.push(url, url_deep_level)
+            if self.head.size > self.memory_limit:
+                self.spill_oldest()
+            return
+
+        self.tail.push(url, url_deep_level)
+        if self.tail.size > self.memory_limit // 2:
+            if not self.head and not self.segments:
+                self.head, self.tail = self.tail, LinkBuffer()
+            else:
+                self.segments.append(self.write_segment(self.tail))
+                self.tail = LinkBuffer()
+
+    def pop(
+            self
+    ) -> Optional[tuple[str, int]]:
+        """Take the next link from the frontier or None if it is empty"""
+        if self.lifo:
+            if not self.head and self.segments:
+                self.head = self.read_segment(self.segments.pop())
+            return self.head.pop_last() if self.head else None
+
+        if not self.head:
+            if self.segments:
+                self.head = self.read_segment(self.segments.popleft())
+            else:
+                self.head, self.tail = self.tail, LinkBuffer()
+        return self.head.pop_first() if self.head else None
+
+    def spill_oldest(
+            self
+    ) -> None:
+        """Move the oldest half of the LIFO buffer to a segment"""
+        oldest = LinkBuffer()
+        for _ in range(len(self.head) // 2):
+            oldest.push(*self.head.pop_first())
+        self.segments.append(self.write_segment(oldest))
+
+    def write_segment(
+            self,
+            buffer: LinkBuffer
+    ) -> tuple[str, int]:
+        """Write the buffer to a new segment file"""
+        path = os.path.join(self.directory, f"segment.{self.segment_counter}")
+        self.segment_counter += 1
+        with open(path, 'wb') as file:
+            for url, url_deep_level in buffer:
+                encoded = url.encode('utf-8')
+                file.write(SEGMENT_ENTRY.pack(url_deep_level, len(encoded)))
+                file.write(encoded)
+        self.spilled_count += len(buffer)
+        logging.log(logging.DEBUG, f"Spilled {len(buffer)} frontier links to {path}")
+        return path, len(buffer)
+
+    @staticmethod
+    def iter_segment(
+            path: str
+    ) -> Generator[tuple[str, int], None, None]:
+        """Stream the links of the segment file"""
+        with open(path, 'rb') as file:
+            while header := file.read(SEGMENT_ENTRY.size):
+                url_deep_level, length = SEGMENT_ENTRY.unpack(header)
+                yield file.read(length).decode('utf-8'), url_deep_level
+
+    def read_segment(
+            self,
+            segment: tuple[str, int]
+    ) -> LinkBuffer:
+        """Load the segment into a buffer and remove its file"""
+        path, count = segment
+        buffer = LinkBuffer()
+        for url, url_deep_level in self.iter_segment(path):
+            buffer.push(url, url_deep_level)
+        os.remove(path)
+        self.spilled_count -= count
+        return buffer
+
+    def __iter__(
+            self
+    ) -> Generator[tuple[str, int], None, None]:
+        """Stream all links of the frontier (in no particular order) without taking them"""
+        yield from self.head
+        for path, _ in self.segments:
+            yield from self.iter_segment(path)
+        yield from self.tail
+
+    def snapshot(
+            self,
+            directory: str
+    ) -> Generator[tuple[str, int], None, None]:
+        """Take a snapshot of all links, that can be streamed on another thread while the frontier changes.
+        The buffers are copied, and the segment files are hard linked into the directory
+        (they are removed by the frontier, once they are read).
+        """
+        head, tail = list(self.head), list(self.tail)
+        paths = []
+        for path, _ in self.segments:
+            snapshot_path = os.path.join(directory, f"frontier-{os.path.basename(path)}")
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+            try:
+                os.link(path, snapshot_path)
+            except OSError:
+                shutil.copyfile(path, snapshot_path)
+            paths.append(snapshot_path)
+        return self.iter_snapshot(head, paths, tail)
+
+    def iter_snapshot(
+            self,
+            head: list[tuple[str, int]],
+            paths: list[str],
+            tail: list[tuple[str, int]]
+    ) -> Generator[tuple[str, int], None, None]:
+        """Stream the links of the snapshot and remove its segment files"""
+        try:
+            yield from head
+            for path in paths:
+                yield from self.iter_segment(path)
+            yield from tail
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def close(
+            self
+    ) -> None:
+        """Remove the segment files"""
+        self.head.clear()
+        self.tail.clear()
+        self.segments.clear()
+        self.spilled_count = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -7,6 +7,11 @@ import scrapy
 
 
 class SherlockItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # Scraped web-page url
+    url = scrapy.Field()
+    # Deep level of the url from the start point
+    url_deep_level = scrapy.Field()
+    # Pairs of the found query and the link with it (empty if found in the page source)
+    matches = scrapy.Field()
+    # Partition name of the seed the url was found from (in the multi-seed mode)
+    seed = scrapy.Field()
@@ -0,0 +1,253 @@
+import bisect
+import codecs
+import re
+from collections.abc import Iterable
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+REGEX_PREFIX = 're:'
+GLOB_PREFIX = 'glob:'
+
+# Glob wildcards match inside a single token of a page (url, attribute value, word)
+GLOB_TOKEN_CHARACTER = r'[^\s"\'<>]'
+
+
+def glob_to_regex(
+        glob: str
+) -> str:
+    """Translate the glob into an unanchored regex"""
+    # Leading and trailing wildcards do not change if an unanchored glob matches
+    glob = glob.strip('*')
+    parts = []
+    index = 0
+    while index < len(glob):
+        character = glob[index]
+        index += 1
+        if character == '*':
+            parts.append(f'{GLOB_TOKEN_CHARACTER}*')
+        elif character == '?':
+            parts.append(GLOB_TOKEN_CHARACTER)
+        elif character == '[' and ']' in glob[index + 1:]:
+            end = glob.index(']', index + 1)
+            characters = glob[index:end].replace('\\', '\\\\')
+            if characters.startswith('!'):
+                characters = '^' + characters[1:]
+            parts.append(f'[{characters}]')
+            index = end + 1
+        else:
+            parts.append(re.escape(character))
+    return ''.join(parts)
+
+
+def build_trie(
+        words: Iterable[str]
+) -> dict:
+    """Build a character trie of the words, the '' key marks the end of a word"""
+    trie = {}
+    for word in words:
+        node = trie
+        for character in word:
+            node = node.setdefault(character, {})
+        node[''] = True
+    return trie
+
+
+def trie_to_regex(
+        node: dict
+) -> str:
+    """Translate the trie into a regex, that matches the longest word at a position"""
+    branches = [re.escape(character) + trie_to_regex(child)
+                for character, child in sorted(node.items()) if character]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+    return f"(?:{body})?" if '' in node else body
+
+
+class QueryMatcher:
+    """Match many queries in a single pass over a text
+
+    Literal queries are compiled into one Aho-Corasick automaton, when the
+    optional `pyahocorasick` package is installed, or into a single trie
+    shaped regex otherwise, so the matching time stays nearly flat as the
+    amount of queries grows. Queries with the `re:` and `glob:` prefixes are
+    compiled one by one, as an alternation of many regexes backtracks through
+    all of them at every position, and each of them scans the text once.
+    """
+
+    def __init__(
+            self,
+            queries: Iterable[str]
+    ) -> None:
+        self.queries = list(dict.fromkeys(query for query in queries if query))
+        self.literals = [query for query in self.queries
+                         if not query.startswith((REGEX_PREFIX, GLOB_PREFIX))]
+        self.patterns = {}
+        for query in self.queries:
+            if query.startswith(REGEX_PREFIX):
+                self.patterns[query] = query[len(REGEX_PREFIX):]
+            elif query.startswith(GLOB_PREFIX):
+                self.patterns[query] = glob_to_regex(query[len(GLOB_PREFIX):])
+
+        self.literals_trie = build_trie(self.literals)
+        self.automaton = None
+        self.literals_regex = None
+        if self.literals and ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for literal in self.literals:
+                self.automaton.add_word(literal, literal)
+            self.automaton.make_automaton()
+        elif self.literals:
+            self.literals_regex = re.compile(trie_to_regex(self.literals_trie))
+
+        self.patterns_regexes = {query: re.compile(pattern) for query, pattern in self.patterns.items()}
+
+    @classmethod
+    def from_file(
+            cls,
+            filepath: str
+    ) -> 'QueryMatcher':
+        """Load the queries from the file (one per line, '#' starts a comment line)"""
+        with open(filepath, encoding='utf-8') as file:
+            return cls(line.strip() for line in file
+                       if line.strip() and not line.lstrip().startswith('#'))
+
+    def __bool__(
+            self
+    ) -> bool:
+        return bool(self.queries)
+
+    def find_literals(
+            self,
+            text: str
+    ) -> Iterable[tuple[int, str]]:
+        """Find the start position and the literal of every literal occurrence"""
+        if self.automaton is not None:
+            for end, literal in self.automaton.iter(text):
+                yield end - len(literal) + 1, literal
+        elif self.literals_regex is not None:
+            match = self.literals_regex.search(text)
+            while match is not None:
+                # The regex matches the longest literal at a position, the shorter ones are its prefixes
+                node = self.literals_trie
+                for length, character in enumerate(match.group(), start=1):
+                    node = node[character]
+                    if '' in node:
+                        yield match.start(), match.group()[:length]
+                # Restart right after the match start to find the overlapping literals too
+                match = self.literals_regex.search(text, match.start() + 1)
+
+    def find_patterns(
+            self,
+            text: str
+    ) -> Iterable[tuple[int, str]]:
+        """Find the start position and the query of the regex and glob matches"""
+        for query, regex in self.patterns_regexes.items():
+            for match in regex.finditer(text):
+                yield match.start(), query
+
+    def find(
+            self,
+            text: str
+    ) -> Iterable[tuple[int, str]]:
+        """Find the start position and the query of all matches"""
+        yield from self.find_literals(text)
+        yield from self.find_patterns(text)
+
+    def search(
+            self,
+            text: str
+    ) -> set[str]:
+        """Get all queries found in the text"""
+        found = {query for _, query in self.find_literals(text)}
+        # The first match of a pattern is enough
+        found.update(query for query, regex in self.patterns_regexes.items() if regex.search(text))
+        return found
+
+    def search_links(
+            self,
+            links: list[str]
+    ) -> list[tuple[str, str]]:
+        """Get all (query, link) pairs of the queries found in the links.
+        The literals are found in all links at once, joined into a single text,
+        and the patterns are searched in every link apart, so they can not
+        match across two links.
+        """
+        offsets = []
+        position = 0
+        for link in links:
+            offsets.append(position)
+            position += len(link) + 1
+
+        found = {}
+        for start, query in self.find_literals('\n'.join(links)):
+            index = bisect.bisect_right(offsets, start) - 1
+            # A literal with a line break could span the separator
+            if start + len(query) <= offsets[index] + len(links[index]):
+                found[(query, links[index])] = None
+        for query, regex in self.patterns_regexes.items():
+            for link in links:
+                if regex.search(link):
+                    found[(query, link)] = None
+        return list(found)
+
+
+class StreamScanner:
+    """Search the queries in a body fed chunk by chunk
+
+    The tail of every chunk is kept and searched together with the next one,
+    so the literal matches spanning chunk boundaries are found too. Regex and
+    glob matches are found across boundaries only if they are not longer
+    than `PATTERN_OVERLAP` characters.
+    """
+
+    PATTERN_OVERLAP = 4096
+
+    def __init__(
+            self,
+            matcher: QueryMatcher,
+            encoding: str = 'utf-8'
+    ) -> None:
+        self.matcher = matcher
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self.overlap = max(
+            max((len(literal) for literal in matcher.literals), default=1) - 1,
+            self.PATTERN_OVERLAP if matcher.patterns else 0
+        )
+        self.tail = ''
+        self.size = 0
+        self.found = set()
+
+    @property
+    def is_complete(
+            self
+    ) -> bool:
+        """Check if all queries are found already"""
+        return len(self.found) == len(self.matcher.queries)
+
+    def scan(
+            self,
+            text: str
+    ) -> None:
+        """Search the text after the tail of the previous chunk"""
+        text = self.tail + text
+        self.found |= self.matcher.search(text)
+        self.tail = text[-self.overlap:] if self.overlap else ''
+
+    def feed(
+            self,
+            data: bytes
+    ) -> None:
+        """Search the next chunk of the body"""
+        self.size += len(data)
+        self.scan(self.decoder.decode(data))
+
+    def close(
+            self
+    ) -> set[str]:
+        """Search the rest of the body and get all found queries"""
+        self.scan(self.decoder.decode(b'', final=True))
+        return self.found
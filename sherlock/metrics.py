@@ -0,0 +1,212 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Generator
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Upper bounds of the latency histogram buckets (in seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Phases of processing a page
+PHASES = (
+    'download',       # scrapy download of the static response
+    'extract',        # link extraction from the static or rendered page
+    'render_get',     # driver.get of the page in a browser
+    'render_ready',   # waiting for the document ready state
+    'render_extract', # extraction of the links (and the page source) in the browser
+    'match',          # search of the queries in the links and the page source
+    'fingerprint',    # content fingerprint of the page for the near-duplicates check
+    'write',          # writing a batch of items to the result files
+)
+
+
+class Histogram:
+    """Latency histogram with fixed buckets"""
+
+    def __init__(
+            self,
+            buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ) -> None:
+        self.buckets = buckets
+        # The last count is of the values over the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def observe(
+            self,
+            value: float
+    ) -> None:
+        """Add the value to the histogram"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.count == 1 else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(
+            self,
+            q: float
+    ) -> float:
+        """Estimate the quantile, interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                # The observed extremes narrow the first and the last buckets
+                lower = max(self.min, self.buckets[index - 1] if index > 0 else 0.0)
+                upper = min(self.max, self.buckets[index] if index < len(self.buckets) else self.max)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+    def to_dict(
+            self
+    ) -> dict:
+        """Get the summary of the histogram"""
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else 0.0,
+            'p50': round(self.quantile(0.5), 6),
+            'p90': round(self.quantile(0.9), 6),
+            'p99': round(self.quantile(0.99), 6),
+            'max': round(self.max, 6),
+        }
+
+
+def get_rss(
+) -> tuple[int, int]:
+    """Get the current and the peak resident memory of the process (in bytes, 0 if unknown)"""
+    peak = 0
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports the peak in kilobytes, macOS in bytes
+        peak = peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        with open('/proc/self/statm') as file:
+            current = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        current = peak
+    return current, peak
+
+
+def escape_label(
+        value: str
+) -> str:
+    """Escape the label value for the Prometheus text exposition format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Thread-safe registry of the crawl metrics
+
+    Keeps a latency histogram per phase of processing a page, counters per
+    host and gauges (browser pool utilisation, frontier size, memory).
+    The phases of rendering are recorded from the browser pool threads.
+    """
+
+    def __init__(
+            self
+    ) -> None:
+        self.lock = threading.Lock()
+        self.histograms: dict[str, Histogram] = {phase: Histogram() for phase in PHASES}
+        self.host_counters: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.gauges: dict[str, float] = {}
+        self.started = time.monotonic()
+
+    def observe(
+            self,
+            phase: str,
+            seconds: float
+    ) -> None:
+        """Record the duration of the phase"""
+        with self.lock:
+            histogram = self.histograms.get(phase)
+            if histogram is None:
+                histogram = self.histograms[phase] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(
+            self,
+            phase: str
+    ) -> Generator[None, None, None]:
+        """Record the duration of the block as the phase"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - started)
+
+    def inc_host(
+            self,
+            host: str,
+            name: str,
+            count: int = 1
+    ) -> None:
+        """Increase the counter of the host"""
+        with self.lock:
+            self.host_counters[host][name] += count
+
+    def set_gauge(
+            self,
+            name: str,
+            value: float
+    ) -> None:
+        """Set the current value of the gauge"""
+        with self.lock:
+            self.gauges[name] = value
+
+    def to_dict(
+            self
+    ) -> dict:
+        """Get the snapshot of all metrics"""
+        with self.lock:
+            return {
+                'uptime': round(time.monotonic() - self.started, 3),
+                'phases': {phase: histogram.to_dict() for phase, histogram in self.histograms.items()},
+                'hosts': {host: dict(counters) for host, counters in self.host_counters.items()},
+                'gauges': dict(self.gauges),
+            }
+
+    def to_prometheus(
+            self,
+            prefix: str = 'sherlock'
+    ) -> str:
+        """Get all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            lines.append(f"# TYPE {prefix}_phase_seconds histogram")
+            for phase, histogram in self.histograms.items():
+                phase = escape_label(phase)
+                cumulative = 0
+                for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_phase_seconds_sum{{phase="{phase}"}} {histogram.sum}')
+                lines.append(f'{prefix}_phase_seconds_count{{phase="{phase}"}} {histogram.count}')
+
+            lines.append(f"# TYPE {prefix}_host_total counter")
+            for host, counters in self.host_counters.items():
+                host = escape_label(host)
+                for name, value in counters.items():
+                    lines.append(f'{prefix}_host_total{{host="{host}",counter="{escape_label(name)}"}} {value}')
+
+            for name, value in self.gauges.items():
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                lines.append(f"{prefix}_{name} {value}")
+        return '\n'.join(lines) + '\n'
+
@@ -7,10 +7,6 @@ from scrapy import signals
 from scrapy.http import HtmlResponse
 from scrapy.utils.python import to_bytes
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.wait import WebDriverWait
-
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
@@ -3,11 +3,232 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import csv
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+# Header rows of the csv result files
+SCRAPED_URLS_HEADER = ["URL", "Deep Level"]
+RESULT_HEADER = ["Base URL", "Search Query", "Matched URL"]
+
+
+class OffsetsMarker(threading.Event):
+    """Marker queued to the result writer, that is set with the sizes of the result files,
+    once the items queued before it are written
+    """
+
+    def __init__(
+            self
+    ) -> None:
+        super().__init__()
+        self.offsets: dict[str, int] = {}
+
+    def get_offsets(
+            self
+    ) -> dict[str, int]:
+        """Wait for the marker and get the sizes of the result files"""
+        self.wait()
+        return self.offsets
+
+
+class ResultWriter(threading.Thread):
+    """Background thread, that appends the buffered items to the result files
+
+    The files are kept open for the whole crawl and the rows are written in
+    batches, once `batch_size` items are buffered or `flush_interval` seconds
+    passed since the last write.
+    The items of a seed (in the multi-seed mode) are also appended to the
+    result files of the seed partition folder, that are opened per batch.
+    """
+
+    STOP = object()
+
+    def __init__(
+            self,
+            spider,
+            batch_size: int,
+            flush_interval: float
+    ) -> None:
+        super().__init__(name='ResultWriter', daemon=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.items = queue.Queue()
+        self.buffer = []
+        self.metrics = getattr(spider, 'metrics', None)
+        self.seeds_folder = getattr(spider, 'SEEDS_FOLDER', None)
+        self.get_data_filepaths = spider.get_data_filepaths
+        # Result files of the seed partitions written so far
+        self.partition_filepaths = set()
+
+        self.result_file = open(spider.RESULT_FILEPATH, mode='a', newline='')
+        self.result_file_txt = open(spider.RESULT_FILEPATH_TXT, mode='a')
+        self.scraped_urls_file = open(spider.SCRAPED_URLS_FILEPATH, mode='a', newline='')
+        self.scraped_urls_file_txt = open(spider.SCRAPED_URLS_FILEPATH_TXT, mode='a')
+        self.result_writer = csv.writer(self.result_file)
+        self.scraped_urls_writer = csv.writer(self.scraped_urls_file)
+
+    def run(
+            self
+    ) -> None:
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, last_flush + self.flush_interval - time.monotonic())
+            try:
+                item = self.items.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self.STOP:
+                break
+            if isinstance(item, threading.Event):
+                self.flush()
+                last_flush = time.monotonic()
+                if isinstance(item, OffsetsMarker):
+                    item.offsets = self.get_offsets()
+                item.set()
+                continue
+            if item is not None:
+                self.buffer.append(item)
+
+            if len(self.buffer) >= self.batch_size or time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+
+        self.flush()
+        self.close_files()
+
+    def flush(
+            self
+    ) -> None:
+        """Write the buffered items to the result files"""
+        if not self.buffer:
+            return
+
+        started = time.perf_counter()
+        self.write_items(self.buffer, self.result_writer, self.result_file_txt,
+                         self.scraped_urls_writer, self.scraped_urls_file_txt)
+        for file in self.files:
+            file.flush()
+        if self.seeds_folder is not None:
+            self.write_partitions(self.buffer)
+        self.buffer.clear()
+
+        if self.metrics is not None:
+            self.metrics.observe('write', time.perf_counter() - started)
+
+    @staticmethod
+    def write_items(
+            items: list[dict],
+            result_writer,
+            result_file_txt,
+            scraped_urls_writer,
+            scraped_urls_file_txt
+    ) -> None:
+        """Write the rows of the items to the result files"""
+        for item in items:
+            url, matches = item['url'], item['matches']
+            result_writer.writerows([url, query, link] for query, link in matches)
+            if matches:
+                result_file_txt.write(f"{url}\n")
+            scraped_urls_writer.writerow([url, item['url_deep_level']])
+            scraped_urls_file_txt.write(f"{url}\n")
+
+    def write_partitions(
+            self,
+            items: list[dict]
+    ) -> None:
+        """Append the items of the seeds to the result files of their partitions"""
+        seed_items = defaultdict(list)
+        for item in items:
+            if item.get('seed'):
+                seed_items[item['seed']].append(item)
+
+        for seed, items in seed_items.items():
+            filepaths = self.get_data_filepaths(os.path.join(self.seeds_folder, seed))
+            os.makedirs(os.path.dirname(filepaths['RESULT_FILEPATH']), exist_ok=True)
+            with open(filepaths['RESULT_FILEPATH'], mode='a', newline='') as result_file, \
+                    open(filepaths['RESULT_FILEPATH_TXT'], mode='a') as result_file_txt, \
+                    open(filepaths['SCRAPED_URLS_FILEPATH'], mode='a', newline='') as scraped_urls_file, \
+                    open(filepaths['SCRAPED_URLS_FILEPATH_TXT'], mode='a') as scraped_urls_file_txt:
+                result_writer = csv.writer(result_file)
+                scraped_urls_writer = csv.writer(scraped_urls_file)
+                # New partition files get the header rows first
+                if result_file.tell() == 0:
+                    result_writer.writerow(RESULT_HEADER)
+                if scraped_urls_file.tell() == 0:
+                    scraped_urls_writer.writerow(SCRAPED_URLS_HEADER)
+                self.write_items(items, result_writer, result_file_txt, scraped_urls_writer, scraped_urls_file_txt)
+                self.partition_filepaths.update(file.name for file in (
+                    result_file, result_file_txt, scraped_urls_file, scraped_urls_file_txt))
+
+    def mark_offsets(
+            self
+    ) -> OffsetsMarker:
+        """Queue a marker, that gets the sizes of the result files with the items queued so far"""
+        marker = OffsetsMarker()
+        self.items.put(marker)
+        return marker
+
+    def get_offsets(
+            self
+    ) -> dict[str, int]:
+        """Get the sizes of all result files written so far"""
+        filepaths = [file.name for file in self.files] + sorted(self.partition_filepaths)
+        return {filepath: os.path.getsize(filepath) for filepath in filepaths if os.path.isfile(filepath)}
+
+    @property
+    def files(
+            self
+    ) -> tuple:
+        """Get all result files"""
+        return self.result_file, self.result_file_txt, self.scraped_urls_file, self.scraped_urls_file_txt
+
+    def close_files(
+            self
+    ) -> None:
+        """Close all result files"""
+        for file in self.files:
+            file.close()
+
 
 class SherlockPipeline:
+    """Hand the scraped items over to the background result writer"""
+
+    def __init__(
+            self,
+            batch_size: int = 100,
+            flush_interval: float = 5.0
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            batch_size=crawler.settings.getint('SHERLOCK_WRITE_BATCH_SIZE', 100),
+            flush_interval=crawler.settings.getfloat('SHERLOCK_WRITE_FLUSH_INTERVAL', 5.0),
+        )
+
+    def open_spider(self, spider):
+        self.writer = ResultWriter(spider, self.batch_size, self.flush_interval)
+        self.writer.start()
+        # Let the spider flush the results before its checkpoints
+        spider.result_writer = self.writer
+
+    def close_spider(self, spider):
+        # Write all buffered items before the crawl finishes
+        self.writer.items.put(ResultWriter.STOP)
+        self.writer.join()
+        logging.log(logging.INFO, "Result writer flushed and closed")
+
     def process_item(self, item, spider):
+        self.writer.items.put(ItemAdapter(item).asdict())
         return item
@@ -0,0 +1,163 @@
+import threading
+from typing import Optional
+
+# When a rendered page is ready to be extracted: its load event (load), its DOM
+# content loaded event (dom), no resources loaded for a while (network-idle),
+# an element matching the CSS selector (selector:<css>) or a literal query (query) in the DOM
+READY_STRATEGIES = ('load', 'dom', 'network-idle', 'selector', 'query')
+
+# Asynchronous script run in the browser after the page is navigated to. It waits
+# for the readiness of the strategy (arguments[0]) with its argument (arguments[1])
+# using DOM events and observers, and calls back with true once the page is ready
+# or with false after the timeout (arguments[2], in milliseconds).
+READY_SCRIPT = """
+    var strategy = arguments[0], argument = arguments[1], timeout = arguments[2];
+    var done = arguments[arguments.length - 1];
+    var finished = false, observers = [], timers = [];
+    var finish = function (ready) {
+        if (finished) {
+            return;
+        }
+        finished = true;
+        observers.forEach(function (observer) { observer.disconnect(); });
+        timers.forEach(clearTimeout);
+        done(ready);
+    };
+    var check = function () {
+        try {
+            if (strategy === 'dom') {
+                return document.readyState !== 'loading';
+            } else if (strategy === 'selector') {
+                return document.querySelector(argument) !== null;
+            } else if (strategy === 'query') {
+                var html = document.documentElement.outerHTML;
+                return argument.some(function (literal) { return html.indexOf(literal) !== -1; });
+            }
+            return document.readyState === 'complete';
+        } catch (error) {
+            // An invalid selector does not hold the page up
+            return true;
+        }
+    };
+    timers.push(setTimeout(function () { finish(false); }, timeout));
+
+    if (strategy === 'network-idle') {
+        // Idle, once the document is loaded and no resource finished loading for IDLE_TIME
+        var IDLE_TIME = 500, idleTimer = null;
+        var restart = function () {
+            clearTimeout(idleTimer);
+            idleTimer = setTimeout(function () {
+                if (document.readyState === 'complete') {
+                    finish(true);
+                } else {
+                    restart();
+                }
+            }, IDLE_TIME);
+            timers.push(idleTimer);
+        };
+        if (window.PerformanceObserver) {
+            var performanceObserver = new PerformanceObserver(restart);
+            performanceObserver.observe({entryTypes: ['resource']});
+            observers.push(performanceObserver);
+        }
+        restart();
+        return;
+    }
+    if (check()) {
+        finish(true);
+        return;
+    }
+    if (strategy === 'load') {
+        window.addEventListener('load', function () { finish(true); });
+    } else if (strategy === 'dom') {
+        document.addEventListener('DOMContentLoaded', function () { finish(true); });
+    } else {
+        // Checks of the mutated DOM are throttled, serializing a big DOM on every mutation is slow
+        var scheduled = false;
+        var mutationObserver = new MutationObserver(function () {
+            if (scheduled) {
+                return;
+            }
+            scheduled = true;
+            timers.push(setTimeout(function () {
+                scheduled = false;
+                if (check()) {
+                    finish(true);
+                }
+            }, strategy === 'query' ? 100 : 0));
+        });
+        mutationObserver.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+        observers.push(mutationObserver);
+    }
+"""
+
+
+def parse_readiness(
+        value: str
+) -> tuple[str, Optional[str]]:
+    """Parse the readiness option ("strategy" or "selector:<css>") into the strategy and its argument"""
+    strategy, _, argument = value.partition(':')
+    if strategy not in READY_STRATEGIES:
+        raise ValueError(f"Unknown readiness strategy: {strategy}")
+    if strategy == 'selector' and not argument:
+        raise ValueError("The selector readiness strategy needs a CSS selector: selector:<css>")
+    return strategy, argument or None
+
+
+class AdaptiveTimeouts:
+    """Render timeouts of the hosts adapted to their observed load times
+
+    Like the retransmission timeout of TCP, the timeout of a host is its
+    smoothed load time plus four smoothed deviations, kept between
+    `min_timeout` and `max_timeout`. A new host gets `max_timeout`, and the
+    timeout of a host doubles after every page, that timed out.
+    """
+
+    SMOOTHING = 0.125
+    DEVIATION_SMOOTHING = 0.25
+    DEVIATIONS = 4
+
+    def __init__(
+            self,
+            max_timeout: float = 10.0,
+            min_timeout: float = 2.0
+    ) -> None:
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.lock = threading.Lock()
+        # Host -> smoothed load time, smoothed deviation and timeout
+        self.hosts: dict[str, tuple[float, float, float]] = {}
+
+    def get(
+            self,
+            host: str
+    ) -> float:
+        """Get the current timeout of the host"""
+        state = self.hosts.get(host)
+        return self.max_timeout if state is None else state[2]
+
+    def observe(
+            self,
+            host: str,
+            seconds: float
+    ) -> None:
+        """Adapt the timeout of the host to the load time of its page"""
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None:
+                load_time, deviation = seconds, seconds / 2
+            else:
+                load_time, deviation, _ = state
+                deviation += self.DEVIATION_SMOOTHING * (abs(seconds - load_time) - deviation)
+                load_time += self.SMOOTHING * (seconds - load_time)
+            timeout = min(self.max_timeout, max(self.min_timeout, load_time + self.DEVIATIONS * deviation))
+            self.hosts[host] = (load_time, deviation, timeout)
+
+    def timed_out(
+            self,
+            host: str
+    ) -> None:
+        """Back the timeout of the host off after its page timed out"""
+        with self.lock:
+            load_time, deviation, timeout = self.hosts.get(host, (self.max_timeout, 0.0, self.max_timeout))
+            self.hosts[host] = (load_time, deviation, min(self.max_timeout, timeout * 2))
@@ -0,0 +1,152 @@
+import logging
+from collections import Counter, defaultdict
+from typing import Optional, Union
+from urllib.parse import urlparse
+
+from parsel import Selector
+from scrapy.http import Response, TextResponse
+
+RENDER_MODES = ('always', 'auto', 'never')
+
+# Root elements of the common single page application frameworks
+SPA_ROOT_SELECTORS = (
+    '#root', '#app', '#__next', '#__nuxt', '#___gatsby', '#svelte',
+    'app-root', '[ng-app]', '[ng-version]', '[data-reactroot]',
+)
+
+
+class RenderHeuristic:
+    """Decide whether a statically downloaded page has to be rendered in a browser
+
+    The page-level checks look for a near-empty body, an empty SPA root
+    element and `<noscript>` fallbacks asking to enable JavaScript.
+    The first pages of a host without any of these signs are rendered as
+    probes and compared with their static versions, and once enough probes
+    were sampled the host gets a verdict. A "needs rendering" verdict
+    renders all pages of the host, while the pages of a host, that "does
+    not need rendering", still get the page-level checks, so its SPA pages
+    are rendered too. Pages rendered for their signs are not sampled, they
+    would gain from rendering by their selection only.
+    A probe gains, if it has half as many links more as its static version
+    (at least one more), so pages with few links are not penalised.
+    """
+
+    MIN_TEXT_LENGTH = 200
+    MIN_LINKS = 3
+    SAMPLES_PER_HOST = 3
+    LINK_GAIN_RATIO = 1.5
+    LINK_GAIN_MIN = 1
+
+    def __init__(
+            self
+    ) -> None:
+        # Probes rendered per host and the URLs of the probes, that are not sampled yet
+        self.probes = Counter()
+        self.probe_urls = set()
+        self.samples = defaultdict(list)
+        self.verdicts = {}
+
+    @staticmethod
+    def get_host(
+            url: str
+    ) -> str:
+        """Get the host the verdicts are learned for"""
+        return urlparse(url).netloc.lower()
+
+    def needs_rendering(
+            self,
+            response: Response,
+            static_links: list[str],
+            looks_dynamic: Optional[bool] = None
+    ) -> bool:
+        """Check if the response has to be rendered in a browser
+        (with the page-level checks done by a parse worker already, if `looks_dynamic` is given)
+        """
+        if not isinstance(response, TextResponse):
+            return False
+
+        host = self.get_host(response.url)
+        if self.verdicts.get(host):
+            return True
+
+        if looks_dynamic is None:
+            looks_dynamic = self.looks_dynamic(response, static_links)
+        if looks_dynamic:
+            return True
+
+        # Probe the first pages of the host, that do not look dynamic, to learn its verdict
+        if host not in self.verdicts and self.probes[host] < self.SAMPLES_PER_HOST:
+            self.probes[host] += 1
+            self.probe_urls.add(response.url)
+            return True
+        return False
+
+    def looks_dynamic(
+            self,
+            page: Union[TextResponse, Selector],
+            static_links: list[str]
+    ) -> bool:
+        """Run the page-level checks on the response (or the selector of its parsed page)"""
+        return self.is_near_empty(page, static_links) \
+            or self.has_empty_spa_root(page) \
+            or self.has_noscript_fallback(page)
+
+    def is_near_empty(
+            self,
+            page: Union[TextResponse, Selector],
+            static_links: list[str]
+    ) -> bool:
+        """Check if the body has almost no text and links"""
+        text = ''.join(page.xpath(
+            '//body//text()[not(ancestor::script) and not(ancestor::style) and not(ancestor::noscript)]'
+        ).getall())
+        return len(text.strip()) < self.MIN_TEXT_LENGTH and len(static_links) < self.MIN_LINKS
+
+    @staticmethod
+    def has_empty_spa_root(
+            page: Union[TextResponse, Selector]
+    ) -> bool:
+        """Check if the page has a SPA root element without content"""
+        for selector in SPA_ROOT_SELECTORS:
+            root = page.css(selector)
+            if root and not root[0].xpath('./*'):
+                return True
+        return False
+
+    @staticmethod
+    def has_noscript_fallback(
+            page: Union[TextResponse, Selector]
+    ) -> bool:
+        """Check if the page asks to enable JavaScript in a `<noscript>` block"""
+        text = ' '.join(page.xpath('//noscript//text()').getall())
+        return 'javascript' in text.lower()
+
+    def learn(
+            self,
+            url: str,
+            static_links_count: int,
+            rendered_links_count: int
+    ) -> None:
+        """Learn the host verdict from the links of the probe found before and after rendering"""
+        if url not in self.probe_urls:
+            return
+        self.probe_urls.discard(url)
+        host = self.get_host(url)
+        if host in self.verdicts:
+            return
+        # A page without links either way tells nothing about the host
+        if not static_links_count and not rendered_links_count:
+            return
+
+        gained = rendered_links_count >= max(
+            static_links_count * self.LINK_GAIN_RATIO,
+            static_links_count + self.LINK_GAIN_MIN,
+        )
+        samples = self.samples[host]
+        samples.append(gained)
+
+        if len(samples) >= self.SAMPLES_PER_HOST or (len(samples) > 1 and all(samples)):
+            self.verdicts[host] = sum(samples) * 2 > len(samples)
+            del self.samples[host]
+            logging.log(logging.INFO,
+                        f"Host {host} {'needs' if self.verdicts[host] else 'does not need'} rendering")
@@ -0,0 +1,370 @@
+import heapq
+import itertools
+import logging
+import re
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from scrapy import Request, Spider
+from scrapy.core.scheduler import BaseScheduler
+
+from twisted.internet import reactor
+
+CRAWL_ORDERS = ('bfs', 'dfs', 'best')
+
+URL_TOKEN_REGEX = re.compile(r'[a-z0-9]{3,}')
+
+
+class HostSlot:
+    """Queue of the pending requests of one host with its adaptive limits
+
+    The concurrency grows additively while the host answers fast and
+    without errors, and is halved (and the delay between requests doubled)
+    when its latency grows or requests fail.
+    """
+
+    LATENCY_SMOOTHING = 0.3
+    LATENCY_TOLERANCE = 2.0
+    MIN_BACKOFF_DELAY = 0.5
+
+    def __init__(
+            self,
+            max_concurrency: int,
+            max_delay: float
+    ) -> None:
+        self.queue = []
+        self.active = 0
+        self.max_concurrency = max_concurrency
+        self.max_delay = max_delay
+        self.concurrency = 1.0
+        self.delay = 0.0
+        self.next_time = 0.0
+        self.latency = None
+        self.base_latency = None
+        self.errors = 0
+
+    def is_ready(
+            self,
+            now: float
+    ) -> bool:
+        """Check if the host has a pending request, that may be sent now"""
+        return bool(self.queue) and self.active < int(self.concurrency) and self.next_time <= now
+
+    def record(
+            self,
+            latency: float,
+            failed: bool
+    ) -> None:
+        """Adjust the limits of the host to the latency and the result of a finished request"""
+        if failed:
+            self.errors += 1
+            self.concurrency = max(1.0, self.concurrency / 2)
+            self.delay = min(self.max_delay, max(self.MIN_BACKOFF_DELAY, self.delay * 2))
+            return
+
+        self.latency = latency if self.latency is None \
+            else self.latency + self.LATENCY_SMOOTHING * (latency - self.latency)
+        self.base_latency = self.latency if self.base_latency is None else min(self.base_latency, self.latency)
+
+        if self.latency <= self.base_latency * self.LATENCY_TOLERANCE:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self.delay = self.delay / 2 if self.delay > 0.01 else 0.0
+        else:
+            self.concurrency = max(1.0, self.concurrency / 2)
+
+
+class HostAwareScheduler(BaseScheduler):
+    """Scheduler with a slot per host and depth aware ordering of requests
+
+    Every host gets at most its adaptive concurrency of requests in progress
+    (downloaded or being rendered), so one huge host can not take all
+    browsers. Among the hosts with a free slot the request with the best
+    priority is taken next: the lowest deep level (bfs), the highest deep
+    level (dfs) or the best score of looking like a match of the query (best).
+    The spider reports every finished request with `request_finished`.
+
+    The links of the spider compact frontier are turned into requests only
+    when the engine asks for the next request and less than `window`
+    requests are queued, so the ordering applies to the requests of the
+    window, and the frontier beyond it is taken in its own (fifo or lifo) order.
+
+    The hosts with queued requests are kept in two heaps, so taking a request
+    costs O(log H) instead of a pass over all H hosts: the ready hosts by the
+    key of their best request, and the delayed ones by the time they may send
+    again. Hosts with no free slot are in neither, until a request of theirs
+    finishes. Heap entries are not removed, when a host changes, the ones,
+    that are out of date, are skipped when they are popped.
+    """
+
+    def __init__(
+            self,
+            crawler,
+            crawl_order: str = 'bfs',
+            host_concurrency: int = 4,
+            host_max_delay: float = 30.0,
+            window: int = 1000
+    ) -> None:
+        if crawl_order not in CRAWL_ORDERS:
+            raise ValueError(f"Unknown crawl order: {crawl_order}")
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.crawl_order = crawl_order
+        self.host_concurrency = host_concurrency
+        self.host_max_delay = host_max_delay
+        self.hosts: dict[str, HostSlot] = {}
+        # Heaps of (best request key, host) and (next allowed time, host), with the current entry of each host
+        self.ready_hosts: list[tuple[tuple, str]] = []
+        self.ready_keys: dict[str, tuple] = {}
+        self.delayed_hosts: list[tuple[float, str]] = []
+        self.delayed_times: dict[str, float] = {}
+        self.pending_count = 0
+        self.counter = itertools.count()
+        self.matcher = None
+        self.query_tokens = set()
+        self.wakeup_call = None
+        self.window = window
+        self.spider = None
+        self.frontier = None
+        self.dropped_hosts = set()
+        # Check of the spider, if the time limit of a host is over (it finishes the host then)
+        self.is_host_expired = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler,
+            crawl_order=crawler.settings.get('SHERLOCK_CRAWL_ORDER', 'bfs'),
+            host_concurrency=crawler.settings.getint('SHERLOCK_HOST_CONCURRENCY', 4),
+            host_max_delay=crawler.settings.getfloat('SHERLOCK_HOST_MAX_DELAY', 30.0),
+            window=crawler.settings.getint('SHERLOCK_SCHEDULER_WINDOW')
+            or max(100, 4 * crawler.settings.getint('CONCURRENT_REQUESTS')),
+        )
+
+    def open(self, spider: Spider) -> None:
+        self.spider = spider
+        self.frontier = getattr(spider, 'frontier', None)
+        self.dropped_hosts.update(getattr(spider, 'finished_hosts', ()))
+        self.matcher = getattr(spider, 'matcher', None)
+        self.is_host_expired = getattr(spider, 'is_host_expired', None)
+        if self.matcher is not None:
+            for literal in self.matcher.literals:
+                self.query_tokens.update(URL_TOKEN_REGEX.findall(literal.lower()))
+
+    def close(self, reason: str) -> None:
+        if self.wakeup_call is not None and self.wakeup_call.active():
+            self.wakeup_call.cancel()
+        logging.log(logging.INFO, f"Scheduler closed ({reason}) with {self.pending_count} pending requests")
+
+    def __len__(self) -> int:
+        return self.pending_count + (len(self.frontier) if self.frontier is not None else 0)
+
+    def has_pending_requests(self) -> bool:
+        return len(self) > 0
+
+    def refill(
+            self
+    ) -> None:
+        """Make the requests of the frontier links, until the window is full"""
+        if self.frontier is None:
+            return
+        while self.pending_count < self.window:
+            link = self.frontier.pop()
+            if link is None:
+                break
+            if self.dropped_hosts and urlparse(link[0]).netloc.lower() in self.dropped_hosts:
+                self.stats.inc_value('scheduler/dropped', spider=self.crawler.spider)
+                continue
+            self.enqueue_request(self.spider.make_request(*link))
+
+    @staticmethod
+    def get_host(
+            request: Request
+    ) -> str:
+        """Get the host of the request"""
+        return urlparse(request.url).netloc.lower()
+
+    def get_slot(
+            self,
+            host: str
+    ) -> HostSlot:
+        """Get the slot of the host, creating it if needed"""
+        slot = self.hosts.get(host)
+        if slot is None:
+            slot = self.hosts[host] = HostSlot(self.host_concurrency, self.host_max_delay)
+        return slot
+
+    def score(
+            self,
+            request: Request,
+            url_deep_level: int
+    ) -> float:
+        """Score how likely the URL leads to a match of the query"""
+        score = -url_deep_level
+        if self.matcher:
+            score += 10 * len(self.matcher.search(request.url))
+            score += len(self.query_tokens.intersection(URL_TOKEN_REGEX.findall(request.url.lower())))
+        return score
+
+    def get_order_key(
+            self,
+            request: Request
+    ) -> tuple:
+        """Get the key of the request in the host queue, the lowest key is taken first"""
+        url_deep_level = request.cb_kwargs.get('url_deep_level', 0)
+        if self.crawl_order == 'dfs':
+            key = -url_deep_level
+        elif self.crawl_order == 'best':
+            key = -self.score(request, url_deep_level)
+        else:
+            key = url_deep_level
+        return -request.priority, key, next(self.counter)
+
+    def enqueue_request(self, request: Request) -> bool:
+        # A redirected request carries the meta of the original one, that still holds the slot
+        original_host = request.meta.pop('sherlock_slot_host', None)
+        if original_host is not None:
+            self.release(original_host, None, failed=False)
+
+        host = self.get_host(request)
+        slot = self.get_slot(host)
+        heapq.heappush(slot.queue, (self.get_order_key(request), request))
+        self.update_host(host, time.monotonic())
+        self.pending_count += 1
+        self.stats.inc_value('scheduler/enqueued', spider=self.crawler.spider)
+        return True
+
+    def update_host(
+            self,
+            host: str,
+            now: float
+    ) -> None:
+        """Put the host into the ready or the delayed heap, if it has a queued request and a free slot"""
+        slot = self.hosts[host]
+        if not slot.queue or slot.active >= int(slot.concurrency):
+            return
+        if slot.next_time > now:
+            if self.delayed_times.get(host) != slot.next_time:
+                self.delayed_times[host] = slot.next_time
+                heapq.heappush(self.delayed_hosts, (slot.next_time, host))
+            return
+        key = slot.queue[0][0]
+        if self.ready_keys.get(host) != key:
+            self.ready_keys[host] = key
+            heapq.heappush(self.ready_hosts, (key, host))
+
+    def pop_delayed_host(
+            self
+    ) -> Optional[str]:
+        """Take the host, that may send the soonest, skipping the out of date entries"""
+        while self.delayed_hosts:
+            next_time, host = heapq.heappop(self.delayed_hosts)
+            if self.delayed_times.get(host) == next_time:
+                del self.delayed_times[host]
+                return host
+        return None
+
+    def next_request(self) -> Optional[Request]:
+        self.refill()
+        now = time.monotonic()
+        # The delayed hosts, that may send again, become ready
+        while self.delayed_hosts and self.delayed_hosts[0][0] <= now:
+            host = self.pop_delayed_host()
+            if host is not None:
+                self.update_host(host, now)
+
+        best_host = None
+        while self.ready_hosts:
+            key, host = heapq.heappop(self.ready_hosts)
+            if self.ready_keys.get(host) != key:
+                continue
+            del self.ready_keys[host]
+            slot = self.hosts[host]
+            if slot.queue and slot.queue[0][0] == key and slot.is_ready(now):
+                # The queued requests of a host out of its time are dropped by the spider
+                if self.is_host_expired is not None and self.is_host_expired(host):
+                    continue
+                best_host = host
+                break
+            self.update_host(host, now)
+
+        if best_host is None:
+            self.schedule_wakeup(now)
+            return None
+
+        slot = self.hosts[best_host]
+        _, request = heapq.heappop(slot.queue)
+        slot.active += 1
+        slot.next_time = now + slot.delay
+        self.update_host(best_host, now)
+        self.pending_count -= 1
+        request.meta['sherlock_slot_host'] = best_host
+        request.meta['sherlock_slot_started'] = now
+        self.stats.inc_value('scheduler/dequeued', spider=self.crawler.spider)
+        return request
+
+    def drop_host(
+            self,
+            host: str
+    ) -> list[Request]:
+        """Drop the queued requests of the host and skip its frontier links from now on.
+        Return the dropped requests.
+        """
+        self.dropped_hosts.add(host)
+        slot = self.hosts.get(host)
+        if slot is None or not slot.queue:
+            return []
+        dropped = [request for _, request in slot.queue]
+        slot.queue.clear()
+        self.ready_keys.pop(host, None)
+        self.delayed_times.pop(host, None)
+        self.pending_count -= len(dropped)
+        self.stats.inc_value('scheduler/dropped', len(dropped), spider=self.crawler.spider)
+        return dropped
+
+    def schedule_wakeup(
+            self,
+            now: float
+    ) -> None:
+        """Wake the engine up, when the first delayed host is ready again"""
+        while self.delayed_hosts and self.delayed_times.get(self.delayed_hosts[0][1]) != self.delayed_hosts[0][0]:
+            heapq.heappop(self.delayed_hosts)
+        if not self.delayed_hosts or (self.wakeup_call is not None and self.wakeup_call.active()):
+            return
+        self.wakeup_call = reactor.callLater(max(0.0, self.delayed_hosts[0][0] - now), self.wake_engine)
+
+    def wake_engine(
+            self
+    ) -> None:
+        """Ask the engine to take the next requests"""
+        engine_slot = getattr(self.crawler.engine, 'slot', None)
+        if engine_slot is not None:
+            engine_slot.nextcall.schedule()
+
+    def release(
+            self,
+            host: str,
+            latency: Optional[float],
+            failed: bool
+    ) -> None:
+        """Free the slot of the host and adjust its limits"""
+        slot = self.hosts.get(host)
+        if slot is None:
+            return
+        slot.active = max(0, slot.active - 1)
+        if latency is not None:
+            slot.record(latency, failed)
+        self.update_host(host, time.monotonic())
+        self.wake_engine()
+
+    def request_finished(
+            self,
+            request: Request,
+            failed: bool = False
+    ) -> None:
+        """Free the slot held by the request, once it is downloaded and processed"""
+        host = request.meta.pop('sherlock_slot_host', None)
+        if host is None:
+            return
+        latency = time.monotonic() - request.meta['sherlock_slot_started']
+        self.release(host, latency, failed)
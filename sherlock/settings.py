@@ -57,17 +57,39 @@ DOWNLOADER_MIDDLEWARES = {
    "scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware": 110,
 }
 
+# Schedule requests with a slot per host and depth aware ordering
+SCHEDULER = "sherlock.scheduler.HostAwareScheduler"
+# Order of crawling: "bfs", "dfs" or "best" (urls looking like a match of the query first)
+SHERLOCK_CRAWL_ORDER = "bfs"
+# Maximum concurrent requests per host, the actual limit adapts to the host latency and errors
+SHERLOCK_HOST_CONCURRENCY = 4
+# Maximum delay between requests to a failing host (in seconds)
+SHERLOCK_HOST_MAX_DELAY = 30.0
+# Requests made of the queued links at once (0 is 4 * CONCURRENT_REQUESTS) and memory of the queued links
+SHERLOCK_SCHEDULER_WINDOW = 0
+SHERLOCK_FRONTIER_MEMORY = 64 * 1024 * 1024
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "sherlock.extensions.MetricsExtension": 500,
+}
+
+# Publish the metrics to the stats and the dump file (and a local Prometheus endpoint, if the port is set)
+SHERLOCK_METRICS_INTERVAL = 10.0
+SHERLOCK_METRICS_DUMP_PATH = "results/metrics.json"
+SHERLOCK_METRICS_PORT = 0
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "sherlock.pipelines.SherlockPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "sherlock.pipelines.SherlockPipeline": 300,
+}
+
+# Write the result files in batches of items or after the interval (in seconds)
+SHERLOCK_WRITE_BATCH_SIZE = 100
+SHERLOCK_WRITE_FLUSH_INTERVAL = 5.0
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -0,0 +1,335 @@
+import logging
+import os
+import shutil
+import sqlite3
+import zlib
+from abc import ABC, abstractmethod
+from collections.abc import Generator, Iterable
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from sherlock.visited import VisitedSet
+
+
+def get_shard(
+        url: str,
+        shards: int
+) -> int:
+    """Get the shard owning the hostname of the URL"""
+    return zlib.crc32(urlparse(url).netloc.lower().encode('utf-8')) % shards
+
+
+class FrontierService(ABC):
+    """Shared frontier, that the shard workers exchange discovered links through
+
+    Every shard has its own inbox of (url, deep level) links and an idle
+    flag. The crawl is finished, when all shards are idle and all inboxes
+    are empty, so no worker can get any new link anymore.
+    """
+
+    @abstractmethod
+    def register(
+            self,
+            shards: int
+    ) -> None:
+        """Register all shards as busy (if they are not registered yet)"""
+
+    @abstractmethod
+    def push(
+            self,
+            links: Iterable[tuple[int, str, int]]
+    ) -> None:
+        """Put the (shard, url, deep level) links into the inboxes of their shards"""
+
+    @abstractmethod
+    def pop(
+            self,
+            shard: int,
+            limit: int
+    ) -> list[tuple[str, int]]:
+        """Take up to limit (url, deep level) links from the shard inbox.
+        The shard is marked as busy, if it got any links.
+        """
+
+    @abstractmethod
+    def set_idle(
+            self,
+            shard: int
+    ) -> bool:
+        """Mark the shard as idle, if its inbox is empty. Return if it was marked"""
+
+    @abstractmethod
+    def is_finished(
+            self
+    ) -> bool:
+        """Check if all shards are idle and all inboxes are empty"""
+
+    def close(
+            self
+    ) -> None:
+        """Release the connection to the service"""
+
+
+class SqliteFrontierService(FrontierService):
+    """Frontier in a SQLite database file, shared by the worker processes of one host"""
+
+    def __init__(
+            self,
+            path: str
+    ) -> None:
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS links '
+            '(id INTEGER PRIMARY KEY AUTOINCREMENT, shard INTEGER, url TEXT, url_deep_level INTEGER)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS links_shard ON links (shard, id)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS workers (shard INTEGER PRIMARY KEY, idle INTEGER)')
+
+    @contextmanager
+    def transaction(
+            self,
+            mode: str = 'IMMEDIATE'
+    ) -> Generator[sqlite3.Connection, None, None]:
+        """Run the statements in one transaction, that locks the database for writing by default"""
+        self.connection.execute(f'BEGIN {mode}')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def register(
+            self,
+            shards: int
+    ) -> None:
+        with self.transaction():
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO workers (shard, idle) VALUES (?, 0)',
+                ((shard,) for shard in range(shards))
+            )
+
+    def push(
+            self,
+            links: Iterable[tuple[int, str, int]]
+    ) -> None:
+        with self.transaction():
+            self.connection.executemany('INSERT INTO links (shard, url, url_deep_level) VALUES (?, ?, ?)', links)
+
+    def pop(
+            self,
+            shard: int,
+            limit: int
+    ) -> list[tuple[str, int]]:
+        with self.transaction():
+            rows = self.connection.execute(
+                'SELECT id, url, url_deep_level FROM links WHERE shard = ? ORDER BY id LIMIT ?', (shard, limit)
+            ).fetchall()
+            if rows:
+                self.connection.execute('DELETE FROM links WHERE shard = ? AND id <= ?', (shard, rows[-1][0]))
+                self.connection.execute('UPDATE workers SET idle = 0 WHERE shard = ?', (shard,))
+        return [(url, url_deep_level) for _, url, url_deep_level in rows]
+
+    def set_idle(
+            self,
+            shard: int
+    ) -> bool:
+        with self.transaction():
+            has_links = self.connection.execute(
+                'SELECT EXISTS (SELECT 1 FROM links WHERE shard = ?)', (shard,)
+            ).fetchone()[0]
+            if not has_links:
+                self.connection.execute('UPDATE workers SET idle = 1 WHERE shard = ?', (shard,))
+        return not has_links
+
+    def is_finished(
+            self
+    ) -> bool:
+        with self.transaction('DEFERRED'):
+            busy = self.connection.execute('SELECT COUNT(*) FROM workers WHERE idle = 0').fetchone()[0]
+            has_links = self.connection.execute('SELECT EXISTS (SELECT 1 FROM links)').fetchone()[0]
+        return not busy and not has_links
+
+    def close(
+            self
+    ) -> None:
+        self.connection.close()
+
+
+class RedisFrontierService(FrontierService):
+    """Frontier in a Redis-compatible server, shared by the workers of many hosts
+
+    Popping links and checking for the end of the crawl are done by Lua
+    scripts, so they are atomic on the server.
+    """
+
+    POP_SCRIPT = """
+        local links = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+        if #links > 0 then
+            redis.call('LTRIM', KEYS[1], #links, -1)
+            redis.call('HSET', KEYS[2], ARGV[2], 0)
+        end
+        return links
+    """
+    SET_IDLE_SCRIPT = """
+        if redis.call('LLEN', KEYS[1]) > 0 then
+            return 0
+        end
+        redis.call('HSET', KEYS[2], ARGV[1], 1)
+        return 1
+    """
+    IS_FINISHED_SCRIPT = """
+        local workers = redis.call('HGETALL', KEYS[1])
+        for i = 2, #workers, 2 do
+            if workers[i] ~= '1' then
+                return 0
+            end
+            if redis.call('LLEN', ARGV[1] .. workers[i - 1]) > 0 then
+                return 0
+            end
+        end
+        return 1
+    """
+
+    def __init__(
+            self,
+            url: str,
+            prefix: str = 'sherlock'
+    ) -> None:
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.workers_key = f"{prefix}:workers"
+        self.pop_script = self.client.register_script(self.POP_SCRIPT)
+        self.set_idle_script = self.client.register_script(self.SET_IDLE_SCRIPT)
+        self.is_finished_script = self.client.register_script(self.IS_FINISHED_SCRIPT)
+
+    def get_inbox_key(
+            self,
+            shard: int
+    ) -> str:
+        """Get the key of the shard inbox list"""
+        return f"{self.prefix}:inbox:{shard}"
+
+    def register(
+            self,
+            shards: int
+    ) -> None:
+        for shard in range(shards):
+            self.client.hsetnx(self.workers_key, shard, 0)
+
+    def push(
+            self,
+            links: Iterable[tuple[int, str, int]]
+    ) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        for shard, url, url_deep_level in links:
+            pipeline.rpush(self.get_inbox_key(shard), f"{url_deep_level}\t{url}")
+        pipeline.execute()
+
+    def pop(
+            self,
+            shard: int,
+            limit: int
+    ) -> list[tuple[str, int]]:
+        links = self.pop_script(keys=[self.get_inbox_key(shard), self.workers_key], args=[limit, shard])
+        result = []
+        for link in links:
+            url_deep_level, url = link.decode('utf-8').split('\t', 1)
+            result.append((url, int(url_deep_level)))
+        return result
+
+    def set_idle(
+            self,
+            shard: int
+    ) -> bool:
+        return bool(self.set_idle_script(keys=[self.get_inbox_key(shard), self.workers_key], args=[shard]))
+
+    def is_finished(
+            self
+    ) -> bool:
+        return bool(self.is_finished_script(keys=[self.workers_key], args=[f"{self.prefix}:inbox:"]))
+
+    def close(
+            self
+    ) -> None:
+        self.client.close()
+
+
+def make_frontier_service(
+        uri: str
+) -> FrontierService:
+    """Create the frontier service for the URI (sqlite:///path or redis://host:port/db)"""
+    if uri.startswith('sqlite:///'):
+        return SqliteFrontierService(uri[len('sqlite:///'):])
+    if uri.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisFrontierService(uri)
+    raise ValueError(f"Unknown frontier service: {uri}")
+
+
+# Data files of a results folder (and of a seed partition folder) and if they have a header row
+DATA_FILES = (
+    ("scraped_urls.csv", True),
+    ("scraped_urls.txt", False),
+    ("result.csv", True),
+    ("result.txt", False),
+)
+
+
+def append_files(
+        source_filepaths: Iterable[str],
+        target_filepath: str,
+        has_header: bool
+) -> None:
+    """Append the files to the target file, keeping a single header row"""
+    with open(target_filepath, 'ab') as target:
+        for filepath in source_filepaths:
+            if not os.path.isfile(filepath):
+                continue
+            with open(filepath, 'rb') as source:
+                if has_header and target.tell() > 0:
+                    source.readline()
+                shutil.copyfileobj(source, target)
+
+
+def merge_shard_results(
+        shard_folders: list[str],
+        results_folder: str
+) -> None:
+    """Append the data files of the shards to the data files of the results folder
+    (and of their seed partitions and summaries in the multi-seed mode).
+    """
+    for filename, has_header in DATA_FILES:
+        append_files([os.path.join(shard_folder, filename) for shard_folder in shard_folders],
+                     os.path.join(results_folder, filename), has_header)
+
+    seed_filepaths = [os.path.join(shard_folder, "seeds.csv") for shard_folder in shard_folders]
+    if any(os.path.isfile(filepath) for filepath in seed_filepaths):
+        append_files(seed_filepaths, os.path.join(results_folder, "seeds.csv"), has_header=True)
+    for shard_folder in shard_folders:
+        shard_seeds_folder = os.path.join(shard_folder, "seeds")
+        if not os.path.isdir(shard_seeds_folder):
+            continue
+        for seed in os.listdir(shard_seeds_folder):
+            seed_folder = os.path.join(results_folder, "seeds", seed)
+            os.makedirs(seed_folder, exist_ok=True)
+            for filename, has_header in DATA_FILES:
+                append_files([os.path.join(shard_seeds_folder, seed, filename)],
+                             os.path.join(seed_folder, filename), has_header)
+    logging.log(logging.INFO, f"Merged results of {len(shard_folders)} shards into {results_folder}")
+
+
+def merge_shard_visited(
+        shard_folders: list[str],
+        visited: VisitedSet,
+        results_folder: str
+) -> None:
+    """Merge the visited set snapshots of the shards and save the merged one to the results folder"""
+    for shard_folder in shard_folders:
+        snapshot_path = os.path.join(shard_folder, "visited.snapshot")
+        if os.path.isfile(snapshot_path):
+            visited.merge(snapshot_path)
+    visited.save(os.path.join(results_folder, "visited.snapshot"))
+    logging.log(logging.INFO, f"Merged visited urls of {len(shard_folders)} shards: {len(visited)} urls")
@@ -0,0 +1,157 @@
+import re
+import zlib
+from typing import Optional
+from urllib.parse import urljoin
+
+from lxml import etree
+
+# Maximum decompressed size of a sitemap (twice the 50 MB limit of the sitemaps protocol)
+MAX_SITEMAP_SIZE = 100 * 1024 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+ROBOTS_SITEMAP_REGEX = re.compile(r'^\s*sitemap\s*:\s*(\S+)', re.IGNORECASE | re.MULTILINE)
+
+
+def get_robots_url(
+        url: str
+) -> str:
+    """Get the robots.txt URL of the URL host"""
+    return urljoin(url, '/robots.txt')
+
+
+def get_robots_sitemaps(
+        robots_url: str,
+        text: str
+) -> list[str]:
+    """Get the sitemap URLs of the robots.txt (or the default sitemap, if it has none)"""
+    sitemaps = [urljoin(robots_url, match.group(1)) for match in ROBOTS_SITEMAP_REGEX.finditer(text)]
+    return list(dict.fromkeys(sitemaps)) or [urljoin(robots_url, '/sitemap.xml')]
+
+
+def get_local_name(
+        tag
+) -> Optional[str]:
+    """Get the tag name without its namespace (None for comments and processing instructions)"""
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else None
+
+
+class SitemapParser:
+    """Incremental parser of a sitemap or a sitemap index
+
+    It is fed with the downloaded chunks, gunzips them on the fly (gzipped
+    files and gzip content encoding are detected by their magic bytes) and
+    parses them with a pull parser, dropping every parsed entry, so neither
+    the decompressed document nor its tree are kept in memory.
+    Every call returns the (kind, url) entries parsed so far, where the kind
+    is `url` for a page and `sitemap` for a nested sitemap. Plain text
+    sitemaps (a URL per line) are supported too. A broken sitemap keeps
+    the entries parsed before the error, and the rest of it is ignored.
+    """
+
+    def __init__(
+            self
+    ) -> None:
+        self.header = b''
+        self.decompressor = None
+        self.parser = None
+        self.text_tail: Optional[str] = None
+        self.started = False
+        self.broken = False
+        self.size = 0
+
+    def feed(
+            self,
+            data: bytes
+    ) -> list[tuple[str, str]]:
+        """Parse the next chunk of the downloaded sitemap"""
+        if self.broken:
+            return []
+        if not self.started:
+            # The format is detected by the first bytes
+            self.header += data
+            if len(self.header) < len(GZIP_MAGIC):
+                return []
+            data, self.header = self.header, b''
+            if data.startswith(GZIP_MAGIC):
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self.started = True
+        if self.decompressor is not None:
+            try:
+                data = self.decompressor.decompress(data)
+            except zlib.error:
+                self.broken = True
+                return []
+        return self.parse(data)
+
+    def parse(
+            self,
+            data: bytes
+    ) -> list[tuple[str, str]]:
+        """Parse the next chunk of the decompressed sitemap"""
+        self.size += len(data)
+        if self.parser is None and self.text_tail is None:
+            stripped = data.lstrip(b'\xef\xbb\xbf \t\r\n')
+            if not stripped:
+                return []
+            if stripped.startswith(b'<'):
+                self.parser = etree.XMLPullParser(events=('end',), resolve_entities=False, no_network=True)
+            else:
+                self.text_tail = ''
+
+        if self.parser is None:
+            lines = (self.text_tail + data.decode('utf-8', errors='replace')).split('\n')
+            self.text_tail = lines.pop()
+            return [('url', line.strip()) for line in lines if line.strip()]
+
+        try:
+            self.parser.feed(data)
+        except etree.XMLSyntaxError:
+            self.broken = True
+        return self.read_entries()
+
+    def read_entries(
+            self
+    ) -> list[tuple[str, str]]:
+        """Take the entries parsed by the pull parser and drop their elements"""
+        entries = []
+        for _, element in self.parser.read_events():
+            name = get_local_name(element.tag)
+            if name == 'loc':
+                parent = element.getparent()
+                kind = get_local_name(parent.tag) if parent is not None else None
+                if kind in ('url', 'sitemap') and element.text and element.text.strip():
+                    entries.append((kind, element.text.strip()))
+            elif name in ('url', 'sitemap'):
+                element.clear()
+                # The parsed entries before this one are removed from the root too
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+        return entries
+
+    def close(
+            self
+    ) -> list[tuple[str, str]]:
+        """Parse the rest of the sitemap"""
+        entries = []
+        if self.broken:
+            return entries
+        if not self.started and self.header:
+            self.started = True
+            entries += self.parse(self.header)
+        if self.decompressor is not None:
+            try:
+                entries += self.parse(self.decompressor.flush())
+            except zlib.error:
+                self.broken = True
+        if self.parser is not None:
+            try:
+                self.parser.close()
+            except etree.XMLSyntaxError:
+                # A truncated sitemap keeps the entries parsed before the error
+                self.broken = True
+            entries += self.read_entries()
+        elif self.text_tail and self.text_tail.strip():
+            entries.append(('url', self.text_tail.strip()))
+            self.text_tail = ''
+        return entries
@@ -1,27 +1,58 @@
 import csv
+import functools
+import hashlib
+import itertools
 import logging
 import os.path
+import shutil
+import time
+from collections import Counter
 from collections.abc import Generator
-from typing import Any
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Any, Optional
 
+import lxml.html
 import scrapy
 
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urlparse
 
-from scrapy.http import HtmlResponse
-from scrapy.utils.python import to_bytes
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider, StopDownload
+
+from scrapy.http import Response, TextResponse
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.defer import maybe_deferred_to_future
 from scrapy.spiders import CrawlSpider
+from scrapy.utils.misc import load_object
 # from scrapy.linkextractors import LinkExtractor
 
-from selenium import webdriver
-from selenium.common import TimeoutException
-from selenium.webdriver.chrome.options import Options as ChromeOptions
-from selenium.webdriver.firefox.options import Options as FirefoxOptions
-from selenium.webdriver.edge.options import Options as EdgeOptions
-from selenium.webdriver.safari.options import Options as SafariOptions
-from selenium.webdriver.support.wait import WebDriverWait
+from twisted.internet.defer import Deferred
+from twisted.internet.error import DNSLookupError, TimeoutError as DownloadTimeoutError
+from twisted.internet.task import LoopingCall
+
+from sherlock.assets import is_asset_response, is_asset_url
+from sherlock.browser_pool import BrowserPool, BrowserUnavailableError
+from sherlock.browser_profile import DEFAULT_BLOCKED_PATTERNS, LeanProfile
+from sherlock.cache import CacheEntry, RenderCache
+from sherlock.canonical import DEFAULT_STRIP_PARAMS, NearDuplicateIndex, UrlCanonicalizer, get_simhash
+from sherlock.drivers import BROWSERS, get_timeout_errors, make_driver
+from sherlock.extraction import extract_links, extract_text
+from sherlock.frontier import CompactFrontier
+from sherlock.items import SherlockItem
+from sherlock.matching import QueryMatcher, StreamScanner
+from sherlock.metrics import Metrics
+from sherlock.pipelines import RESULT_HEADER, SCRAPED_URLS_HEADER
+from sherlock.readiness import parse_readiness
+from sherlock.rendering import RenderHeuristic
+from sherlock.scheduler import HostAwareScheduler
+from sherlock.sharding import get_shard, make_frontier_service
+from sherlock.sitemaps import MAX_SITEMAP_SIZE, SitemapParser, get_robots_sitemaps, get_robots_url
+from sherlock.state import CrawlState, get_file_sizes
+from sherlock.visited import make_visited_set
+from sherlock.workers import ParseWorkerPool, StaticPage
 
-from twisted.internet.error import DNSLookupError
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
 
 CUSTOM_PRINT_LOG_LEVEL = 60
 logging.addLevelName(CUSTOM_PRINT_LOG_LEVEL, 'CUSTOM_PRINT_LOG_LEVEL')
@@ -37,11 +68,21 @@ class CodeBlockSpider(CrawlSpider):
     RESULTS_FOLDER = 'results'
     retry_enabled = False
 
+    # Interval and batch size of taking links of the shard from the frontier service
+    FRONTIER_POLL_INTERVAL = 1.0
+    FRONTIER_POLL_LIMIT = 1000
+
+    # Requests of robots.txt and sitemaps are taken before the pages of their host
+    SITEMAP_PRIORITY = 100
+
     # Data files
     SCRAPED_URLS_FILEPATH = os.path.join(RESULTS_FOLDER, "scraped_urls.csv")
     SCRAPED_URLS_FILEPATH_TXT = os.path.join(RESULTS_FOLDER, "scraped_urls.txt")
     RESULT_FILEPATH = os.path.join(RESULTS_FOLDER, "result.csv")
     RESULT_FILEPATH_TXT = os.path.join(RESULTS_FOLDER, "result.txt")
+    VISITED_FILEPATH = os.path.join(RESULTS_FOLDER, "visited.bin")
+    SEEDS_FILEPATH = os.path.join(RESULTS_FOLDER, "seeds.csv")
+    SEEDS_FOLDER = None
 
     def __init__(
             self,
@@ -51,104 +92,727 @@ class CodeBlockSpider(CrawlSpider):
             parsed_links_limit_per_url: int,
             max_url_deep_level: int,
             full_search: bool,
+            browser_pool_size: int = 1,
+            browser: str = 'auto',
+            render_mode: str = 'auto',
+            visited_backend: str = 'memory',
+            visited_error_rate: float = 0.001,
+            queries_file: Optional[str] = None,
+            state_dir: Optional[str] = None,
+            checkpoint_interval: float = 60.0,
+            results_folder: Optional[str] = None,
+            shard_id: int = 0,
+            shards: int = 1,
+            frontier_uri: Optional[str] = None,
+            cache_dir: Optional[str] = None,
+            cache_size: int = 1024 * 1024 * 1024,
+            lean_render: bool = False,
+            blocked_patterns: Optional[list[str]] = None,
+            browser_profile_dir: Optional[str] = None,
+            max_asset_size: int = 5 * 1024 * 1024,
+            stop_after_matches: int = 0,
+            stop_host_on_match: bool = False,
+            max_pages_per_host: int = 0,
+            max_time_per_host: float = 0.0,
+            canonicalize: bool = True,
+            strip_params: Optional[list[str]] = None,
+            strip_trailing_slash: bool = True,
+            near_duplicate_distance: int = 0,
+            seeds_file: Optional[str] = None,
+            max_pages_per_seed: int = 0,
+            ready: str = 'load',
+            render_timeout: float = 10.0,
+            sitemaps: bool = False,
+            parse_workers: int = 0,
             *args,
             **kwargs
     ) -> None:
         super().__init__(*args, **kwargs)
-        self.start_urls = [start_point]
+        if results_folder is not None:
+            self.RESULTS_FOLDER = results_folder
+            for name, filepath in self.get_data_filepaths(results_folder).items():
+                setattr(self, name, filepath)
+        # Many start points are streamed from the seeds file instead of the single one
+        self.seeds_file = seeds_file
+        self.start_urls = [] if seeds_file else [start_point]
+        if seeds_file:
+            self.SEEDS_FOLDER = os.path.join(self.RESULTS_FOLDER, "seeds")
+        self.max_pages_per_seed = max_pages_per_seed
+        # Seeds taken from the file, the seeds of the hosts (partition names) and the seed counters
+        self.seeds_read = 0
+        self.host_seeds: dict[str, str] = {}
+        self.seed_stats: dict[str, dict[str, Any]] = {}
         self.domain_zone = "" if domain_zone.lower() in ("any", "*") else domain_zone
         self.query = query
+        self.matcher = QueryMatcher.from_file(queries_file) if queries_file else QueryMatcher([query])
         self.PARSED_LINKS_LIMIT_PER_URL = parsed_links_limit_per_url
         self.MAXIMUM_URL_DEEP_LEVEL = max_url_deep_level
         self.enable_full_search = full_search
-        self.processed_links = []
+        # Cached matches are reused only for the same queries and search mode
+        self.queries_hash = hashlib.sha1(
+            '\n'.join([*self.matcher.queries, str(full_search)]).encode('utf-8')
+        ).hexdigest()
+        self.render_cache = RenderCache(cache_dir, cache_size) if cache_dir else None
+        # Scanners of the assets (.js, .css) being downloaded, that are searched chunk by chunk
+        self.asset_scanners: dict[scrapy.Request, StreamScanner] = {}
+        self.max_asset_size = max_asset_size
+        # The links of the sitemaps (found in robots.txt of the seeds) are seeded before the crawl
+        self.sitemaps = sitemaps
+        self.sitemap_urls = set()
+        self.sitemap_parsers: dict[scrapy.Request, SitemapParser] = {}
+        self.render_mode = render_mode
+        self.readiness = parse_readiness(ready)
+        if self.readiness[0] == 'query' and not self.matcher.literals:
+            # Regexes and globs can not be awaited in the page, and no literal would ever appear
+            logging.log(logging.WARNING, "The query readiness strategy needs a literal query, "
+                                         "pages are awaited until their network is idle instead")
+            self.readiness = ('network-idle', None)
+        self.render_heuristic = RenderHeuristic()
+        # Static pages are parsed and searched in worker processes, keeping the reactor thread for I/O
+        self.parse_pool = ParseWorkerPool(
+            parse_workers, self.matcher.queries, full_search
+        ) if parse_workers > 0 else None
+        # Variants of a URL are visited once, and links of near-duplicate pages are not followed
+        self.canonicalizer = UrlCanonicalizer(
+            DEFAULT_STRIP_PARAMS if strip_params is None else strip_params,
+            strip_trailing_slash=strip_trailing_slash
+        ) if canonicalize else None
+        self.near_duplicates = NearDuplicateIndex(near_duplicate_distance) if near_duplicate_distance > 0 else None
+        # Timings of the phases of processing pages, published by the metrics extension
+        self.metrics = Metrics()
+        self.first_match_seconds = None
+
+        # Early stop: the whole crawl after a number of matched pages, and a host
+        # after its first matched page, a number of pages or seconds since its first page
+        self.stop_after_matches = stop_after_matches
+        self.stop_host_on_match = stop_host_on_match
+        self.max_pages_per_host = max_pages_per_host
+        self.max_time_per_host = max_time_per_host
+        self.matched_pages = 0
+        self.host_pages = Counter()
+        self.host_started: dict[str, float] = {}
+        self.finished_hosts = set()
+        self.stopping = False
 
-        self.selenium_driver = None
-        self.configure_selenium_driver()
+        # Links waiting for a free downloader slot (created with the crawler, as they depend on the scheduler)
+        self.frontier: Optional[CompactFrontier] = None
+        # Requests made of the frontier links (url -> deep level), that are also saved on checkpoints
+        self.pending = {}
+        self.state = CrawlState(state_dir) if state_dir else None
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_loop = None
+        self.resumed = self.state is not None and self.state.exists()
+
+        self.visited = make_visited_set(
+            visited_backend,
+            visited_error_rate,
+            self.VISITED_FILEPATH,
+            snapshot_path=self.state.visited_snapshot_path if self.resumed else None
+        )
+        for url in self.start_urls:
+            self.visited.add(self.get_visited_key(url))
+        self.processed_count = 0
+
+        # Sharded crawl, where the worker owns the hostnames of its shard only
+        self.shard_id = shard_id
+        self.shards = shards
+        self.frontier_service = make_frontier_service(frontier_uri) if shards > 1 else None
+        self.frontier_loop = None
+        if self.frontier_service is not None:
+            self.frontier_service.register(shards)
+        if self.resumed:
+            self.processed_count = self.state.meta.get('processed_count', 0)
+            self.matched_pages = self.state.meta.get('matched_pages', 0)
+            self.host_pages.update(self.state.meta.get('host_pages', {}))
+            self.finished_hosts.update(self.state.meta.get('finished_hosts', []))
+            self.seeds_read = self.state.meta.get('seeds_read', 0)
+            self.host_seeds.update(self.state.meta.get('host_seeds', {}))
+            self.seed_stats.update(self.state.meta.get('seed_stats', {}))
+            self.render_heuristic.verdicts.update(self.state.meta.get('render_verdicts', {}))
+            self.state.restore_outputs(self.SEEDS_FOLDER)
+
+        if browser not in BROWSERS:
+            raise ValueError(f"Unknown browser: {browser}")
+        self.browser = browser
+        # Without a browser only the static pages are searched
+        if browser == 'none':
+            self.render_mode = 'never'
+        self.lean_profile = None
+        if lean_render:
+            self.lean_profile = LeanProfile(
+                DEFAULT_BLOCKED_PATTERNS if blocked_patterns is None else blocked_patterns,
+                template_dir=browser_profile_dir
+            )
+
+        # The drivers are started in the background: right away if every page is rendered,
+        # otherwise once the first page needs rendering
+        self.browser_pool = None
+        if self.render_mode != 'never':
+            strategy, argument = self.readiness
+            self.browser_pool = BrowserPool(
+                self.configure_selenium_driver,
+                size=browser_pool_size,
+                metrics=self.metrics,
+                timeout_errors=get_timeout_errors(browser),
+                # The query strategy waits for any of the literal queries
+                readiness=(strategy, self.matcher.literals if strategy == 'query' else argument),
+                max_timeout=render_timeout
+            )
+            self.browser_pool.start(warm=self.render_mode == 'always')
 
     def configure_selenium_driver(
             self
+    ) -> 'WebDriver':
+        """Configure a new Selenium driver (on a browser pool thread)"""
+        # The strategies other than the load event are awaited in the page from its DOM content loaded event
+        page_load_strategy = 'normal' if self.readiness[0] == 'load' else 'eager'
+        return make_driver(self.browser, self.lean_profile, page_load_strategy)
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(spider.spider_error, signal=signals.spider_error)
+        crawler.signals.connect(spider.bytes_received, signal=signals.bytes_received)
+
+        # The host aware scheduler makes requests of the compact frontier links lazily
+        if issubclass(load_object(crawler.settings['SCHEDULER']), HostAwareScheduler):
+            spider.frontier = CompactFrontier(
+                os.path.join(spider.RESULTS_FOLDER, "frontier"),
+                memory_limit=crawler.settings.getint('SHERLOCK_FRONTIER_MEMORY', 64 * 1024 * 1024),
+                lifo=crawler.settings.get('SHERLOCK_CRAWL_ORDER') == 'dfs'
+            )
+        return spider
+
+    def spider_opened(
+            self
     ) -> None:
-        """Configure Selenium driver"""
-        import browsers
-
-        available_browsers = {item['browser_type'] for item in browsers.browsers()}
-
-        if {"chrome", "chromium"} & available_browsers:
-            browser_options = ChromeOptions()
-            browser_options.add_argument('--headless')
-            browser_options.add_argument('--ignore-certificate-errors')
-            browser_options.add_argument('--incognito')
-            self.selenium_driver = webdriver.Chrome(options=browser_options)
-        elif {"firefox"} & available_browsers:
-            browser_options = FirefoxOptions()
-            browser_options.add_argument('-headless')
-            self.selenium_driver = webdriver.Firefox(options=browser_options)
-        elif {"msedge"} & available_browsers:
-            browser_options = EdgeOptions()
-            browser_options.add_argument('--headless')
-            browser_options.add_argument('--ignore-certificate-errors')
-            browser_options.add_argument('--incognito')
-            self.selenium_driver = webdriver.Edge(options=browser_options)
-        elif {"safari"} & available_browsers:
-            browser_options = SafariOptions()
-            self.selenium_driver = webdriver.Safari(options=browser_options)
-
-        self.selenium_driver.set_page_load_timeout(10)
+        """Start the periodic checkpoints and polling of the frontier service"""
+        if self.state is not None:
+            self.checkpoint_loop = LoopingCall(self.checkpoint)
+            self.checkpoint_loop.start(self.checkpoint_interval, now=False)
+        if self.frontier_service is not None:
+            self.frontier_loop = LoopingCall(self.poll_frontier)
+            self.frontier_loop.start(self.FRONTIER_POLL_INTERVAL)
 
-    def get_start_url_repr(
+    def spider_idle(
             self
+    ) -> None:
+        """Keep the shard worker open, until all shards are finished"""
+        if self.frontier_service is None:
+            return
+        if self.poll_frontier():
+            raise DontCloseSpider
+        if not self.frontier_service.set_idle(self.shard_id) or not self.frontier_service.is_finished():
+            raise DontCloseSpider
+
+    def poll_frontier(
+            self
+    ) -> int:
+        """Schedule the links sent to the shard by the other workers"""
+        links = self.frontier_service.pop(self.shard_id, self.FRONTIER_POLL_LIMIT)
+        for url, url_deep_level in links:
+            if self.visited.add(self.get_visited_key(url)):
+                self.schedule_link(url, url_deep_level)
+        return len(links)
+
+    def get_visited_key(
+            self,
+            url: str
     ) -> str:
-        """Get the start URL representation"""
-        return str(urlparse(self.start_urls[0]).netloc).replace(".", "_")
+        """Get the form of the URL, that the visited set keeps"""
+        return self.canonicalizer.canonicalize(url) if self.canonicalizer is not None else url
+
+    def is_own_link(
+            self,
+            url: str
+    ) -> bool:
+        """Check if the URL belongs to the shard of the worker"""
+        return self.shards <= 1 or get_shard(url, self.shards) == self.shard_id
+
+    def item_scraped(
+            self,
+            item: SherlockItem,
+            response: Response
+    ) -> None:
+        """Remove the request of the item from pending, once it is handed to the result writer"""
+        self.finish_request(response.request)
+
+    def bytes_received(
+            self,
+            data: bytes,
+            request: scrapy.Request
+    ) -> None:
+        """Search the next chunk of a downloading asset (or parse the next chunk of a sitemap).
+        Stop the download once all queries are found or the size limit is reached.
+        """
+        if request.meta.get('sherlock_sitemap'):
+            parser = self.sitemap_parsers.get(request)
+            if parser is None:
+                parser = self.sitemap_parsers[request] = SitemapParser()
+            self.seed_sitemap_entries(parser.feed(data), request.meta.get('sherlock_seed'))
+            if parser.broken or parser.size >= MAX_SITEMAP_SIZE:
+                raise StopDownload(fail=False)
+            return
+        if not request.meta.get('sherlock_asset'):
+            return
+        scanner = self.asset_scanners.get(request)
+        if scanner is None:
+            scanner = self.asset_scanners[request] = StreamScanner(self.matcher)
+        scanner.feed(data)
+        if scanner.is_complete or scanner.size >= self.max_asset_size:
+            raise StopDownload(fail=False)
+
+    def spider_error(
+            self,
+            failure,
+            response: Response
+    ) -> None:
+        """Finish the request, which callback raised an exception"""
+        self.finish_request(response.request, failed=True)
+
+    def finish_request(
+            self,
+            request: scrapy.Request,
+            failed: bool = False
+    ) -> None:
+        """Remove the request from pending (by its URL before any redirects)
+        and free its host slot in the scheduler.
+        """
+        self.pending.pop(request.meta.get('redirect_urls', [request.url])[0], None)
+
+        scheduler = self.crawler.engine.slot.scheduler if self.crawler.engine.slot else None
+        if hasattr(scheduler, 'request_finished'):
+            scheduler.request_finished(request, failed=failed)
+
+    def checkpoint(
+            self
+    ) -> Deferred:
+        """Save the frontier, the visited set and the output offsets.
+        The checkpoint is taken now and written on a thread, the deferred fires once it is written.
+        """
+        if self.state.saving:
+            # One checkpoint is written at a time, the next one is taken once the previous one is written
+            return self.state.when_saved().addCallback(lambda _: self.checkpoint())
+
+        result_writer = getattr(self, 'result_writer', None)
+        if result_writer is not None and result_writer.is_alive():
+            # The writer gets the sizes of the result files with the items scraped until now
+            offsets = result_writer.mark_offsets().get_offsets
+        else:
+            offsets = functools.partial(get_file_sizes, (
+                self.SCRAPED_URLS_FILEPATH,
+                self.SCRAPED_URLS_FILEPATH_TXT,
+                self.RESULT_FILEPATH,
+                self.RESULT_FILEPATH_TXT,
+                *(result_writer.partition_filepaths if result_writer is not None else ()),
+            ))
+
+        return self.state.save(
+            frontier=itertools.chain(
+                list(self.pending.items()),
+                self.frontier.snapshot(self.state.state_dir) if self.frontier is not None else (),
+            ),
+            visited=self.visited,
+            offsets=offsets,
+            processed_count=self.processed_count,
+            render_verdicts=self.render_heuristic.verdicts,
+            matched_pages=self.matched_pages,
+            host_pages=self.host_pages,
+            finished_hosts=sorted(self.finished_hosts),
+            seeds_read=self.seeds_read,
+            host_seeds=self.host_seeds,
+            seed_stats=self.seed_stats,
+        )
+
+    def claim_link(
+            self,
+            seed: str,
+            url: str
+    ) -> bool:
+        """Count the link in the page budget of the seed and give the seed the link host,
+        if it is not taken by another seed. Return False, if the budget is spent.
+        """
+        seed_stats = self.seed_stats[seed]
+        if 0 < self.max_pages_per_seed <= seed_stats['requests']:
+            return False
+        seed_stats['requests'] += 1
+        self.host_seeds.setdefault(urlparse(url).netloc.lower(), seed)
+        return True
+
+    def count_seed_page(
+            self,
+            seed: Optional[str],
+            url_deep_level: int,
+            matched: bool
+    ) -> None:
+        """Count the processed page of the seed"""
+        if seed is None:
+            return
+        seed_stats = self.seed_stats[seed]
+        seed_stats['pages'] += 1
+        seed_stats['matched_pages'] += int(matched)
+        seed_stats['max_deep_level'] = max(seed_stats['max_deep_level'], url_deep_level)
+
+    def iter_seed_requests(
+            self
+    ) -> Generator[scrapy.Request, None, None]:
+        """Stream the requests of the seeds file (after the seeds read before the checkpoint).
+        Scrapy takes the start requests only while the downloader has free slots,
+        so the seeds are read as the crawl progresses.
+        """
+        with open(self.seeds_file, encoding='utf-8') as file:
+            seed_urls = (line.strip() for line in file)
+            seed_urls = (url for url in seed_urls if url and not url.startswith('#'))
+            for index, url in enumerate(seed_urls):
+                if index < self.seeds_read:
+                    continue
+                self.seeds_read = index + 1
+                # Only the worker owning the seed host crawls it
+                if not self.is_own_link(url) or not self.visited.add(self.get_visited_key(url)):
+                    continue
+                seed = self.get_start_url_repr(url)
+                self.seed_stats.setdefault(seed, {
+                    'url': url, 'requests': 0, 'pages': 0, 'matched_pages': 0, 'max_deep_level': 0,
+                })
+                self.crawler.stats.inc_value('sherlock/seeds')
+                if self.claim_link(seed, url):
+                    yield self.make_request(url, 0)
+                    if self.sitemaps and self.MAXIMUM_URL_DEEP_LEVEL > 0:
+                        yield self.make_robots_request(url, seed)
+
+    def make_robots_request(
+            self,
+            url: str,
+            seed: Optional[str] = None
+    ) -> scrapy.Request:
+        """Make the request of robots.txt of the start URL (or seed URL) host, that lists its sitemaps"""
+        return scrapy.Request(
+            url=get_robots_url(url),
+            callback=self.parse_robots,
+            errback=self.parse_robots_error,
+            dont_filter=True,
+            priority=self.SITEMAP_PRIORITY,
+            meta={'sherlock_seed': seed}
+        )
+
+    def make_sitemap_requests(
+            self,
+            urls: list[str],
+            seed: Optional[str] = None
+    ) -> Generator[scrapy.Request, None, None]:
+        """Make the requests of the sitemaps, that are not requested yet.
+        They are not compressed by the server, as the parser gunzips them while they are downloaded.
+        """
+        for url in urls:
+            if url in self.sitemap_urls or self.is_host_finished(url):
+                continue
+            self.sitemap_urls.add(url)
+            self.crawler.stats.inc_value('sherlock/sitemaps/requested')
+            yield scrapy.Request(
+                url=url,
+                callback=self.parse_sitemap,
+                errback=self.parse_error,
+                dont_filter=True,
+                priority=self.SITEMAP_PRIORITY,
+                headers={'Accept-Encoding': 'identity'},
+                meta={'sherlock_sitemap': True, 'sherlock_seed': seed}
+            )
+
+    def seed_sitemap_entries(
+            self,
+            entries: list[tuple[str, str]],
+            seed: Optional[str] = None
+    ) -> None:
+        """Request the nested sitemaps and seed the frontier with the new page links of the sitemap
+        (at the deep level of the links of the start URL)
+        """
+        foreign_links = []
+        for kind, url in entries:
+            if kind == 'sitemap':
+                for request in self.make_sitemap_requests([url], seed):
+                    self.crawler.engine.crawl(request)
+                continue
+
+            if not url.startswith("http") or not urlparse(url).netloc.endswith(self.domain_zone):
+                continue
+            if not self.enable_full_search and is_asset_url(url):
+                continue
+            key = self.get_visited_key(url)
+            if key in self.visited:
+                continue
+            if seed is not None and not self.claim_link(seed, url):
+                continue
+            self.visited.add(key)
+            self.crawler.stats.inc_value('sherlock/sitemaps/links')
+            if self.is_own_link(url):
+                self.schedule_link(url, 1)
+            else:
+                foreign_links.append((get_shard(url, self.shards), url, 1))
+
+        if foreign_links:
+            self.frontier_service.push(foreign_links)
+
+    def write_seed_summary(
+            self
+    ) -> None:
+        """Write the counters of the seeds to the seeds summary file"""
+        with open(self.SEEDS_FILEPATH, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Seed", "Start URL", "Requests", "Processed Pages", "Matched Pages", "Max Deep Level"])
+            writer.writerows(
+                [seed, stats['url'], stats['requests'], stats['pages'], stats['matched_pages'],
+                 stats['max_deep_level']]
+                for seed, stats in self.seed_stats.items()
+            )
+
+    def is_host_finished(
+            self,
+            url: str
+    ) -> bool:
+        """Check if the crawl of the URL host is stopped early"""
+        return bool(self.finished_hosts) and urlparse(url).netloc.lower() in self.finished_hosts
+
+    def finish_host(
+            self,
+            host: str,
+            reason: str
+    ) -> None:
+        """Stop crawling the host and drop its queued requests right away"""
+        if host in self.finished_hosts:
+            return
+        self.finished_hosts.add(host)
+        self.crawler.stats.inc_value(f'sherlock/finished_hosts/{reason}')
+
+        scheduler = self.crawler.engine.slot.scheduler if self.crawler.engine.slot else None
+        dropped = scheduler.drop_host(host) if hasattr(scheduler, 'drop_host') else []
+        for request in dropped:
+            self.pending.pop(request.meta.get('redirect_urls', [request.url])[0], None)
+        logging.log(logging.INFO, f"Finished host {host} ({reason}), dropped {len(dropped)} queued requests")
+
+    def count_page(
+            self,
+            host: str,
+            matched: bool
+    ) -> None:
+        """Count the processed page of the host and apply the early stop limits"""
+        self.host_pages[host] += 1
+        if matched:
+            self.matched_pages += 1
+            if self.stop_host_on_match:
+                self.finish_host(host, 'match')
+        if 0 < self.max_pages_per_host <= self.host_pages[host]:
+            self.finish_host(host, 'page_limit')
+
+        if 0 < self.stop_after_matches <= self.matched_pages and not self.stopping:
+            self.stopping = True
+            logging.log(CUSTOM_PRINT_LOG_LEVEL, f"Found {self.matched_pages} matched pages, stopping")
+            self.crawler.engine.close_spider(self, 'match_limit')
+
+    def is_host_expired(
+            self,
+            host: str
+    ) -> bool:
+        """Check if the time limit of the host is over (counting from its first request),
+        and finish the host if it is. It is checked by the scheduler before every request of the host.
+        """
+        if self.max_time_per_host <= 0:
+            return False
+        started = self.host_started.setdefault(host, time.monotonic())
+        if time.monotonic() - started < self.max_time_per_host:
+            return False
+        self.finish_host(host, 'time_limit')
+        return True
+
+    def schedule_link(
+            self,
+            url: str,
+            url_deep_level: int
+    ) -> None:
+        """Add the link to the frontier (or request it right away, if there is no frontier)"""
+        if self.is_host_finished(url):
+            return
+        if self.frontier is not None:
+            self.frontier.push(url, url_deep_level)
+        else:
+            self.crawler.engine.crawl(self.make_request(url, url_deep_level))
+
+    def make_request(
+            self,
+            url: str,
+            url_deep_level: int,
+            conditional: bool = True
+    ) -> scrapy.Request:
+        """Make a pending request of the URL
+        (conditional one, if the URL is in the render cache).
+        Assets are downloaded to be searched only, and never rendered or crawled.
+        """
+        self.pending[url] = url_deep_level
+
+        if is_asset_url(url):
+            # Assets are scanned while they are downloaded, before they could be decompressed
+            return scrapy.Request(
+                url=url,
+                callback=self.parse_asset,
+                errback=self.parse_error,
+                dont_filter=True,
+                headers={'Accept-Encoding': 'identity'},
+                meta={'sherlock_asset': True},
+                cb_kwargs={'url_deep_level': url_deep_level}
+            )
+
+        headers, meta = {}, {}
+        # Full search needs the cached page source, the entries without it are downloaded again
+        validators = self.render_cache.get_validators(url, with_dom=self.enable_full_search) \
+            if self.render_cache and conditional else None
+        if validators is not None:
+            etag, last_modified = validators
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+            meta['handle_httpstatus_list'] = [304]
+
+        # The visited set replaces the scrapy duplicates filter
+        return scrapy.Request(
+            url=url,
+            callback=self.parse,
+            errback=self.parse_error,
+            dont_filter=True,
+            headers=headers,
+            meta=meta,
+            cb_kwargs={'url_deep_level': url_deep_level}
+        )
+
+    def get_start_url_repr(
+            self,
+            url: Optional[str] = None
+    ) -> str:
+        """Get the start URL (or the seed URL) representation"""
+        return str(urlparse(url or self.start_urls[0]).netloc).replace(".", "_").replace(":", "_")
 
     @staticmethod
-    def prepare_env() -> None:
+    def get_data_filepaths(
+            results_folder: str
+    ) -> dict[str, str]:
+        """Get the data file paths inside the results folder"""
+        return {
+            'SCRAPED_URLS_FILEPATH': os.path.join(results_folder, "scraped_urls.csv"),
+            'SCRAPED_URLS_FILEPATH_TXT': os.path.join(results_folder, "scraped_urls.txt"),
+            'RESULT_FILEPATH': os.path.join(results_folder, "result.csv"),
+            'RESULT_FILEPATH_TXT': os.path.join(results_folder, "result.txt"),
+            'VISITED_FILEPATH': os.path.join(results_folder, "visited.bin"),
+            'SEEDS_FILEPATH': os.path.join(results_folder, "seeds.csv"),
+        }
+
+    @staticmethod
+    def prepare_env(
+            results_folder: str = RESULTS_FOLDER,
+            keep_results: bool = False
+    ) -> None:
         """Prepare the environment for the spider"""
+        filepaths = CodeBlockSpider.get_data_filepaths(results_folder)
 
         # Create .logs folder if missing
         if not os.path.exists(CodeBlockSpider.LOGS_FOLDER):
             os.makedirs(CodeBlockSpider.LOGS_FOLDER)
 
         # Create results folder if missing
-        if not os.path.exists(CodeBlockSpider.RESULTS_FOLDER):
-            os.makedirs(CodeBlockSpider.RESULTS_FOLDER)
-
-        # Remove old data files
-        if os.path.isfile(CodeBlockSpider.SCRAPED_URLS_FILEPATH):
-            os.remove(CodeBlockSpider.SCRAPED_URLS_FILEPATH)
-        if os.path.isfile(CodeBlockSpider.SCRAPED_URLS_FILEPATH_TXT):
-            os.remove(CodeBlockSpider.SCRAPED_URLS_FILEPATH_TXT)
-        if os.path.isfile(CodeBlockSpider.RESULT_FILEPATH):
-            os.remove(CodeBlockSpider.RESULT_FILEPATH)
-        if os.path.isfile(CodeBlockSpider.RESULT_FILEPATH_TXT):
-            os.remove(CodeBlockSpider.RESULT_FILEPATH_TXT)
+        if not os.path.exists(results_folder):
+            os.makedirs(results_folder)
+
+        # Keep the data files of the resumed crawl
+        if keep_results and os.path.isfile(filepaths['RESULT_FILEPATH']):
+            return
+
+        # Remove old data files and seed partitions
+        for name in ('SCRAPED_URLS_FILEPATH', 'SCRAPED_URLS_FILEPATH_TXT', 'RESULT_FILEPATH', 'RESULT_FILEPATH_TXT',
+                     'SEEDS_FILEPATH'):
+            if os.path.isfile(filepaths[name]):
+                os.remove(filepaths[name])
+        shutil.rmtree(os.path.join(results_folder, "seeds"), ignore_errors=True)
 
         # Add headers to csv files
-        with open(CodeBlockSpider.SCRAPED_URLS_FILEPATH, 'w', newline='') as file:
+        with open(filepaths['SCRAPED_URLS_FILEPATH'], 'w', newline='') as file:
             writer = csv.writer(file)
-            writer.writerow(["URL", "Deep Level"])
-        with open(CodeBlockSpider.RESULT_FILEPATH, 'w', newline='') as file:
+            writer.writerow(SCRAPED_URLS_HEADER)
+        with open(filepaths['RESULT_FILEPATH'], 'w', newline='') as file:
             writer = csv.writer(file)
-            writer.writerow(["Base URL", "Search Query"])
+            writer.writerow(RESULT_HEADER)
+        with open(filepaths['SCRAPED_URLS_FILEPATH_TXT'], 'w'), open(filepaths['RESULT_FILEPATH_TXT'], 'w'):
+            pass
 
     def start_requests(
             self
     ) -> Generator[scrapy.Request, None, None]:
-        """Start the spider by visiting the start URL"""
-        yield scrapy.Request(
-            url=self.start_urls[0],
-            callback=self.parse,
-            errback=self.parse_error,
-            cb_kwargs={'url_deep_level': 0}
-        )
+        """Start the spider by visiting the start URL (or the seeds) or the frontier of the resumed crawl"""
+        if self.resumed:
+            for url, url_deep_level in self.state.iter_frontier():
+                if self.frontier is not None:
+                    self.frontier.push(url, url_deep_level)
+                else:
+                    yield self.make_request(url, url_deep_level)
+
+        if self.seeds_file is not None:
+            yield from self.iter_seed_requests()
+        # Only the worker owning the start URL starts a sharded crawl
+        elif not self.resumed and self.is_own_link(self.start_urls[0]):
+            yield self.make_request(self.start_urls[0], 0)
+            if self.sitemaps and self.MAXIMUM_URL_DEEP_LEVEL > 0:
+                yield self.make_robots_request(self.start_urls[0])
 
     def close(
             self,
             reason: Any
+    ) -> Optional[Deferred]:
+        """Close the spider (the deferred of the last checkpoint is waited for by the engine)"""
+        if self.browser_pool is not None:
+            self.browser_pool.close()
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+        if self.lean_profile is not None:
+            self.lean_profile.close()
+
+        if self.render_cache is not None:
+            self.render_cache.close()
+
+        if self.frontier_service is not None:
+            if self.frontier_loop is not None and self.frontier_loop.running:
+                self.frontier_loop.stop()
+            self.frontier_service.close()
+            # Save the visited set of the shard to be merged with the others
+            self.visited.save(os.path.join(self.RESULTS_FOLDER, "visited.snapshot"))
+
+        saving = None
+        if self.state is not None:
+            if self.checkpoint_loop is not None and self.checkpoint_loop.running:
+                self.checkpoint_loop.stop()
+            # The crawl is finished once the last checkpoint is written
+            saving = self.checkpoint()
+
+        self.crawler.stats.set_value('sherlock/processed_count', self.processed_count)
+        self.crawler.stats.set_value('sherlock/matched_pages', self.matched_pages)
+        if self.seeds_file is not None:
+            self.write_seed_summary()
+        self.crawler.stats.set_value('sherlock/visited_count', len(self.visited))
+        logging.log(CUSTOM_PRINT_LOG_LEVEL,
+                    f"Finished ({reason}). Processed - {self.processed_count} links. "
+                    f"Visited - {len(self.visited)} links.")
+        if saving is None:
+            self.close_storage()
+            return None
+        # The last checkpoint may wait for the one being written, it takes the frontier and the visited set then
+        return saving.addBoth(lambda _: self.close_storage())
+
+    def close_storage(
+            self
     ) -> None:
-        """Close the spider"""
-        self.selenium_driver.close()
+        """Close the frontier and the visited set"""
+        if self.frontier is not None:
+            self.frontier.close()
+        self.visited.close()
 
     def parse_error(
             self,
@@ -157,96 +821,362 @@ class CodeBlockSpider(CrawlSpider):
         """Check for timeout errors and dns lookup errors.
         If any of these errors occur, the spider will retry the request.
         """
-        if failure.check(TimeoutException) or failure.check(DNSLookupError):
+        self.finish_request(failure.request, failed=True)
+        self.asset_scanners.pop(failure.request, None)
+        self.sitemap_parsers.pop(failure.request, None)
+        self.metrics.inc_host(urlparse(failure.request.url).netloc.lower(), 'errors')
+        if failure.check(DownloadTimeoutError) or failure.check(DNSLookupError):
             logging.log(CUSTOM_PRINT_LOG_LEVEL, repr(failure))
 
-    def parse(self, response, *args, **kwargs):
-        logging.log(logging.INFO, f"Started processing {response.url}")
+    def parse_robots(self, response, *args, **kwargs):
+        """Request the sitemaps listed in robots.txt (or the default one)"""
+        self.finish_request(response.request)
+        text = response.body.decode('utf-8', errors='replace')
+        yield from self.make_sitemap_requests(
+            get_robots_sitemaps(response.url, text), response.meta.get('sherlock_seed'))
 
-        url_deep_level = kwargs.get('url_deep_level', 0)
+    def parse_robots_error(
+            self,
+            failure
+    ) -> Generator[scrapy.Request, None, None]:
+        """Request the default sitemap of the host without robots.txt"""
+        self.parse_error(failure)
+        if failure.check(HttpError):
+            yield from self.make_sitemap_requests(
+                get_robots_sitemaps(failure.request.url, ''), failure.request.meta.get('sherlock_seed'))
+
+    def parse_sitemap(self, response, *args, **kwargs):
+        """Seed the rest of the sitemap parsed while it was downloaded"""
+        self.finish_request(response.request)
+        parser = self.sitemap_parsers.pop(response.request, None)
+        entries = []
+        if parser is None:
+            # The body was not streamed (e.g. an empty response)
+            parser = SitemapParser()
+            entries += parser.feed(response.body)
+        entries += parser.close()
+        self.seed_sitemap_entries(entries, response.meta.get('sherlock_seed'))
+        if parser.broken:
+            self.crawler.stats.inc_value('sherlock/sitemaps/broken')
+            logging.log(logging.WARNING, f"Broken sitemap {response.url}, parsed its first {parser.size} bytes")
+
+    @staticmethod
+    def extract_links(
+            response: Response
+    ) -> list[str]:
+        """Extract the absolute URLs of all links from the response in a single pass
+        (over the tree parsed once for all selectors of the response).
+        """
+        if not isinstance(response, TextResponse):
+            return []
+        return extract_links(response.selector.root, response.url)
 
-        # Extract SPA content
+    async def parse_static_page(
+            self,
+            response: Response
+    ) -> Optional[StaticPage]:
+        """Parse and search the static page in a parse worker.
+        Return None without parse workers, for a small page or if the worker failed
+        (the spider parses the page then).
+        """
+        if self.parse_pool is None or not isinstance(response, TextResponse) or not self.parse_pool.accepts(response):
+            return None
+        host = urlparse(response.url).netloc.lower()
+        check_rendering = self.render_mode == 'auto' and not self.render_heuristic.verdicts.get(host)
         try:
-            self.selenium_driver.get(response.url)
-            WebDriverWait(self.selenium_driver, 10).until(
-                lambda driver: driver.execute_script("return document.readyState") == "complete")
-        except TimeoutException:
+            static_page = await maybe_deferred_to_future(
+                self.parse_pool.parse(response, check_rendering, self.near_duplicates is not None))
+        except BrokenProcessPool as error:
+            logging.log(logging.ERROR, f"Parse workers stopped ({error!r}), pages are parsed by the spider")
+            self.parse_pool.close()
+            self.parse_pool = None
+            return None
+        except Exception as error:
+            logging.log(logging.WARNING, f"Parse worker failed on {response.url}: {error!r}")
+            self.crawler.stats.inc_value('sherlock/parse_workers/failed')
+            return None
+        for phase, seconds in static_page.timings.items():
+            self.metrics.observe(phase, seconds)
+        return static_page
+
+    async def extract_page(
+            self,
+            response: Response,
+            static_page: Optional[StaticPage] = None
+    ) -> tuple[list[str], str, Optional[set[str]], bool]:
+        """Get the absolute links and the source of the page,
+        rendering it in a browser only if it is needed.
+        The rendered source is transferred from the browser only if full search needs it,
+        otherwise it is empty and the literal queries found in it are returned instead.
+        The last value tells, if the page is partial (it was not ready in time, or it was not rendered at all).
+        A page, that could not be rendered, falls back to its static links and source.
+        """
+        if static_page is not None:
+            # The parse worker searched the source already, it is decoded here only for the render cache
+            links = static_page.links
+            page_source = response.text if self.render_cache is not None else ''
+        else:
+            # Extract links from the static response first
+            with self.metrics.time('extract'):
+                links = self.extract_links(response)
+            page_source = response.text if isinstance(response, TextResponse) else ''
+
+        # Extract SPA content (rendered on a browser pool thread) only when needed
+        looks_dynamic = static_page.looks_dynamic if static_page is not None else None
+        if self.render_mode == 'always' or (
+                self.render_mode == 'auto' and self.render_heuristic.needs_rendering(response, links, looks_dynamic)):
+            self.metrics.inc_host(urlparse(response.url).netloc.lower(), 'renders')
+            # Regex and glob queries are searched in the source, the cache keeps it to search new queries
+            with_source = self.enable_full_search and bool(self.matcher.patterns or self.render_cache)
+            literals = self.matcher.literals if self.enable_full_search and not with_source else []
+            try:
+                result = await maybe_deferred_to_future(self.browser_pool.render(response.url, literals, with_source))
+            except BrowserUnavailableError:
+                if self.render_mode != 'never':
+                    self.render_mode = 'never'
+                    logging.log(logging.WARNING, "No browser could be started, rendering is switched off "
+                                                 "and only the static pages are searched")
+                result = None
+            except Exception as error:
+                logging.log(logging.WARNING, f"Failed to render {response.url}: {error!r}")
+                result = None
+            if result is None:
+                # The static page is searched instead, and it is partial, so it is not cached
+                self.crawler.stats.inc_value('sherlock/render/failed')
+                return links, page_source, static_page.source_queries if static_page is not None else None, True
+            if result['partial']:
+                self.crawler.stats.inc_value('sherlock/render/partial')
+                self.metrics.inc_host(urlparse(response.url).netloc.lower(), 'partial_renders')
+            else:
+                self.render_heuristic.learn(response.url, len(links), len(result['links']))
+            if with_source:
+                return result['links'], result['source'], None, result['partial']
+            return result['links'], '', set(result['found']), result['partial']
+
+        return links, page_source, static_page.source_queries if static_page is not None else None, False
+
+    def match_page(
+            self,
+            links: list[str],
+            page_source: str,
+            source_queries: Optional[set[str]] = None,
+            link_matches: Optional[list[tuple[str, str]]] = None
+    ) -> list[tuple[str, str]]:
+        """Collect the links with the queries, and the queries found only in the page source
+        (searched in it, if they were not found in the browser or a parse worker already).
+        """
+        with self.metrics.time('match'):
+            matches = self.matcher.search_links(links) if link_matches is None else list(link_matches)
+            if self.enable_full_search:
+                found_queries = {query for query, _ in matches}
+                if source_queries is None:
+                    source_queries = self.matcher.search(page_source)
+                matches += [(query, '') for query in sorted(source_queries - found_queries)]
+        return matches
+
+    def is_near_duplicate(
+            self,
+            response: Response,
+            links: list[str],
+            page_source: str,
+            static_page: Optional[StaticPage] = None
+    ) -> bool:
+        """Check if the page is a near-duplicate of an already processed one,
+        by the fingerprint of its text (or of its links, if the browser returned no source).
+        """
+        if self.near_duplicates is None:
+            return False
+        if static_page is not None:
+            # Fingerprinted by the parse worker
+            return static_page.fingerprint is not None and not self.near_duplicates.add(static_page.fingerprint)
+        with self.metrics.time('fingerprint'):
+            if not page_source.strip():
+                text = ' '.join(links)
+            elif isinstance(response, TextResponse) and page_source is response.text:
+                text = extract_text(response.selector.root)
+            else:
+                text = extract_text(lxml.html.fromstring(page_source))
+            fingerprint = get_simhash(text)
+            return fingerprint is not None and not self.near_duplicates.add(fingerprint)
+
+    @staticmethod
+    def get_header(
+            response: Response,
+            name: str
+    ) -> Optional[str]:
+        """Get the decoded header of the response"""
+        value = response.headers.get(name)
+        return value.decode('latin-1') if value else None
+
+    def process_asset(
+            self,
+            response: Response,
+            url_deep_level: int,
+            found_queries: set[str]
+    ) -> SherlockItem:
+        """Count the searched asset and make its item"""
+        self.processed_count += 1
+        host = urlparse(response.url).netloc.lower()
+        self.metrics.inc_host(host, 'assets')
+        self.metrics.inc_host(host, 'bytes', len(response.body))
+        if found_queries:
+            self.metrics.inc_host(host, 'matches', len(found_queries))
+        self.count_page(host, bool(found_queries))
+        seed = self.host_seeds.get(host)
+        self.count_seed_page(seed, url_deep_level, bool(found_queries))
+        return SherlockItem(url=response.url, url_deep_level=url_deep_level,
+                            matches=[(query, '') for query in sorted(found_queries)], seed=seed)
+
+    def parse_asset(self, response, *args, **kwargs):
+        """Get the queries found in the asset while it was downloaded"""
+        scanner = self.asset_scanners.pop(response.request, None)
+        host = urlparse(response.url).netloc.lower()
+        if host in self.finished_hosts or self.is_host_expired(host):
+            self.finish_request(response.request)
             return
-        body = to_bytes(self.selenium_driver.page_source)
-        selenium_response = HtmlResponse(response.url, body=body, encoding='utf-8')
+        if scanner is None or (scanner.size != len(response.body) and 'download_stopped' not in response.flags):
+            # The body was not streamed (e.g. a cached or an empty response),
+            # or it was streamed compressed by a server ignoring the identity encoding
+            scanner = StreamScanner(self.matcher)
+            scanner.feed(response.body[:self.max_asset_size])
+        if 'download_stopped' in response.flags:
+            self.crawler.stats.inc_value('sherlock/assets/stopped_early')
+        yield self.process_asset(response, kwargs.get('url_deep_level', 0), scanner.close())
+
+    async def parse(self, response, *args, **kwargs):
+        logging.log(logging.INFO, f"Started processing {response.url}")
+
+        url_deep_level = kwargs.get('url_deep_level', 0)
 
         if 0 < self.MAXIMUM_URL_DEEP_LEVEL < url_deep_level:
+            self.finish_request(response.request)
             return
-        
-        # Extract all links from the response
-        links = selenium_response.css('a::attr(href)').getall() \
-            + selenium_response.css('link[rel="stylesheet"]::attr(href)').getall() \
-            + selenium_response.css('script::attr(src)').getall() \
-            + selenium_response.css('link[rel="alternate"][hreflang="en"]::attr(href)').getall()
-
-        # Extract the URLs from the og:url meta tag
-        og_url = selenium_response.css('meta[property="og:url"]::attr(content)').get()
-
-        # Add the meta tag URLs to the list of links
-        if og_url:
-            links.append(og_url)
-
-        # Preprocess links (convert to absolute url and remove all protocols except http/https)
-        links = [urljoin(response.url, link) for link in links]
-        result_links = set()
-
-        # Write the result URL and it's searched term url
-        with open(self.RESULT_FILEPATH, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            if self.enable_full_search and self.query in self.selenium_driver.page_source:
-                writer.writerow([response.url, self.query])
-            else:
-                result_links = {link for link in links if self.query in link}
-                for link in result_links:
-                    writer.writerow([response.url, link])
 
-        # Write the result searched URL
-        with open(self.RESULT_FILEPATH_TXT, mode='a', newline='') as file:
-            if (self.enable_full_search and self.query in self.selenium_driver.page_source) or result_links:
-                file.write(f"{response.url}\n")
+        # Requests of the host, that was finished while they were downloaded, are not processed
+        host = urlparse(response.url).netloc.lower()
+        if host in self.finished_hosts or self.is_host_expired(host):
+            self.finish_request(response.request)
+            return
+
+        # Assets found by their content type are searched only (their url was not like an asset)
+        if is_asset_response(response):
+            found_queries = self.matcher.search(response.text) \
+                if self.enable_full_search and isinstance(response, TextResponse) else set()
+            yield self.process_asset(response, url_deep_level, found_queries)
+            return
+
+        self.metrics.inc_host(host, 'pages')
+        self.metrics.inc_host(host, 'bytes', len(response.body))
+        if 'download_latency' in response.meta:
+            self.metrics.observe('download', response.meta['download_latency'])
+
+        # Reuse the cached page, if it is not modified
+        cache_entry, body_hash = None, None
+        if self.render_cache is not None:
+            cache_entry = self.render_cache.get(response.url, with_dom=self.enable_full_search)
+            body_hash = hashlib.sha1(response.body).hexdigest()
+        if response.status == 304 and cache_entry is None:
+            # The entry was evicted after the conditional request was made
+            self.finish_request(response.request)
+            self.crawler.engine.crawl(self.make_request(response.url, url_deep_level, conditional=False))
+            return
 
+        matches, source_queries, partial, static_page = None, None, False, None
+        if cache_entry is not None and (response.status == 304 or cache_entry.body_hash == body_hash):
+            self.crawler.stats.inc_value('sherlock/render_cache/hit')
+            self.metrics.inc_host(host, 'cache_hits')
+            links, page_source = cache_entry.links, cache_entry.dom
+            if cache_entry.queries_hash == self.queries_hash:
+                matches = cache_entry.matches
+        else:
+            static_page = await self.parse_static_page(response)
+            links, page_source, source_queries, partial = await self.extract_page(response, static_page)
+            # The results of the parse worker hold for the static page only, not for the rendered one
+            if static_page is not None and links is not static_page.links:
+                static_page = None
+
+        if matches is None:
+            matches = self.match_page(
+                links, page_source, source_queries, static_page.link_matches if static_page is not None else None)
+        if matches:
+            self.metrics.inc_host(host, 'matches', len(matches))
+            if self.first_match_seconds is None:
+                self.first_match_seconds = time.monotonic() - self.metrics.started
+                self.metrics.set_gauge('first_match_seconds', round(self.first_match_seconds, 3))
+
+        # Partial pages are not cached, so a recrawl renders them again
+        if self.render_cache is not None and not partial and (
+                cache_entry is None or cache_entry.matches is not matches):
+            # A not modified response may omit the validators, that the cached page still has
+            not_modified = response.status == 304
+            self.render_cache.put(CacheEntry(
+                url=response.url,
+                etag=self.get_header(response, 'ETag') or (cache_entry.etag if not_modified else None),
+                last_modified=self.get_header(response, 'Last-Modified') or (
+                    cache_entry.last_modified if not_modified else None),
+                body_hash=cache_entry.body_hash if not_modified else body_hash,
+                links=links,
+                matches=matches,
+                queries_hash=self.queries_hash,
+                dom=page_source,
+            ))
+
+        # The links of near-duplicate pages (e.g. calendars, paginations) lead to more of them
+        if self.is_near_duplicate(response, links, page_source, static_page):
+            self.crawler.stats.inc_value('sherlock/near_duplicates')
+            links = []
+
+        # Remove all protocols except http/https
         links = [link for link in links if link.startswith("http")]
 
-        # Filter out already processed links to prevent infinite loops from all sources
-        new_links = [link for link in links
-                     if urlparse(link).netloc.endswith(self.domain_zone) and (link not in self.processed_links)]
+        # Filter out already visited links (by their canonical form) to prevent infinite loops from all sources
+        new_links = {}
+        for link in links:
+            if urlparse(link).netloc.endswith(self.domain_zone):
+                key = self.get_visited_key(link)
+                if key not in new_links and key not in self.visited:
+                    # A link, that is canonical already, is queued as the same string the visited set keeps
+                    new_links[key] = key if key == link else link
+        new_links = list(new_links.items())
+
+        # Assets are downloaded only to search the query in them, their links are matched already
+        if not self.enable_full_search:
+            new_links = [(key, link) for key, link in new_links if not is_asset_url(link)]
 
         # or Filter out from the body of response
         # new_links = [link.url for link in LinkExtractor().extract_links(response)
-        #              if (self.domain_zone in link.url) and (link.url not in self.processed_links)]
+        #              if (self.domain_zone in link.url) and (link.url not in self.visited)]
 
         if self.PARSED_LINKS_LIMIT_PER_URL > 0:
             new_links = new_links[:self.PARSED_LINKS_LIMIT_PER_URL]
 
-        self.processed_links.append(response.url)
-
-        # Write the current URL and deep level to the output file
-        with open(self.SCRAPED_URLS_FILEPATH, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([response.url, url_deep_level])
-
-        # Write the current URL to the output txt file
-        with open(self.SCRAPED_URLS_FILEPATH_TXT, mode='a', newline='') as file:
-            file.write(f"{response.url}\n")
+        self.processed_count += 1
+        # The links of a host finished by this page are not scheduled
+        self.count_page(host, bool(matches))
+        seed = self.host_seeds.get(host)
+        self.count_seed_page(seed, url_deep_level, bool(matches))
 
         # Add new links to the queue
         if self.MAXIMUM_URL_DEEP_LEVEL > 0 and url_deep_level + 1 <= self.MAXIMUM_URL_DEEP_LEVEL:
-            for link in new_links:
-                self.crawler.engine.crawl(
-                    scrapy.Request(
-                        url=link, 
-                        callback=self.parse, 
-                        errback=self.parse_error,
-                        cb_kwargs={'url_deep_level': url_deep_level + 1}
-                    )
-                )
+            foreign_links = []
+            for key, link in new_links:
+                # The links found from a seed count in its page budget
+                if seed is not None and not self.claim_link(seed, link):
+                    break
+                self.visited.add(key)
+                if self.is_own_link(link):
+                    self.schedule_link(link, url_deep_level + 1)
+                else:
+                    foreign_links.append((get_shard(link, self.shards), link, url_deep_level + 1))
+
+            # Send the links of the other shards to their workers
+            if foreign_links:
+                self.frontier_service.push(foreign_links)
 
         logging.log(CUSTOM_PRINT_LOG_LEVEL, 
-                    f"Processed - {len(self.processed_links)} links. "
+                    f"Processed - {self.processed_count} links. "
+                    f"Visited - {len(self.visited)} links. "
                     f"In Queue - {len(self.crawler.engine.slot.scheduler)} links. "
                     f"Current url deep level - {url_deep_level}. ")
+
+        yield SherlockItem(url=response.url, url_deep_level=url_deep_level, matches=matches, seed=seed)
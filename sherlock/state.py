@@ -0,0 +1,240 @@
+import copy
+import json
+import logging
+import os
+from collections.abc import Callable, Generator, Iterable
+from typing import Optional
+
+from twisted.internet import threads
+from twisted.internet.defer import Deferred, succeed
+from twisted.python.failure import Failure
+
+from sherlock.visited import VisitedSet
+
+
+def fsync_file(
+        filepath: str
+) -> None:
+    """Flush the written content of the file to the disk"""
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(
+        directory: str
+) -> None:
+    """Flush the renames in the directory to the disk (where directories can be opened)"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def get_file_sizes(
+        filepaths: Iterable[str]
+) -> dict[str, int]:
+    """Get the sizes of the existing files"""
+    return {filepath: os.path.getsize(filepath) for filepath in filepaths if os.path.isfile(filepath)}
+
+
+class CrawlState:
+    """On-disk checkpoints of a crawl, that allow to resume it after a crash or a stop
+
+    Every checkpoint writes a new generation of the frontier (pending URLs
+    and their deep levels) and of the visited set snapshot, and then
+    atomically replaces the state file pointing to them together with the
+    sizes of the output files. A crash in the middle of a checkpoint leaves
+    the previous generation intact.
+
+    A checkpoint is taken on the reactor thread (the pending links, the
+    visited set and the metadata are copied, or snapshot incrementally), and
+    written on another thread, one at a time. All its files and the output
+    files are synced to the disk before the state file is replaced.
+    """
+
+    STATE_FILENAME = 'state.json'
+
+    def __init__(
+            self,
+            state_dir: str
+    ) -> None:
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_filepath = os.path.join(state_dir, self.STATE_FILENAME)
+        self.meta = self.load_meta()
+        self.generation: Optional[int] = self.meta.get('generation')
+        # Deferreds waiting for the checkpoint being written (None, if none is)
+        self.save_waiters: Optional[list[Deferred]] = None
+
+    def exists(
+            self
+    ) -> bool:
+        """Check if there is a checkpoint to resume from"""
+        return bool(self.meta)
+
+    def load_meta(
+            self
+    ) -> dict:
+        """Load the state of the last checkpoint"""
+        if not os.path.isfile(self.state_filepath):
+            return {}
+        with open(self.state_filepath, encoding='utf-8') as file:
+            return json.load(file)
+
+    def get_path(
+            self,
+            name: str,
+            generation: Optional[int] = None
+    ) -> str:
+        """Get the path of the state file of the generation (the last one by default)"""
+        generation = self.meta.get('generation', 0) if generation is None else generation
+        return os.path.join(self.state_dir, f"{name}.{generation}")
+
+    @property
+    def visited_snapshot_path(
+            self
+    ) -> Optional[str]:
+        """Get the path of the visited set snapshot of the last checkpoint"""
+        return self.get_path('visited') if self.exists() else None
+
+    def iter_frontier(
+            self
+    ) -> Generator[tuple[str, int], None, None]:
+        """Stream the pending URLs and their deep levels of the last checkpoint"""
+        if not self.exists():
+            return
+        with open(self.get_path('frontier'), encoding='utf-8') as file:
+            for line in file:
+                url_deep_level, url = line.rstrip('\n').split('\t', 1)
+                yield url, int(url_deep_level)
+
+    def restore_outputs(
+            self,
+            folder: Optional[str] = None
+    ) -> None:
+        """Cut the output files to their sizes at the last checkpoint,
+        so the rows written after it are not duplicated on resume.
+        The files of the folder, that were created after the checkpoint, are removed.
+        """
+        offsets = self.meta.get('offsets', {})
+        for filepath, size in offsets.items():
+            if os.path.isfile(filepath) and os.path.getsize(filepath) > size:
+                with open(filepath, 'r+b') as file:
+                    file.truncate(size)
+
+        if folder is not None:
+            for directory, _, filenames in os.walk(folder):
+                for filename in filenames:
+                    filepath = os.path.join(directory, filename)
+                    if filepath not in offsets:
+                        os.remove(filepath)
+
+    @property
+    def saving(
+            self
+    ) -> bool:
+        """Check if a checkpoint is being written"""
+        return self.save_waiters is not None
+
+    def when_saved(
+            self
+    ) -> Deferred:
+        """Get a deferred, that fires once the checkpoint being written (if any) is finished"""
+        if self.save_waiters is None:
+            return succeed(None)
+        waiter = Deferred()
+        self.save_waiters.append(waiter)
+        return waiter
+
+    def save(
+            self,
+            frontier: Iterable[tuple[str, int]],
+            visited: VisitedSet,
+            offsets: Callable[[], dict[str, int]],
+            **meta
+    ) -> Deferred:
+        """Take a new checkpoint and write it on a thread.
+        The frontier is consumed and the output offsets are got on that thread, so they
+        must not depend on the crawl going on. The deferred fires, once the checkpoint is
+        written (or failed to be, then the previous one is kept).
+        """
+        if self.save_waiters is not None:
+            raise RuntimeError("The previous checkpoint is still being written")
+        self.generation = 0 if self.generation is None else self.generation + 1
+        generation = self.generation
+        save_visited = visited.snapshot()
+        meta = copy.deepcopy(meta)
+        self.save_waiters = []
+
+        def saved(
+                _
+        ) -> None:
+            visited.snapshot_saved(self.get_path('visited', generation))
+            logging.log(logging.INFO, f"Checkpoint {generation} saved to {self.state_dir}")
+
+        def failed(
+                failure: Failure
+        ) -> None:
+            logging.log(logging.WARNING, f"Failed to save checkpoint {generation}: {failure.getErrorMessage()}")
+
+        def finish(
+                _
+        ) -> None:
+            waiters, self.save_waiters = self.save_waiters, None
+            for waiter in waiters:
+                waiter.callback(None)
+
+        deferred = threads.deferToThread(self.write, generation, frontier, save_visited, offsets, meta)
+        deferred.addCallbacks(saved, failed)
+        deferred.addBoth(finish)
+        return deferred
+
+    def write(
+            self,
+            generation: int,
+            frontier: Iterable[tuple[str, int]],
+            save_visited: Callable[[str], None],
+            offsets: Callable[[], dict[str, int]],
+            meta: dict
+    ) -> None:
+        """Write the checkpoint files, sync them and replace the state file (on a thread)"""
+        frontier_path = self.get_path('frontier', generation)
+        visited_path = self.get_path('visited', generation)
+        tmp_filepath = f"{self.state_filepath}.tmp"
+        try:
+            with open(frontier_path, 'w', encoding='utf-8') as file:
+                file.writelines(f"{url_deep_level}\t{url}\n" for url, url_deep_level in frontier)
+                file.flush()
+                os.fsync(file.fileno())
+            save_visited(visited_path)
+            fsync_file(visited_path)
+
+            meta = {**meta, 'generation': generation, 'offsets': offsets()}
+            for filepath in meta['offsets']:
+                fsync_file(filepath)
+            with open(tmp_filepath, 'w', encoding='utf-8') as file:
+                json.dump(meta, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_filepath, self.state_filepath)
+            fsync_directory(self.state_dir)
+        except BaseException:
+            for filepath in (frontier_path, visited_path, tmp_filepath):
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+            raise
+
+        previous_generation = self.meta.get('generation')
+        self.meta = meta
+        if previous_generation is not None:
+            for name in ('frontier', 'visited'):
+                try:
+                    os.remove(self.get_path(name, previous_generation))
+                except FileNotFoundError:
+                    pass
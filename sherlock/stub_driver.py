@@ -0,0 +1,82 @@
+import base64
+import re
+import urllib.request
+from typing import Any, Optional
+
+from sherlock.extraction import EXTRACT_SCRIPT, extract_rendered
+from sherlock.readiness import READY_SCRIPT
+
+# Elements, that the stub "renders" by replacing their content with the decoded attribute
+RENDER_ATTRIBUTE_REGEX = re.compile(r'(<[^>]*\sdata-render="([A-Za-z0-9+/=]*)"[^>]*>)')
+
+
+def expand_rendered_content(
+        page_source: str
+) -> str:
+    """Insert the base64 encoded `data-render` content of the elements into them"""
+    return RENDER_ATTRIBUTE_REGEX.sub(
+        lambda match: match.group(1) + base64.b64decode(match.group(2)).decode('utf-8'), page_source)
+
+
+class StubDriver:
+    """Browser-less stand-in of a Selenium driver
+
+    Downloads the page with urllib and "renders" it by expanding the
+    `data-render` attributes of the benchmark sites, so the crawl, extract
+    and write path can be measured on machines without a browser.
+    Implements only the part of the driver API the browser pool uses.
+    """
+
+    def __init__(
+            self
+    ) -> None:
+        self.page_source = ''
+        self.current_url: Optional[str] = None
+        self.timeout: Optional[float] = None
+
+    def get(
+            self,
+            url: str
+    ) -> None:
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            charset = response.headers.get_content_charset() or 'utf-8'
+            self.page_source = expand_rendered_content(response.read().decode(charset, errors='replace'))
+        self.current_url = url
+
+    def execute_script(
+            self,
+            script: str,
+            *args
+    ) -> Any:
+        if script == EXTRACT_SCRIPT:
+            return extract_rendered(self.page_source, self.current_url, *args)
+        if 'readyState' in script:
+            return 'complete'
+        return None
+
+    def execute_async_script(
+            self,
+            script: str,
+            *args
+    ) -> Any:
+        # The downloaded page is complete, so it is ready by every strategy
+        if script == READY_SCRIPT:
+            return True
+        return None
+
+    def set_script_timeout(
+            self,
+            timeout: float
+    ) -> None:
+        pass
+
+    def set_page_load_timeout(
+            self,
+            timeout: float
+    ) -> None:
+        self.timeout = timeout
+
+    def quit(
+            self
+    ) -> None:
+        self.page_source = ''
@@ -0,0 +1,549 @@
+import copy
+import hashlib
+import math
+import mmap
+import os
+import pickle
+import shutil
+import struct
+from abc import ABC, abstractmethod
+from array import array
+from collections.abc import Callable
+from typing import Optional
+
+VISITED_BACKENDS = ('memory', 'bloom', 'disk')
+
+
+def url_hash(
+        url: str,
+        digest_size: int = 8
+) -> int:
+    """Get a stable integer hash of the URL"""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=digest_size).digest(), 'little')
+
+
+class VisitedSet(ABC):
+    """Set of URLs, that were already seen by the spider"""
+
+    @abstractmethod
+    def add(
+            self,
+            url: str
+    ) -> bool:
+        """Add the URL to the set, return False if it was already there"""
+
+    @abstractmethod
+    def __contains__(
+            self,
+            url: str
+    ) -> bool:
+        """Check if the URL is in the set"""
+
+    @abstractmethod
+    def __len__(
+            self
+    ) -> int:
+        """Get the amount of URLs added to the set"""
+
+    @abstractmethod
+    def save(
+            self,
+            path: str
+    ) -> None:
+        """Save a snapshot of the set to the file"""
+
+    @abstractmethod
+    def snapshot(
+            self
+    ) -> Callable[[str], None]:
+        """Take a snapshot of the set and get the function, that saves it to a file.
+        The function may run on another thread, while the set keeps changing.
+        """
+
+    def snapshot_saved(
+            self,
+            path: str
+    ) -> None:
+        """Take note, that the last snapshot was saved to the file as a part of a checkpoint"""
+
+    @abstractmethod
+    def load(
+            self,
+            path: str
+    ) -> None:
+        """Replace the content of the set with the snapshot from the file"""
+
+    @abstractmethod
+    def merge(
+            self,
+            path: str
+    ) -> None:
+        """Add the content of the snapshot from the file to the set"""
+
+    def close(
+            self
+    ) -> None:
+        """Release the resources of the set"""
+
+
+class MemoryVisitedSet(VisitedSet):
+    """Exact in-memory hash set of URLs"""
+
+    def __init__(
+            self
+    ) -> None:
+        self.urls = set()
+
+    def add(
+            self,
+            url: str
+    ) -> bool:
+        if url in self.urls:
+            return False
+        self.urls.add(url)
+        return True
+
+    def __contains__(
+            self,
+            url: str
+    ) -> bool:
+        return url in self.urls
+
+    def __len__(
+            self
+    ) -> int:
+        return len(self.urls)
+
+    def save(
+            self,
+            path: str
+    ) -> None:
+        self.snapshot()(path)
+
+    def snapshot(
+            self
+    ) -> Callable[[str], None]:
+        urls = list(self.urls)
+
+        def save_urls(
+                path: str
+        ) -> None:
+            with open(path, 'w', encoding='utf-8') as file:
+                file.writelines(f"{url}\n" for url in urls)
+        return save_urls
+
+    def load(
+            self,
+            path: str
+    ) -> None:
+        with open(path, encoding='utf-8') as file:
+            self.urls = {line.rstrip('\n') for line in file}
+
+    def merge(
+            self,
+            path: str
+    ) -> None:
+        with open(path, encoding='utf-8') as file:
+            self.urls.update(line.rstrip('\n') for line in file)
+
+
+class BloomFilter:
+    """Fixed size Bloom filter using double hashing over a blake2b digest"""
+
+    def __init__(
+            self,
+            capacity: int,
+            error_rate: float
+    ) -> None:
+        self.capacity = capacity
+        self.bits_count = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes_count = max(1, round(self.bits_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bits_count + 7) // 8)
+        self.count = 0
+
+    def add(
+            self,
+            first: int,
+            second: int
+    ) -> None:
+        """Set the bits of the hash pair"""
+        bits, bits_count = self.bits, self.bits_count
+        for i in range(self.hashes_count):
+            position = (first + i * second) % bits_count
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def contains(
+            self,
+            first: int,
+            second: int
+    ) -> bool:
+        """Check if all bits of the hash pair are set"""
+        bits, bits_count = self.bits, self.bits_count
+        for i in range(self.hashes_count):
+            position = (first + i * second) % bits_count
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class BloomVisitedSet(VisitedSet):
+    """Scalable Bloom filter of URLs
+
+    New filters with doubled capacity and a tighter error rate are added
+    when the current one is full, so the overall false positive rate stays
+    below `error_rate` however many URLs are added.
+    """
+
+    INITIAL_CAPACITY = 100_000
+    GROWTH_FACTOR = 2
+    TIGHTENING_RATIO = 0.5
+
+    def __init__(
+            self,
+            error_rate: float = 0.001,
+            initial_capacity: int = INITIAL_CAPACITY
+    ) -> None:
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        self.filters: list[BloomFilter] = []
+        self.count = 0
+
+    def add_filter(
+            self
+    ) -> BloomFilter:
+        """Add a new filter, that is bigger and stricter than the previous one"""
+        index = len(self.filters)
+        bloom_filter = BloomFilter(
+            capacity=self.initial_capacity * self.GROWTH_FACTOR ** index,
+            error_rate=self.error_rate * (1 - self.TIGHTENING_RATIO) * self.TIGHTENING_RATIO ** index,
+        )
+        self.filters.append(bloom_filter)
+        return bloom_filter
+
+    @staticmethod
+    def hash_pair(
+            url: str
+    ) -> tuple[int, int]:
+        """Get the pair of hashes used to derive the bit positions"""
+        digest = url_hash(url, digest_size=16)
+        return digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+
+    def add(
+            self,
+            url: str
+    ) -> bool:
+        first, second = self.hash_pair(url)
+        if any(bloom_filter.contains(first, second) for bloom_filter in self.filters):
+            return False
+        bloom_filter = self.filters[-1] if self.filters else self.add_filter()
+        if bloom_filter.count >= bloom_filter.capacity:
+            bloom_filter = self.add_filter()
+        bloom_filter.add(first, second)
+        self.count += 1
+        return True
+
+    def __contains__(
+            self,
+            url: str
+    ) -> bool:
+        first, second = self.hash_pair(url)
+        return any(bloom_filter.contains(first, second) for bloom_filter in self.filters)
+
+    def __len__(
+            self
+    ) -> int:
+        return self.count
+
+    def save(
+            self,
+            path: str
+    ) -> None:
+        self.snapshot()(path)
+
+    def snapshot(
+            self
+    ) -> Callable[[str], None]:
+        # The bit arrays are copied, the filters keep taking new URLs meanwhile
+        filters, count = copy.deepcopy(self.filters), self.count
+
+        def save_filters(
+                path: str
+        ) -> None:
+            with open(path, 'wb') as file:
+                pickle.dump((filters, count), file, protocol=pickle.HIGHEST_PROTOCOL)
+        return save_filters
+
+    def load(
+            self,
+            path: str
+    ) -> None:
+        with open(path, 'rb') as file:
+            self.filters, self.count = pickle.load(file)
+
+    def merge(
+            self,
+            path: str
+    ) -> None:
+        # A URL is in the union, when it is in any filter of any of the sets
+        with open(path, 'rb') as file:
+            filters, count = pickle.load(file)
+        self.filters = filters + self.filters
+        self.count += count
+
+
+class DiskVisitedSet(VisitedSet):
+    """On-disk set of 64-bit URL fingerprints
+
+    The fingerprints are kept in an open addressing hash table inside a
+    memory-mapped file, so the operating system pages the table in and out
+    as needed instead of keeping it in the process memory.
+
+    Snapshots are incremental: once a snapshot is saved in a checkpoint, the
+    fingerprints added after it are kept aside, and the next snapshot is a copy
+    of the saved one with them added, made without touching the live table.
+    Only the first snapshot of a new set copies the table (in memory).
+    """
+
+    HEADER = struct.Struct('<8sQQ')
+    SLOT = struct.Struct('<Q')
+    MAGIC = b'SHERLOCK'
+    INITIAL_CAPACITY = 1 << 20
+    MAX_LOAD_FACTOR = 0.5
+
+    def __init__(
+            self,
+            path: str,
+            initial_capacity: int = INITIAL_CAPACITY
+    ) -> None:
+        self.path = path
+        self.file = None
+        self.map = None
+        self.capacity = 0
+        self.count = 0
+        # The last snapshot saved in a checkpoint and the fingerprints added after it (once there is one)
+        self.snapshot_base: Optional[str] = None
+        self.unsaved: Optional[array] = None
+        self.snapshot_length = 0
+        self.create(path, 1 << max(4, (initial_capacity - 1).bit_length()))
+
+    @classmethod
+    def open_table(
+            cls,
+            path: str
+    ) -> 'DiskVisitedSet':
+        """Map an existing table file, that is not tracked for snapshots"""
+        table = cls.__new__(cls)
+        table.path = path
+        table.snapshot_base = table.unsaved = None
+        table.snapshot_length = 0
+        table.open(path)
+        return table
+
+    def create(
+            self,
+            path: str,
+            capacity: int
+    ) -> None:
+        """Create an empty table file and map it"""
+        with open(path, 'wb') as file:
+            file.write(self.HEADER.pack(self.MAGIC, capacity, 0))
+            file.truncate(self.HEADER.size + capacity * self.SLOT.size)
+        self.open(path)
+
+    def open(
+            self,
+            path: str
+    ) -> None:
+        """Map the table file"""
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, self.capacity, self.count = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a visited set file")
+
+    def sync(
+            self
+    ) -> None:
+        """Write the header and the changed pages of the table to the file"""
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, self.capacity, self.count)
+        self.map.flush()
+
+    def close(
+            self
+    ) -> None:
+        if self.map is not None:
+            self.sync()
+            self.map.close()
+            self.file.close()
+            self.map = self.file = None
+
+    def save(
+            self,
+            path: str
+    ) -> None:
+        self.sync()
+        shutil.copyfile(self.path, path)
+
+    def snapshot(
+            self
+    ) -> Callable[[str], None]:
+        if self.snapshot_base is None:
+            self.sync()
+            table, base, added = bytes(self.map), None, array('Q')
+            self.unsaved = array('Q')
+        else:
+            table, base, added = None, self.snapshot_base, self.unsaved[:]
+        self.snapshot_length = len(self.unsaved)
+
+        def save_table(
+                path: str
+        ) -> None:
+            if table is not None:
+                with open(path, 'wb') as file:
+                    file.write(table)
+            else:
+                shutil.copyfile(base, path)
+            if added:
+                snapshot = DiskVisitedSet.open_table(path)
+                try:
+                    for fingerprint in added:
+                        snapshot.add_fingerprint(fingerprint)
+                finally:
+                    snapshot.close()
+        return save_table
+
+    def snapshot_saved(
+            self,
+            path: str
+    ) -> None:
+        self.snapshot_base = path
+        del self.unsaved[:self.snapshot_length]
+        self.snapshot_length = 0
+
+    def load(
+            self,
+            path: str
+    ) -> None:
+        self.close()
+        shutil.copyfile(path, self.path)
+        self.open(self.path)
+        self.snapshot_base = path
+        self.unsaved = array('Q')
+        self.snapshot_length = 0
+
+    @staticmethod
+    def fingerprint(
+            url: str
+    ) -> int:
+        """Get the non-zero fingerprint of the URL (zero marks an empty slot)"""
+        return url_hash(url) or 1
+
+    def find_slot(
+            self,
+            fingerprint: int
+    ) -> tuple[int, bool]:
+        """Find the slot offset of the fingerprint and if it is occupied by it"""
+        mask = self.capacity - 1
+        index = fingerprint & mask
+        while True:
+            offset = self.HEADER.size + index * self.SLOT.size
+            value, = self.SLOT.unpack_from(self.map, offset)
+            if value == fingerprint:
+                return offset, True
+            if value == 0:
+                return offset, False
+            index = (index + 1) & mask
+
+    def grow(
+            self
+    ) -> None:
+        """Move the fingerprints into a table file twice as big"""
+        old_map, old_file, old_capacity = self.map, self.file, self.capacity
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(self.HEADER.pack(self.MAGIC, old_capacity * 2, self.count))
+            file.truncate(self.HEADER.size + old_capacity * 2 * self.SLOT.size)
+        self.open(tmp_path)
+        for index in range(old_capacity):
+            value, = self.SLOT.unpack_from(old_map, self.HEADER.size + index * self.SLOT.size)
+            if value:
+                offset, _ = self.find_slot(value)
+                self.SLOT.pack_into(self.map, offset, value)
+        old_map.close()
+        old_file.close()
+
+        # Replace the old table and reopen the mapping under the original path
+        self.map.close()
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self.open(self.path)
+
+    def merge(
+            self,
+            path: str
+    ) -> None:
+        other = DiskVisitedSet.open_table(path)
+        try:
+            for index in range(other.capacity):
+                value, = self.SLOT.unpack_from(other.map, self.HEADER.size + index * self.SLOT.size)
+                if value:
+                    self.add_fingerprint(value)
+        finally:
+            other.map.close()
+            other.file.close()
+
+    def add(
+            self,
+            url: str
+    ) -> bool:
+        return self.add_fingerprint(self.fingerprint(url))
+
+    def add_fingerprint(
+            self,
+            fingerprint: int
+    ) -> bool:
+        """Add the URL fingerprint to the table, return False if it was already there"""
+        offset, found = self.find_slot(fingerprint)
+        if found:
+            return False
+        if (self.count + 1) > self.capacity * self.MAX_LOAD_FACTOR:
+            self.grow()
+            offset, _ = self.find_slot(fingerprint)
+        self.SLOT.pack_into(self.map, offset, fingerprint)
+        self.count += 1
+        if self.unsaved is not None:
+            self.unsaved.append(fingerprint)
+        return True
+
+    def __contains__(
+            self,
+            url: str
+    ) -> bool:
+        return self.find_slot(self.fingerprint(url))[1]
+
+    def __len__(
+            self
+    ) -> int:
+        return self.count
+
+
+def make_visited_set(
+        backend: str,
+        error_rate: float = 0.001,
+        path: str = 'visited.bin',
+        snapshot_path: Optional[str] = None
+) -> VisitedSet:
+    """Create the visited set for the backend name, restored from the snapshot if it is given"""
+    if backend == 'memory':
+        visited = MemoryVisitedSet()
+    elif backend == 'bloom':
+        visited = BloomVisitedSet(error_rate=error_rate)
+    elif backend == 'disk':
+        visited = DiskVisitedSet(path)
+    else:
+        raise ValueError(f"Unknown visited set backend: {backend}")
+
+    if snapshot_path is not None:
+        visited.load(snapshot_path)
+    return visited
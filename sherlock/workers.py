@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Union
+
+from parsel import Selector
+from scrapy.http import TextResponse, XmlResponse
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from w3lib.encoding import html_to_unicode
+
+from sherlock.canonical import get_simhash
+from sherlock.extraction import extract_links, extract_text
+from sherlock.matching import QueryMatcher
+from sherlock.rendering import RenderHeuristic
+
+# Smaller pages are parsed faster by the spider itself than sent to a worker and back
+MIN_PAGE_SIZE = 16 * 1024
+
+# Bodies of this size and bigger are passed to the workers in shared memory blocks, smaller ones are pickled
+SHARED_MEMORY_MIN_SIZE = 64 * 1024
+
+
+@dataclass
+class StaticPage:
+    """Compact result of parsing and searching a static page in a parse worker"""
+    links: list[str]
+    link_matches: list[tuple[str, str]]
+    # Queries found in the page source (full search only)
+    source_queries: Optional[set[str]]
+    # Result of the page-level render checks (if they were asked for)
+    looks_dynamic: Optional[bool]
+    # Simhash of the page text (if it was asked for), None for a too short text
+    fingerprint: Optional[int]
+    # Durations of the phases in the worker
+    timings: dict[str, float]
+
+
+# The matcher and the render heuristic of the worker process, made once by its initializer
+worker_matcher: Optional[QueryMatcher] = None
+worker_full_search = False
+worker_heuristic: Optional[RenderHeuristic] = None
+
+
+def init_worker(
+        queries: list[str],
+        full_search: bool
+) -> None:
+    """Compile the queries in the new worker process"""
+    global worker_matcher, worker_full_search, worker_heuristic
+    worker_matcher = QueryMatcher(queries)
+    worker_full_search = full_search
+    worker_heuristic = RenderHeuristic()
+
+
+def read_body(
+        body: Union[bytes, tuple[str, int]]
+) -> bytes:
+    """Get the page body passed inline, or by the name and size of its shared memory block"""
+    if isinstance(body, bytes):
+        return body
+    name, size = body
+    block = SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+
+
+def parse_page(
+        body: Union[bytes, tuple[str, int]],
+        encoding: str,
+        url: str,
+        selector_type: str,
+        check_rendering: bool,
+        fingerprint: bool
+) -> StaticPage:
+    """Parse the static page and search it in the worker process,
+    decoding the body the same way as `TextResponse.text`.
+    """
+    started = time.perf_counter()
+    text = html_to_unicode(f"charset={encoding}", read_body(body))[1]
+    selector = Selector(text=text, type=selector_type)
+    links = extract_links(selector.root, url)
+    looks_dynamic = worker_heuristic.looks_dynamic(selector, links) if check_rendering else None
+    extracted = time.perf_counter()
+
+    link_matches = worker_matcher.search_links(links)
+    source_queries = worker_matcher.search(text) if worker_full_search else None
+    matched = time.perf_counter()
+
+    timings = {'extract': extracted - started, 'match': matched - extracted}
+    page_fingerprint = None
+    if fingerprint:
+        page_fingerprint = get_simhash(extract_text(selector.root))
+        timings['fingerprint'] = time.perf_counter() - matched
+    return StaticPage(
+        links=links,
+        link_matches=link_matches,
+        source_queries=source_queries,
+        looks_dynamic=looks_dynamic,
+        fingerprint=page_fingerprint,
+        timings=timings,
+    )
+
+
+class ParseWorkerPool:
+    """Pool of worker processes, that parse and search the static pages
+
+    Decoding, parsing, link extraction and matching of a page are CPU bound,
+    so they run in `size` worker processes instead of the reactor thread.
+    A big page body is copied once into a shared memory block, that the
+    worker reads it from, and the worker returns only a compact
+    `StaticPage` (the links, the matches and the page-level checks).
+    Pages smaller than `min_size` are not worth the round trip, the spider
+    parses them itself. The workers are spawned (not forked from the reactor
+    process) right away, so their startup overlaps with the first downloads.
+    """
+
+    def __init__(
+            self,
+            size: int,
+            queries: list[str],
+            full_search: bool,
+            min_size: int = MIN_PAGE_SIZE
+    ) -> None:
+        self.size = max(1, size)
+        self.min_size = min_size
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.size,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(queries, full_search)
+        )
+        # Every task submitted while no worker is idle spawns a new one
+        for _ in range(self.size):
+            self.executor.submit(os.getpid)
+
+    def accepts(
+            self,
+            response: TextResponse
+    ) -> bool:
+        """Check if the page is big enough to be parsed in a worker"""
+        return len(response.body) >= self.min_size
+
+    def parse(
+            self,
+            response: TextResponse,
+            check_rendering: bool = False,
+            fingerprint: bool = False
+    ) -> Deferred:
+        """Parse the page in a worker. The deferred fires with its `StaticPage` in the reactor thread"""
+        body = response.body
+        block = None
+        if len(body) >= SHARED_MEMORY_MIN_SIZE:
+            block = SharedMemory(create=True, size=len(body))
+            block.buf[:len(body)] = body
+        try:
+            future = self.executor.submit(
+                parse_page,
+                (block.name, len(body)) if block is not None else body,
+                response.encoding,
+                response.url,
+                'xml' if isinstance(response, XmlResponse) else 'html',
+                check_rendering,
+                fingerprint
+            )
+        except Exception:
+            self.release(block)
+            raise
+
+        deferred = Deferred()
+        future.add_done_callback(lambda done: reactor.callFromThread(self.finish, deferred, done, block))
+        return deferred
+
+    def finish(
+            self,
+            deferred: Deferred,
+            future: Future,
+            block: Optional[SharedMemory]
+    ) -> None:
+        """Free the shared memory block of the page and fire its deferred"""
+        self.release(block)
+        if future.cancelled():
+            deferred.cancel()
+            return
+        error = future.exception()
+        if error is not None:
+            deferred.errback(error)
+        else:
+            deferred.callback(future.result())
+
+    @staticmethod
+    def release(
+            block: Optional[SharedMemory]
+    ) -> None:
+        """Free the shared memory block"""
+        if block is not None:
+            block.close()
+            block.unlink()
+
+    def close(
+            self
+    ) -> None:
+        """Stop the workers, dropping the pages not taken by them yet"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
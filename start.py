@@ -1,10 +1,21 @@
 import argparse
+import glob
+import multiprocessing
 import os
+from typing import Optional
 
 from urllib.parse import urlparse
 from scrapy.crawler import CrawlerProcess
 
+from sherlock.drivers import BROWSERS
+from sherlock.matching import QueryMatcher
+from sherlock.readiness import parse_readiness
+from sherlock.rendering import RENDER_MODES
+from sherlock.scheduler import CRAWL_ORDERS
+from sherlock.sharding import make_frontier_service, merge_shard_results, merge_shard_visited
 from sherlock.spiders.code_block_spider import CodeBlockSpider
+from sherlock.state import CrawlState
+from sherlock.visited import VISITED_BACKENDS, make_visited_set
 
 crawler_settings = {
     'LOG_LEVEL': 'INFO',
@@ -13,21 +24,156 @@ crawler_settings = {
     'RETRY_ENABLED': False,
     'ROBOTSTXT_OBEY': False,
     'AJAXCRAWL_ENABLED': True,
+    'ITEM_PIPELINES': {
+        'sherlock.pipelines.SherlockPipeline': 300,
+    },
+    'SHERLOCK_WRITE_BATCH_SIZE': 100,
+    'SHERLOCK_WRITE_FLUSH_INTERVAL': 5.0,
+    'SCHEDULER': 'sherlock.scheduler.HostAwareScheduler',
+    'EXTENSIONS': {
+        'sherlock.extensions.MetricsExtension': 500,
+    },
+    'SHERLOCK_METRICS_INTERVAL': 10.0,
 }
 
 
+def run_crawler(
+        args: argparse.Namespace,
+        shard_id: Optional[int] = None,
+        frontier_uri: Optional[str] = None
+) -> None:
+    """Run the spider (or the shard worker of the spider) until the crawl is finished"""
+    results_folder = CodeBlockSpider.RESULTS_FOLDER
+    state_dir = args.resume
+    log_filename = os.path.splitext(os.path.basename(args.seeds))[0] if args.seeds \
+        else str(urlparse(args.start_point).netloc).replace('.', '_')
+    if shard_id is not None:
+        results_folder = os.path.join(results_folder, f"shard_{shard_id}")
+        state_dir = state_dir and os.path.join(state_dir, f"shard_{shard_id}")
+        log_filename = f"{log_filename}_shard_{shard_id}"
+
+    # Set crawler settings
+    crawler_settings['CONCURRENT_REQUESTS'] = args.concurrency
+    crawler_settings['SHERLOCK_CRAWL_ORDER'] = args.crawl_order
+    crawler_settings['SHERLOCK_HOST_CONCURRENCY'] = args.host_concurrency
+    crawler_settings['SHERLOCK_FRONTIER_MEMORY'] = args.frontier_memory * 1024 * 1024
+    crawler_settings['SHERLOCK_METRICS_DUMP_PATH'] = os.path.join(results_folder, "metrics.json")
+    # Every shard worker serves its metrics on its own port
+    crawler_settings['SHERLOCK_METRICS_PORT'] = args.metrics_port and args.metrics_port + (shard_id or 0)
+    crawler_settings['LOG_FILE'] = os.path.join(CodeBlockSpider.LOGS_FOLDER, f"{log_filename}.log")
+
+    # Start crawling
+    CodeBlockSpider.prepare_env(
+        results_folder=results_folder,
+        keep_results=state_dir is not None and CrawlState(state_dir).exists()
+    )
+
+    process = CrawlerProcess(crawler_settings)
+    process.crawl(
+        CodeBlockSpider, 
+        start_point=args.start_point, 
+        domain_zone=args.domain_zone, 
+        query=args.query, 
+        parsed_links_limit_per_url=args.links_per_url, 
+        max_url_deep_level=args.scraping_deep_level,
+        full_search=args.full_search,
+        browser_pool_size=args.browsers,
+        browser=args.browser,
+        render_mode=args.render,
+        visited_backend=args.visited_backend,
+        visited_error_rate=args.visited_error_rate,
+        queries_file=args.queries,
+        state_dir=state_dir,
+        checkpoint_interval=args.checkpoint_interval,
+        results_folder=results_folder,
+        shard_id=shard_id or 0,
+        shards=args.shards,
+        frontier_uri=frontier_uri or args.frontier,
+        cache_dir=args.cache_dir,
+        cache_size=args.cache_size * 1024 * 1024,
+        lean_render=args.lean_render,
+        blocked_patterns=args.block,
+        browser_profile_dir=args.browser_profile,
+        max_asset_size=args.max_asset_size * 1024,
+        stop_after_matches=args.stop_after_matches,
+        stop_host_on_match=args.stop_host_on_match,
+        max_pages_per_host=args.max_pages_per_host,
+        max_time_per_host=args.max_time_per_host,
+        canonicalize=not args.raw_urls,
+        strip_params=args.strip_param,
+        strip_trailing_slash=not args.keep_trailing_slash,
+        near_duplicate_distance=args.near_duplicates,
+        seeds_file=args.seeds,
+        max_pages_per_seed=args.max_pages_per_seed,
+        ready=args.ready,
+        render_timeout=args.render_timeout,
+        sitemaps=args.sitemaps,
+        parse_workers=args.parse_workers
+    )
+    process.start()
+
+
+def run_shards(
+        args: argparse.Namespace
+) -> None:
+    """Run a worker process per shard on this host and merge their results"""
+    CodeBlockSpider.prepare_env()
+
+    frontier_uri = args.frontier
+    if frontier_uri is None:
+        frontier_filepath = os.path.abspath(os.path.join(CodeBlockSpider.RESULTS_FOLDER, "frontier.sqlite"))
+        if args.resume is None:
+            for filepath in glob.glob(f"{frontier_filepath}*"):
+                os.remove(filepath)
+        frontier_uri = f"sqlite:///{frontier_filepath}"
+
+    # Register all shards before any of them can decide the crawl is finished
+    frontier_service = make_frontier_service(frontier_uri)
+    frontier_service.register(args.shards)
+    frontier_service.close()
+
+    context = multiprocessing.get_context('spawn')
+    workers = [
+        context.Process(target=run_crawler, args=(args, shard_id, frontier_uri), name=f"shard_{shard_id}")
+        for shard_id in range(args.shards)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    shard_folders = [os.path.join(CodeBlockSpider.RESULTS_FOLDER, worker.name) for worker in workers]
+    merge_shard_results(shard_folders, CodeBlockSpider.RESULTS_FOLDER)
+    merge_shard_visited(shard_folders, make_visited_set(
+        args.visited_backend, args.visited_error_rate, CodeBlockSpider.VISITED_FILEPATH
+    ), CodeBlockSpider.RESULTS_FOLDER)
+
+
 if __name__ == "__main__":
     # Configure parsing arguments
     parser = argparse.ArgumentParser(description="URL scraper", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("-u", "--start_point", 
                         default='https://bigmir.net',
                         help="start url")
+    parser.add_argument('--seeds',
+                        default=None,
+                        metavar='FILE',
+                        help="file with start urls, one per line, crawled in one process with shared browsers "
+                             "(overrides --start_point)")
+    parser.add_argument('--max_pages_per_seed',
+                        type=int,
+                        default=0,
+                        help="maximum number of pages requested per seed of --seeds, 0 for no limit")
     parser.add_argument("-d", "--domain_zone", 
                         default='any',
                         help="domain zones to scrape")
     parser.add_argument('-q', '--query',
                         default='analytics.js',
                         help="query to search for on sites")
+    parser.add_argument('--queries',
+                        default=None,
+                        help="file with queries to search for, one per line "
+                             "('re:' and 'glob:' prefixes for regexes and globs), overrides --query")
     parser.add_argument('--links_per_url',
                         type=int,
                         default=10000,
@@ -40,29 +186,173 @@ if __name__ == "__main__":
                         type=int,
                         default=100,
                         help="number of concurrent requests")
+    parser.add_argument('--host_concurrency',
+                        type=int,
+                        default=4,
+                        help="maximum number of concurrent requests (downloads and renders) per host")
+    parser.add_argument('--crawl_order',
+                        choices=CRAWL_ORDERS,
+                        default='bfs',
+                        help="order of crawling: breadth-first, depth-first or best-first (urls looking "
+                             "like a match of the query first)")
+    parser.add_argument('--frontier_memory',
+                        type=int,
+                        default=64,
+                        help="memory of the queued links (in megabytes), more links are spilled to disk")
+    parser.add_argument('--browsers',
+                        type=int,
+                        default=4,
+                        help="number of headless browsers rendering pages in parallel")
+    parser.add_argument('--browser',
+                        choices=BROWSERS,
+                        default='auto',
+                        help="browser rendering the pages: the first installed one (auto), a chosen one, "
+                             "a browser-less stub, that expands data-render attributes of the benchmark sites, "
+                             "or none (static pages only, Selenium is not loaded)")
+    parser.add_argument('--render',
+                        choices=RENDER_MODES,
+                        default='auto',
+                        help="render pages in a browser always, only when they need JavaScript (auto) or never")
+    parser.add_argument('--ready',
+                        default='load',
+                        metavar='STRATEGY',
+                        help="when a rendered page is ready to be searched: on its load event (load), "
+                             "its DOM content loaded event (dom), when no resources are loaded for 0.5s "
+                             "(network-idle), when an element matches the CSS selector (selector:<css>) "
+                             "or when a literal query is in its DOM (query)")
+    parser.add_argument('--render_timeout',
+                        type=float,
+                        default=10.0,
+                        help="maximum time to load a page in a browser and wait until it is ready (in seconds), "
+                             "the timeout of every host adapts to its load times")
+    parser.add_argument('--parse_workers',
+                        type=int,
+                        default=0,
+                        help="amount of worker processes parsing and searching static pages, "
+                             "0 to parse them in the crawler process")
+    parser.add_argument('--lean_render',
+                        action='store_true',
+                        help="render pages in a lean browser profile, that does not load images, fonts, media "
+                             "and blocked urls")
+    parser.add_argument('--block',
+                        action='append',
+                        default=None,
+                        metavar='PATTERN',
+                        help="url pattern (with * wildcards) blocked by the lean browser profile, may be repeated "
+                             "(replaces the default patterns of images, fonts, media and ad frames)")
+    parser.add_argument('--browser_profile',
+                        default=None,
+                        metavar='PROFILE_DIR',
+                        help="warm browser profile template shared by the lean browsers (kept between runs)")
+    parser.add_argument('--visited_backend',
+                        choices=VISITED_BACKENDS,
+                        default='memory',
+                        help="storage of visited urls: exact in-memory set, compact bloom filter or on-disk table")
+    parser.add_argument('--visited_error_rate',
+                        type=float,
+                        default=0.001,
+                        help="false positive rate of the bloom filter visited urls storage")
     parser.add_argument('--full_search',
                         action='store_true',
                         help="switch on full search mode (default is only links)")
+    parser.add_argument('--max_asset_size',
+                        type=int,
+                        default=5 * 1024,
+                        help="maximum size of an asset (.js, .css) searched in full search mode (in kilobytes)")
+    parser.add_argument('--stop_after_matches',
+                        type=int,
+                        default=0,
+                        metavar='K',
+                        help="stop the crawl after K pages with matches (per shard worker), 0 for no limit")
+    parser.add_argument('--stop_host_on_match',
+                        action='store_true',
+                        help="stop crawling a host after its first page with matches")
+    parser.add_argument('--max_pages_per_host',
+                        type=int,
+                        default=0,
+                        help="maximum number of pages processed per host, 0 for no limit")
+    parser.add_argument('--max_time_per_host',
+                        type=float,
+                        default=0.0,
+                        help="maximum time spent crawling a host since its first request (in seconds), 0 for no limit")
+    parser.add_argument('--raw_urls',
+                        action='store_true',
+                        help="compare raw url strings instead of canonical urls to find visited ones")
+    parser.add_argument('--strip_param',
+                        action='append',
+                        default=None,
+                        metavar='PATTERN',
+                        help="query parameter (with * wildcards) removed from canonical urls, may be repeated "
+                             "(replaces the default tracking and session parameters)")
+    parser.add_argument('--keep_trailing_slash',
+                        action='store_true',
+                        help="keep the trailing slash of canonical url paths")
+    parser.add_argument('--near_duplicates',
+                        type=int,
+                        default=0,
+                        metavar='BITS',
+                        help="do not follow links of pages, which content fingerprint (simhash) differs "
+                             "from an already processed page in at most BITS bits (3 is a good start), 0 to disable")
+    parser.add_argument('--sitemaps',
+                        action='store_true',
+                        help="seed the crawl with the links of the sitemaps listed in robots.txt of the start url "
+                             "(or seeds) hosts, including nested and gzipped ones")
+    parser.add_argument('--resume',
+                        default=None,
+                        metavar='STATE_DIR',
+                        help="save checkpoints of the crawl to the directory and resume from it if it has one")
+    parser.add_argument('--checkpoint_interval',
+                        type=float,
+                        default=60.0,
+                        help="interval between checkpoints of the resumable crawl (in seconds)")
+    parser.add_argument('--cache_dir',
+                        default=None,
+                        help="directory of the render cache, that lets recrawls skip rendering unchanged pages")
+    parser.add_argument('--cache_size',
+                        type=int,
+                        default=1024,
+                        help="maximum size of the render cache (in megabytes)")
+    parser.add_argument('--metrics_port',
+                        type=int,
+                        default=0,
+                        help="serve live metrics in the Prometheus text format on the local port "
+                             "(shard workers use the following ports)")
+    parser.add_argument('--shards',
+                        type=int,
+                        default=1,
+                        help="number of worker processes, each crawling its own partition of hostnames")
+    parser.add_argument('--shard_id',
+                        type=int,
+                        default=None,
+                        help="run only the worker of this shard (to spread the shards over several hosts)")
+    parser.add_argument('--frontier',
+                        default=None,
+                        help="frontier service the shards exchange links through "
+                             "(sqlite:///path or redis://host:port/db, default is sqlite file in results)")
+    parser.add_argument('--merge_shards',
+                        action='store_true',
+                        help="merge the results of the shard folders in results and exit")
     args = parser.parse_args()
+    if args.shard_id is not None and args.frontier is None:
+        parser.error("--shard_id needs a --frontier service shared by all shards")
+    try:
+        strategy, _ = parse_readiness(args.ready)
+    except ValueError as error:
+        parser.error(str(error))
+    # A missing queries file is reported by the crawler
+    if strategy == 'query' and (not args.queries or os.path.isfile(args.queries)):
+        matcher = QueryMatcher.from_file(args.queries) if args.queries else QueryMatcher([args.query])
+        if not matcher.literals:
+            parser.error("--ready query needs a literal query, regex and glob queries can not be awaited")
 
-    # Set crawler settings
-    crawler_settings['CONCURRENT_REQUESTS'] = args.concurrency
-    crawler_settings['LOG_FILE'] = os.path.join(
-        CodeBlockSpider.LOGS_FOLDER,
-        f"{str(urlparse(args.start_point).netloc).replace('.', '_')}.log"
-    )
-
-    # Start crawling
-    CodeBlockSpider.prepare_env()
-
-    process = CrawlerProcess(crawler_settings)
-    process.crawl(
-        CodeBlockSpider, 
-        start_point=args.start_point, 
-        domain_zone=args.domain_zone, 
-        query=args.query, 
-        parsed_links_limit_per_url=args.links_per_url, 
-        max_url_deep_level=args.scraping_deep_level,
-        full_search=args.full_search
-    )
-    process.start()
+    if args.merge_shards:
+        shard_folders = sorted(glob.glob(os.path.join(CodeBlockSpider.RESULTS_FOLDER, "shard_*")))
+        CodeBlockSpider.prepare_env()
+        merge_shard_results(shard_folders, CodeBlockSpider.RESULTS_FOLDER)
+        merge_shard_visited(shard_folders, make_visited_set(
+            args.visited_backend, args.visited_error_rate, CodeBlockSpider.VISITED_FILEPATH
+        ), CodeBlockSpider.RESULTS_FOLDER)
+    elif args.shards > 1 and args.shard_id is None:
+        run_shards(args)
+    else:
+        run_crawler(args, args.shard_id)